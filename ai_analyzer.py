@@ -1,64 +1,281 @@
 import os
-from openai import OpenAI
-from typing import Dict, Any
+import re
+import asyncio
+import httpx
+from openai import OpenAI, AsyncOpenAI, APIStatusError
+from typing import Dict, Any, List, Optional, Tuple, Union, AsyncIterator
 import json
+from async_database import adb
+from cache import AnalysisCache, VacancyProfileCache, merge_popular_titles
+from rate_limiter import openai_limiter
+from prefilter import score_resumes, prefilter_mask
 
-client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+OPENAI_MODEL = os.getenv('OPENAI_MODEL', 'gpt-4o-mini')
+# Адрес API (например, локальная заглушка fake_openai.py для тестов без сети)
+OPENAI_BASE_URL = os.getenv('OPENAI_BASE_URL') or None
+# Сколько запросов к OpenAI одновременно может быть в полёте на один процесс
+OPENAI_MAX_CONCURRENCY = int(os.getenv('OPENAI_MAX_CONCURRENCY', 32))
+# Таймаут одного запроса (секунды)
+OPENAI_TIMEOUT = float(os.getenv('OPENAI_TIMEOUT', 60))
+# Сколько раз повторить запрос после ответа 429 (пауза по Retry-After общая для всех)
+OPENAI_RATE_RETRIES = int(os.getenv('OPENAI_RATE_RETRIES', 2))
+# Цена модели за 1M токенов в долларах (для оценки стоимости в /api/metrics и бенчмарке)
+OPENAI_PRICE_INPUT = float(os.getenv('OPENAI_PRICE_INPUT', 0.15))
+OPENAI_PRICE_OUTPUT = float(os.getenv('OPENAI_PRICE_OUTPUT', 0.60))
+# Пакетный анализ: резюме в одном запросе и ограничение длины пакета (символы)
+ANALYSIS_BATCH_SIZE = int(os.getenv('ANALYSIS_BATCH_SIZE', 10))
+ANALYSIS_BATCH_MAX_CHARS = int(os.getenv('ANALYSIS_BATCH_MAX_CHARS', 60000))
+# Максимум токенов резюме в промпте: длиннее — сжимаем, свежий опыт сохраняем первым
+RESUME_TOKEN_BUDGET = int(os.getenv('RESUME_TOKEN_BUDGET', 3000))
+# Прогрев кэша профилей: сколько самых частых названий вакансий держать готовыми (0 — не прогревать)
+VACANCY_PROFILE_PREWARM_TOP = int(os.getenv('VACANCY_PROFILE_PREWARM_TOP', 30))
 
-def format_resume_for_analysis(full_resume: Dict[str, Any]) -> str:
-    """Форматирует резюме из HH.ru в читаемый текст"""
-    text = ""
+client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'), base_url=OPENAI_BASE_URL)
+
+# Асинхронный клиент с пулом keep-alive соединений.
+# Повторы после 429/503 делаем сами через openai_limiter, чтобы паузу соблюдали все запросы
+async_client = AsyncOpenAI(
+    api_key=os.getenv('OPENAI_API_KEY'),
+    base_url=OPENAI_BASE_URL,
+    timeout=OPENAI_TIMEOUT,
+    max_retries=0,
+    http_client=httpx.AsyncClient(
+        timeout=OPENAI_TIMEOUT,
+        limits=httpx.Limits(
+            max_connections=OPENAI_MAX_CONCURRENCY,
+            max_keepalive_connections=OPENAI_MAX_CONCURRENCY
+        )
+    )
+)
+
+# Глобальное ограничение числа одновременных запросов
+_openai_semaphore = asyncio.Semaphore(OPENAI_MAX_CONCURRENCY)
+
+SYSTEM_PROMPT = "Ты HR-эксперт. Отвечай только валидным JSON."
+
+# Версия промпта анализа: увеличить при изменении промпта, чтобы сбросить кэш
+ANALYSIS_PROMPT_VERSION = "1"
+
+# Кэш результатов анализа (модель работает с temperature=0.0)
+analysis_cache = AnalysisCache(adb)
+
+# Версия промпта профиля вакансии: увеличить при изменении промпта, чтобы сбросить кэш
+VACANCY_PROFILE_PROMPT_VERSION = "1"
+
+# Кэш профилей вакансий по нормализованному названию
+vacancy_profile_cache = VacancyProfileCache(adb)
+
+# Популярные названия для прогрева, пока своих вакансий в базе мало
+POPULAR_VACANCY_TITLES = [
+    "Python Developer", "Java Developer", "Frontend Developer", "Backend Developer",
+    "DevOps Engineer", "QA Engineer", "Data Analyst", "Product Manager", "Project Manager",
+    "Менеджер по продажам", "Бухгалтер", "HR-менеджер", "Маркетолог", "Менеджер по работе с клиентами",
+    "Системный администратор", "Бизнес-аналитик", "Дизайнер", "Офис-менеджер", "Программист 1С", "Юрист"
+]
+
+# Расход токенов асинхронными запросами (с момента запуска процесса)
+usage_stats = {"requests": 0, "prompt_tokens": 0, "completion_tokens": 0,
+               "resume_tokens_before": 0, "resume_tokens_after": 0, "prefiltered": 0}
+
+def estimate_cost(prompt_tokens: int, completion_tokens: int) -> float:
+    """Стоимость запросов в долларах по ценам OPENAI_PRICE_*"""
+    return (prompt_tokens * OPENAI_PRICE_INPUT + completion_tokens * OPENAI_PRICE_OUTPUT) / 1_000_000
+
+def get_usage_stats() -> Dict[str, Any]:
+    """Счётчики запросов и токенов с оценкой стоимости"""
+    return {
+        **usage_stats,
+        "cost_usd": round(estimate_cost(usage_stats["prompt_tokens"], usage_stats["completion_tokens"]), 6)
+    }
+
+# === БЮДЖЕТ ТОКЕНОВ ===
+
+# Точный подсчёт токенов, если установлен tiktoken (pip install tiktoken), иначе оценка
+try:
+    import tiktoken
+    try:
+        _encoding = tiktoken.encoding_for_model(OPENAI_MODEL)
+    except KeyError:
+        _encoding = tiktoken.get_encoding("o200k_base")
+except Exception:
+    _encoding = None
+
+# Служебные строки, которые не помогают оценке кандидата
+BOILERPLATE_PATTERNS = [re.compile(pattern, re.IGNORECASE) for pattern in (
+    r"^(страница|стр\.?|page)\s*\d+(\s*(из|of|/)\s*\d+)?$",
+    r"^\d+\s*(/|из)\s*\d+$",
+    r"^резюме (обновлено|размещено).*$",
+    r"^.*(согласи[ея]|даю согласие) на обработку персональных данных.*$",
+    r"^(сгенерировано|создано|загружено) (с помощью|на|через) .*$",
+    r"^https?://\S+$",
+)]
+
+RESUME_TRUNCATED_MARKER = "[…резюме сокращено]"
+
+def count_tokens(text: str) -> int:
+    """Число токенов в тексте (без tiktoken — примерно 4 символа на токен)"""
+    if not text:
+        return 0
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return max(1, len(text) // 4)
+
+def _strip_html(text: str) -> str:
+    return re.sub(r'<[^>]+>', '', text.replace('<', ' <').replace('>', '> '))
+
+def _normalize_whitespace(text: str) -> str:
+    """Схлопнуть пробелы внутри строк и пустые строки подряд"""
+    lines = [re.sub(r'[ \t ]+', ' ', line).strip() for line in text.splitlines()]
+    return re.sub(r'\n{3,}', '\n\n', '\n'.join(lines)).strip()
+
+def _remove_boilerplate_and_duplicates(text: str) -> str:
+    """Убрать колонтитулы и служебные строки, повторы абзацев и длинных строк"""
+    seen_paragraphs, seen_lines = set(), set()
+    paragraphs = []
+    for paragraph in text.split('\n\n'):
+        lines = []
+        for line in paragraph.split('\n'):
+            if any(pattern.match(line) for pattern in BOILERPLATE_PATTERNS):
+                continue
+            # Короткие строки («Обязанности:») повторяются законно, длинные — копии
+            key = line.lower()
+            if len(line) >= 30:
+                if key in seen_lines:
+                    continue
+                seen_lines.add(key)
+            lines.append(line)
+        paragraph = '\n'.join(lines).strip()
+        if paragraph and paragraph.lower() not in seen_paragraphs:
+            seen_paragraphs.add(paragraph.lower())
+            paragraphs.append(paragraph)
+    return '\n\n'.join(paragraphs)
+
+def _cut_to_tokens(text: str, max_tokens: int) -> str:
+    """Начало текста не длиннее max_tokens токенов"""
+    if max_tokens <= 0:
+        return ""
+    while count_tokens(text) > max_tokens:
+        text = text[:len(text) * max_tokens // count_tokens(text) - 1]
+    return text
+
+def _truncate_to_budget(text: str, budget: int) -> str:
+    """Оставить начало текста (свежий опыт обычно сверху) в пределах budget токенов"""
+    budget -= count_tokens(RESUME_TRUNCATED_MARKER) + 1
+    kept, used = [], 0
+    for line in text.split('\n'):
+        line_tokens = count_tokens(line) + 1
+        if used + line_tokens > budget:
+            # Строка не помещается целиком: оставляем её начало
+            kept.append(_cut_to_tokens(line, budget - used - 1))
+            break
+        kept.append(line)
+        used += line_tokens
+    return '\n'.join(kept).rstrip() + '\n' + RESUME_TRUNCATED_MARKER
+
+def compact_resume(text: str, token_budget: int = None) -> Tuple[str, Dict[str, int]]:
+    """
+    Сжать текст резюме перед отправкой в модель
+    
+    Схлопывает пробелы, убирает колонтитулы и служебные строки, повторы
+    и при необходимости обрезает до бюджета токенов.
+    
+    Returns:
+        (сжатый текст, {"before": токенов до, "after": токенов после})
+    """
+    budget = token_budget or RESUME_TOKEN_BUDGET
+    tokens_before = count_tokens(text)
+    compacted = _remove_boilerplate_and_duplicates(_normalize_whitespace(text or ''))
+    if count_tokens(compacted) > budget:
+        compacted = _truncate_to_budget(compacted, budget)
+    return compacted, {"before": tokens_before, "after": count_tokens(compacted)}
+
+def _with_resume_tokens(result: Dict[str, Any], tokens: Dict[str, int]) -> Dict[str, Any]:
+    """Результат анализа с числом токенов резюме до и после сжатия"""
+    return {**result, "resume_tokens": tokens}
+
+def format_resume_for_analysis(full_resume: Dict[str, Any], token_budget: int = None) -> str:
+    """
+    Форматирует резюме из HH.ru в читаемый текст
     
+    Опыт работы — от свежего к старому; если задан token_budget и описания в него
+    не помещаются, сокращаются описания самых старых мест работы.
+    """
     if not full_resume:
         return "Нет данных для анализа."
     
-    # Опыт работы
-    if full_resume.get('experience'):
-        text += "Опыт работы:\n"
-        for exp in full_resume['experience']:
-            text += f"- {exp.get('position', '')} в {exp.get('company', '')} "
-            text += f"({exp.get('start', '')} - {exp.get('end', 'н.в.')})\n"
-            if exp.get('description'):
-                # Убираем HTML теги
-                desc = exp['description'].replace('<', ' <').replace('>', '> ')
-                import re
-                desc = re.sub('<[^>]+>', '', desc)
-                text += f"  Описание: {desc}\n"
+    tail = ""
     
     # Образование
     if full_resume.get('education', {}).get('primary'):
-        text += "\nОбразование:\n"
+        tail += "\nОбразование:\n"
         for edu in full_resume['education']['primary']:
-            text += f"- {edu.get('name', '')} ({edu.get('year', '')}, {edu.get('result', '')})\n"
+            tail += f"- {edu.get('name', '')} ({edu.get('year', '')}, {edu.get('result', '')})\n"
     
     # Навыки
     if full_resume.get('skill_set'):
-        text += f"\nНавыки: {', '.join(full_resume['skill_set'])}\n"
+        tail += f"\nНавыки: {', '.join(full_resume['skill_set'])}\n"
     
     # Зарплата
     if full_resume.get('salary'):
         amount = full_resume['salary'].get('amount', '')
         currency = full_resume['salary'].get('currency', '')
-        text += f"\nЖелаемая зарплата: {amount} {currency}\n"
+        tail += f"\nЖелаемая зарплата: {amount} {currency}\n"
     
-    return text
+    # Опыт работы
+    text = ""
+    if full_resume.get('experience'):
+        experience = sorted(full_resume['experience'], key=lambda exp: exp.get('start') or '', reverse=True)
+        headers = [
+            f"- {exp.get('position', '')} в {exp.get('company', '')} "
+            f"({exp.get('start', '')} - {exp.get('end') or 'н.в.'})\n"
+            for exp in experience
+        ]
+        text += "Опыт работы:\n"
+        remaining = None if token_budget is None else token_budget - count_tokens(text + "".join(headers) + tail)
+        for exp, header in zip(experience, headers):
+            text += header
+            if exp.get('description') and (remaining is None or remaining > 0):
+                desc = _normalize_whitespace(_strip_html(exp['description']))
+                if remaining is not None:
+                    line_tokens = count_tokens(f"  Описание: {desc}\n")
+                    if line_tokens > remaining:
+                        desc = _cut_to_tokens(desc, remaining - (line_tokens - count_tokens(desc)) - 1).rstrip() + "…"
+                    remaining -= count_tokens(f"  Описание: {desc}\n")
+                text += f"  Описание: {desc}\n"
+    
+    return text + tail
 
-def analyze_resume(resume_text: str, criteria: str = None) -> Dict[str, Any]:
+def prepare_resume(resume: Union[str, Dict[str, Any], None]) -> Tuple[str, Dict[str, int]]:
     """
-    Анализирует резюме через OpenAI С ПОДСЧЁТОМ СОВПАДЕНИЙ
+    Текст резюме для промпта в пределах RESUME_TOKEN_BUDGET
     
     Args:
-        resume_text: Текст резюме
-        criteria: Критерии оценки (опционально)
+        resume: Текст резюме (из файла) или объект резюме HH.ru
     
     Returns:
-        Dict с verdict, reason, matches_count, matched_criteria
+        (текст, {"before": токенов до сжатия, "after": токенов после})
     """
+    if resume is None or isinstance(resume, dict):
+        text = format_resume_for_analysis(resume)
+        tokens_before = count_tokens(text)
+        if tokens_before > RESUME_TOKEN_BUDGET:
+            # Сокращаем описания старых мест работы, а не образование и навыки в конце
+            text = format_resume_for_analysis(resume, RESUME_TOKEN_BUDGET)
+        text, tokens = compact_resume(text)
+        tokens["before"] = tokens_before
+    else:
+        text, tokens = compact_resume(resume)
     
+    usage_stats["resume_tokens_before"] += tokens["before"]
+    usage_stats["resume_tokens_after"] += tokens["after"]
+    return text, tokens
+
+def _build_analysis_prompt(resume_text: str, criteria: str = None) -> str:
+    """Промпт для анализа резюме по критериям"""
     if not criteria:
         criteria = "Оцени кандидата на адекватность и соответствие стандартным требованиям."
     
-    prompt = f"""Ты HR-эксперт. Анализируй СТРОГО по критериям.
+    return f"""Ты HR-эксперт. Анализируй СТРОГО по критериям.
 
 ПРАВИЛО: Из всех критериев должно совпадать НЕ МЕНЕЕ 3. Иначе — "Не подходит".
 
@@ -78,43 +295,188 @@ def analyze_resume(resume_text: str, criteria: str = None) -> Dict[str, Any]:
 
 Важно: Отвечай ТОЛЬКО JSON, без дополнительного текста."""
 
+def _parse_analysis_result(result: Dict[str, Any]) -> Dict[str, Any]:
+    """Привести ответ модели к формату анализа"""
+    # Проверка минимум 3 совпадения
+    matches = int(result.get("matches_count") or 0)
+    if matches < 3 and result.get("verdict") == "Подходит":
+        result["verdict"] = "Не подходит"
+        result["reason"] = f"Недостаточно совпадений критериев ({matches}/3 минимум)"
+    
+    return {
+        "status": "success",
+        "verdict": result.get("verdict", "Не определено"),
+        "reason": result.get("reason", ""),
+        "matches_count": matches,
+        "matched_criteria": result.get("matched_criteria", [])
+    }
+
+def _analysis_error(e: Exception) -> Dict[str, Any]:
+    """Результат анализа при ошибке"""
+    return {
+        "status": "error",
+        "error": str(e),
+        "verdict": "Ошибка",
+        "reason": str(e),
+        "matches_count": 0,
+        "matched_criteria": []
+    }
+
+def _prefiltered_result(matched: int, total: int) -> Dict[str, Any]:
+    """Вердикт без запроса к модели: резюме почти не пересекается с критериями"""
+    return {
+        "status": "success",
+        "verdict": "Не подходит",
+        "reason": f"Резюме почти не совпадает с критериями вакансии (ключевых терминов: {matched} из {total})",
+        "matches_count": 0,
+        "matched_criteria": [],
+        "prefiltered": True
+    }
+
+def _prefilter(resume_texts: List[str], criteria: str = None) -> Tuple[List[Optional[Dict[str, Any]]], List[float]]:
+    """
+    Локальный отсев очевидно неподходящих резюме (BM25 по терминам критериев)
+    
+    Returns:
+        (вердикт для отсеянных или None, BM25 каждого резюме для ранжирования)
+    """
+    if not criteria:
+        return [None] * len(resume_texts), [0.0] * len(resume_texts)
+    scores = score_resumes(resume_texts, criteria)
+    rejected = prefilter_mask(scores)
+    usage_stats["prefiltered"] += int(rejected.sum())
+    results = [
+        _prefiltered_result(int(scores.matched[i]), len(scores.terms)) if rejected[i] else None
+        for i in range(len(resume_texts))
+    ]
+    return results, scores.bm25.tolist()
+
+def _cached_result(result: Dict[str, Any]) -> Dict[str, Any]:
+    """Копия результата из кэша с пометкой"""
+    result = dict(result)
+    result["cached"] = True
+    return result
+
+def _messages(prompt: str) -> List[Dict[str, str]]:
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": prompt}
+    ]
+
+async def _chat_json_async(prompt: str, temperature: float, timeout: float = None,
+                           user_id: str = None) -> Dict[str, Any]:
+    """
+    Запрос к OpenAI, ответ — JSON
+    
+    Сначала ждём очереди в openai_limiter (по кругу между user_id), затем слот семафора.
+    """
+    for attempt in range(OPENAI_RATE_RETRIES + 1):
+        await openai_limiter.acquire(user_id)
+        try:
+            async with _openai_semaphore:
+                response = await async_client.chat.completions.create(
+                    model=OPENAI_MODEL,
+                    messages=_messages(prompt),
+                    temperature=temperature,
+                    response_format={"type": "json_object"},
+                    timeout=timeout or OPENAI_TIMEOUT
+                )
+        except APIStatusError as e:
+            # 429 и 503 (перегрузка): пауза по Retry-After для всех запросов и повтор
+            if e.status_code not in (429, 503):
+                raise
+            openai_limiter.observe(e.status_code, e.response.headers)
+            if attempt == OPENAI_RATE_RETRIES:
+                raise
+            continue
+        usage_stats["requests"] += 1
+        if response.usage:
+            usage_stats["prompt_tokens"] += response.usage.prompt_tokens
+            usage_stats["completion_tokens"] += response.usage.completion_tokens
+        return json.loads(response.choices[0].message.content)
+
+def _analyze_prepared(resume_text: str, tokens: Dict[str, int], criteria: str = None) -> Dict[str, Any]:
+    """Анализ подготовленного (сжатого) текста резюме: отсев, кэш, запрос к модели"""
+    rejected = _prefilter([resume_text], criteria)[0][0]
+    if rejected is not None:
+        return _with_resume_tokens(rejected, tokens)
+    
+    cache_key = AnalysisCache.make_key(resume_text, criteria, OPENAI_MODEL, ANALYSIS_PROMPT_VERSION)
+    cached = analysis_cache.get(cache_key)
+    if cached is not None:
+        return _with_resume_tokens(_cached_result(cached), tokens)
+    
+    prompt = _build_analysis_prompt(resume_text, criteria)
+
     try:
         response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": "Ты HR-эксперт. Отвечай только валидным JSON."},
-                {"role": "user", "content": prompt}
-            ],
+            model=OPENAI_MODEL,
+            messages=_messages(prompt),
             temperature=0.0,
             response_format={"type": "json_object"}
         )
         
         result_text = response.choices[0].message.content
-        result = json.loads(result_text)
-        
-        # Проверка минимум 3 совпадения
-        matches = result.get("matches_count", 0)
-        if matches < 3 and result.get("verdict") == "Подходит":
-            result["verdict"] = "Не подходит"
-            result["reason"] = f"Недостаточно совпадений критериев ({matches}/3 минимум)"
-        
-        return {
-            "status": "success",
-            "verdict": result.get("verdict", "Не определено"),
-            "reason": result.get("reason", ""),
-            "matches_count": matches,
-            "matched_criteria": result.get("matched_criteria", [])
-        }
+        result = _parse_analysis_result(json.loads(result_text))
         
     except Exception as e:
-        return {
-            "status": "error",
-            "error": str(e),
-            "verdict": "Ошибка",
-            "reason": str(e),
-            "matches_count": 0,
-            "matched_criteria": []
-        }
+        return _analysis_error(e)
+    
+    analysis_cache.put(cache_key, result, OPENAI_MODEL, ANALYSIS_PROMPT_VERSION)
+    return _with_resume_tokens(result, tokens)
+
+async def _analyze_prepared_async(resume_text: str, tokens: Dict[str, int], criteria: str = None,
+                                  timeout: float = None, user_id: str = None) -> Dict[str, Any]:
+    """Асинхронный анализ подготовленного (сжатого) текста резюме: отсев, кэш, запрос к модели"""
+    rejected = _prefilter([resume_text], criteria)[0][0]
+    if rejected is not None:
+        return _with_resume_tokens(rejected, tokens)
+    
+    cache_key = AnalysisCache.make_key(resume_text, criteria, OPENAI_MODEL, ANALYSIS_PROMPT_VERSION)
+    cached = await analysis_cache.aget(cache_key)
+    if cached is not None:
+        return _with_resume_tokens(_cached_result(cached), tokens)
+    
+    prompt = _build_analysis_prompt(resume_text, criteria)
+
+    try:
+        result = _parse_analysis_result(
+            await _chat_json_async(prompt, temperature=0.0, timeout=timeout, user_id=user_id)
+        )
+    except Exception as e:
+        return _analysis_error(e)
+    
+    await analysis_cache.aput(cache_key, result, OPENAI_MODEL, ANALYSIS_PROMPT_VERSION)
+    return _with_resume_tokens(result, tokens)
+
+def analyze_resume(resume_text: str, criteria: str = None) -> Dict[str, Any]:
+    """
+    Анализирует резюме через OpenAI С ПОДСЧЁТОМ СОВПАДЕНИЙ
+    
+    Args:
+        resume_text: Текст резюме (перед отправкой сжимается до RESUME_TOKEN_BUDGET)
+        criteria: Критерии оценки (опционально)
+    
+    Returns:
+        Dict с verdict, reason, matches_count, matched_criteria, resume_tokens
+    """
+    return _analyze_prepared(*prepare_resume(resume_text), criteria)
+
+async def analyze_resume_async(resume_text: str, criteria: str = None, timeout: float = None,
+                               user_id: str = None) -> Dict[str, Any]:
+    """
+    Асинхронная версия analyze_resume: не блокирует event loop
+    
+    Args:
+        resume_text: Текст резюме (перед отправкой сжимается до RESUME_TOKEN_BUDGET)
+        criteria: Критерии оценки (опционально)
+        timeout: Таймаут запроса в секундах (по умолчанию OPENAI_TIMEOUT)
+        user_id: Чья очередь в лимитере запросов к OpenAI
+    
+    Returns:
+        Dict с verdict, reason, matches_count, matched_criteria, resume_tokens
+    """
+    return await _analyze_prepared_async(*prepare_resume(resume_text), criteria, timeout=timeout, user_id=user_id)
 
 def analyze_resume_from_hh(full_resume: Dict[str, Any], criteria: str = None) -> Dict[str, Any]:
     """
@@ -127,21 +489,140 @@ def analyze_resume_from_hh(full_resume: Dict[str, Any], criteria: str = None) ->
     Returns:
         Dict с результатами анализа
     """
-    resume_text = format_resume_for_analysis(full_resume)
-    return analyze_resume(resume_text, criteria)
+    return _analyze_prepared(*prepare_resume(full_resume), criteria)
 
-def generate_vacancy_profile(vacancy_title: str) -> Dict[str, Any]:
+async def analyze_resume_from_hh_async(full_resume: Dict[str, Any], criteria: str = None,
+                                       user_id: str = None) -> Dict[str, Any]:
+    """Асинхронная версия analyze_resume_from_hh"""
+    return await _analyze_prepared_async(*prepare_resume(full_resume), criteria, user_id=user_id)
+
+# === ПАКЕТНЫЙ АНАЛИЗ ===
+
+def _build_batch_analysis_prompt(resumes: List[Tuple[str, str]], criteria: str = None) -> str:
+    """Промпт для анализа нескольких резюме по одним критериям (resumes — пары id, текст)"""
+    if not criteria:
+        criteria = "Оцени кандидата на адекватность и соответствие стандартным требованиям."
+    
+    candidates = "\n\n".join(f"### Кандидат id={resume_id}\n{text}" for resume_id, text in resumes)
+    
+    return f"""Ты HR-эксперт. Анализируй СТРОГО по критериям каждого кандидата отдельно.
+
+ПРАВИЛО: Из всех критериев должно совпадать НЕ МЕНЕЕ 3. Иначе — "Не подходит".
+
+Критерии вакансии:
+{criteria}
+
+Резюме кандидатов:
+
+{candidates}
+
+Верни СТРОГО JSON, по одному объекту на каждого кандидата:
+{{
+    "results": [
+        {{
+            "id": "id кандидата",
+            "verdict": "Подходит" или "Не подходит",
+            "reason": "Одно короткое предложение (главный аргумент)",
+            "matches_count": число_совпавших_критериев,
+            "matched_criteria": ["критерий 1", "критерий 2", ...]
+        }}
+    ]
+}}
+
+Важно: Отвечай ТОЛЬКО JSON, без дополнительного текста."""
+
+BatchItem = Tuple[int, str, Dict[str, int]]
+
+def _split_batches(items: List[BatchItem], batch_size: int, max_chars: int) -> List[List[BatchItem]]:
+    """Разбить резюме (индекс, текст, токены) на пакеты не больше batch_size штук и max_chars символов"""
+    batches, current, current_chars = [], [], 0
+    for item in items:
+        text = item[1]
+        if current and (len(current) >= batch_size or current_chars + len(text) > max_chars):
+            batches.append(current)
+            current, current_chars = [], 0
+        current.append(item)
+        current_chars += len(text)
+    if current:
+        batches.append(current)
+    return batches
+
+async def _analyze_batch(batch: List[BatchItem], criteria: str, timeout: float = None,
+                         user_id: str = None) -> List[Tuple[int, Dict[str, Any]]]:
+    """Один запрос к OpenAI на пакет; кого модель пропустила — анализируем по одному"""
+    prompt = _build_batch_analysis_prompt([(str(n), text) for n, (_, text, _) in enumerate(batch)], criteria)
+    try:
+        response = await _chat_json_async(prompt, temperature=0.0, timeout=timeout, user_id=user_id)
+        by_id = {str(item.get("id")): item for item in response.get("results", []) if isinstance(item, dict)}
+    except Exception as e:
+        print(f"⚠️ Пакетный анализ ({len(batch)} резюме) не удался, анализируем по одному: {e}")
+        by_id = {}
+    
+    results = []
+    for n, (index, text, tokens) in enumerate(batch):
+        item = by_id.get(str(n))
+        result = None
+        if item is not None:
+            try:
+                result = _parse_analysis_result(item)
+            except Exception as e:
+                # Битый ответ по одному резюме не должен ронять весь пакет
+                print(f"⚠️ Пакетный анализ: некорректный результат для резюме {index}, анализируем отдельно: {e}")
+        if result is None:
+            results.append((index, await _analyze_prepared_async(text, tokens, criteria, timeout, user_id)))
+            continue
+        cache_key = AnalysisCache.make_key(text, criteria, OPENAI_MODEL, ANALYSIS_PROMPT_VERSION)
+        await analysis_cache.aput(cache_key, result, OPENAI_MODEL, ANALYSIS_PROMPT_VERSION)
+        results.append((index, _with_resume_tokens(result, tokens)))
+    return results
+
+async def analyze_resumes_batch_async(resumes: List[Union[str, Dict[str, Any]]], criteria: str = None,
+                                      timeout: float = None, user_id: str = None, batch_size: int = None
+                                      ) -> AsyncIterator[Tuple[int, Dict[str, Any]]]:
     """
-    Генерирует профиль вакансии (hard/soft skills, критерии)
+    Анализ многих резюме по одним критериям: несколько резюме в одном запросе к OpenAI
+    
+    Критерии и инструкции отправляются один раз на пакет, а не на каждое резюме.
+    Очевидно неподходящие резюме отсеиваются локально (prefilter.py), остальные
+    уходят в модель от самых релевантных по BM25 к менее релевантным.
     
     Args:
-        vacancy_title: Название вакансии (например "Python Developer")
+        resumes: Тексты резюме или объекты резюме HH.ru
+        criteria: Критерии вакансии
+        batch_size: Резюме в одном запросе (по умолчанию ANALYSIS_BATCH_SIZE)
     
-    Returns:
-        Dict с hard_skills, soft_skills, criteria, description
+    Yields:
+        (индекс резюме, результат анализа) — по мере готовности пакетов
     """
+    prepared = [prepare_resume(resume) for resume in resumes]
+    rejected, relevance = _prefilter([text for text, _ in prepared], criteria)
     
-    prompt = f"""Ты HR-эксперт. Создай профиль вакансии по названию должности.
+    pending = []
+    for index, (text, tokens) in enumerate(prepared):
+        if rejected[index] is not None:
+            yield index, _with_resume_tokens(rejected[index], tokens)
+            continue
+        cache_key = AnalysisCache.make_key(text, criteria, OPENAI_MODEL, ANALYSIS_PROMPT_VERSION)
+        cached = await analysis_cache.aget(cache_key)
+        if cached is not None:
+            yield index, _with_resume_tokens(_cached_result(cached), tokens)
+        else:
+            pending.append((index, text, tokens))
+    pending.sort(key=lambda item: relevance[item[0]], reverse=True)
+    
+    batches = _split_batches(pending, batch_size or ANALYSIS_BATCH_SIZE, ANALYSIS_BATCH_MAX_CHARS)
+    tasks = [asyncio.create_task(_analyze_batch(batch, criteria, timeout, user_id)) for batch in batches]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            for index, result in await next_done:
+                yield index, result
+    finally:
+        for task in tasks:
+            task.cancel()
+
+def _build_vacancy_prompt(vacancy_title: str) -> str:
+    """Промпт для генерации профиля вакансии"""
+    return f"""Ты HR-эксперт. Создай профиль вакансии по названию должности.
 
 Вакансия: {vacancy_title}
 
@@ -155,37 +636,118 @@ def generate_vacancy_profile(vacancy_title: str) -> Dict[str, Any]:
 
 Важно: hard_skills через запятую (до 10 штук), soft_skills через запятую (до 5 штук), criteria — конкретные требования для AI-анализа."""
 
+def _parse_vacancy_profile(result: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "status": "success",
+        "hard_skills": result.get("hard_skills", ""),
+        "soft_skills": result.get("soft_skills", ""),
+        "description": result.get("description", ""),
+        "criteria": result.get("criteria", "")
+    }
+
+def _vacancy_profile_error(e: Exception) -> Dict[str, Any]:
+    return {
+        "status": "error",
+        "error": str(e),
+        "hard_skills": "",
+        "soft_skills": "",
+        "description": "",
+        "criteria": ""
+    }
+
+def generate_vacancy_profile(vacancy_title: str) -> Dict[str, Any]:
+    """
+    Генерирует профиль вакансии (hard/soft skills, критерии)
+    
+    Args:
+        vacancy_title: Название вакансии (например "Python Developer")
+    
+    Returns:
+        Dict с hard_skills, soft_skills, criteria, description
+    """
+    cache_key = vacancy_profile_cache.make_key(vacancy_title, OPENAI_MODEL, VACANCY_PROFILE_PROMPT_VERSION)
+    cached = vacancy_profile_cache.get(cache_key)
+    if cached is not None:
+        # Копия: изменения у вызывающего не должны попасть в общий кэш
+        return dict(cached)
+
+    prompt = _build_vacancy_prompt(vacancy_title)
+
     try:
         response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": "Ты HR-эксперт. Отвечай только валидным JSON."},
-                {"role": "user", "content": prompt}
-            ],
+            model=OPENAI_MODEL,
+            messages=_messages(prompt),
             temperature=0.3,
             response_format={"type": "json_object"}
         )
         
         result_text = response.choices[0].message.content
-        result = json.loads(result_text)
-        
-        return {
-            "status": "success",
-            "hard_skills": result.get("hard_skills", ""),
-            "soft_skills": result.get("soft_skills", ""),
-            "description": result.get("description", ""),
-            "criteria": result.get("criteria", "")
-        }
+        profile = _parse_vacancy_profile(json.loads(result_text))
         
     except Exception as e:
-        return {
-            "status": "error",
-            "error": str(e),
-            "hard_skills": "",
-            "soft_skills": "",
-            "description": "",
-            "criteria": ""
-        }
+        return _vacancy_profile_error(e)
+
+    vacancy_profile_cache.put(cache_key, vacancy_title, profile, OPENAI_MODEL, VACANCY_PROFILE_PROMPT_VERSION)
+    return dict(profile)
+
+async def generate_vacancy_profile_async(vacancy_title: str, timeout: float = None,
+                                         user_id: str = None) -> Dict[str, Any]:
+    """Асинхронная версия generate_vacancy_profile"""
+    cache_key = vacancy_profile_cache.make_key(vacancy_title, OPENAI_MODEL, VACANCY_PROFILE_PROMPT_VERSION)
+    cached = await vacancy_profile_cache.aget(cache_key)
+    if cached is not None:
+        return dict(cached)
+
+    prompt = _build_vacancy_prompt(vacancy_title)
+
+    try:
+        result = await _chat_json_async(prompt, temperature=0.3, timeout=timeout, user_id=user_id)
+        profile = _parse_vacancy_profile(result)
+    except Exception as e:
+        return _vacancy_profile_error(e)
+
+    await vacancy_profile_cache.aput(cache_key, vacancy_title, profile, OPENAI_MODEL, VACANCY_PROFILE_PROMPT_VERSION)
+    return dict(profile)
+
+async def prewarm_vacancy_profiles(top: int = VACANCY_PROFILE_PREWARM_TOP,
+                                   titles: List[str] = None) -> Dict[str, int]:
+    """
+    Прогреть кэш профилей вакансий
+    
+    Загружает востребованные профили из БД в память и генерирует недостающие
+    для самых частых названий (вакансии пользователей, запросы профилей, POPULAR_VACANCY_TITLES).
+    Запросы идут через общий лимитер OpenAI под ключом "prewarm" и не задерживают пользователей.
+    
+    Returns:
+        Dict с числом загруженных в память, уже готовых, сгенерированных профилей и ошибок
+    """
+    summary = {"loaded": await vacancy_profile_cache.load_hot(), "cached": 0, "generated": 0, "errors": 0}
+    await vacancy_profile_cache.evict()
+    
+    if titles is None:
+        rows = await adb.get_popular_vacancy_titles(top * 5)
+        rows += [{"title": title, "uses": 0} for title in POPULAR_VACANCY_TITLES]
+        titles = merge_popular_titles(rows, top)
+    
+    async def warm(title: str):
+        cache_key = vacancy_profile_cache.make_key(title, OPENAI_MODEL, VACANCY_PROFILE_PROMPT_VERSION)
+        if await vacancy_profile_cache.contains(cache_key):
+            summary["cached"] += 1
+            return
+        profile = await generate_vacancy_profile_async(title, user_id="prewarm")
+        summary["generated" if profile["status"] == "success" else "errors"] += 1
+    
+    await asyncio.gather(*(warm(title) for title in titles))
+    return summary
+
+async def close_async_client():
+    """Закрыть пул соединений асинхронного клиента (при остановке приложения)"""
+    await async_client.close()
 
 # Экспорт функций
-__all__ = ['analyze_resume', 'analyze_resume_from_hh', 'format_resume_for_analysis', 'generate_vacancy_profile']
\ No newline at end of file
+__all__ = [
+    'analyze_resume', 'analyze_resume_from_hh', 'format_resume_for_analysis', 'generate_vacancy_profile',
+    'analyze_resume_async', 'analyze_resume_from_hh_async', 'generate_vacancy_profile_async', 'close_async_client',
+    'analyze_resumes_batch_async', 'analysis_cache', 'get_usage_stats', 'estimate_cost',
+    'count_tokens', 'compact_resume', 'prepare_resume', 'vacancy_profile_cache', 'prewarm_vacancy_profiles'
+]
\ No newline at end of file
@@ -0,0 +1,54 @@
+import os
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+from database import Database, db
+
+# Размер пула потоков для чтения (каждый поток держит своё соединение)
+DB_READ_POOL_SIZE = int(os.getenv('DB_READ_POOL_SIZE', 4))
+
+# Методы Database, которые пишут в базу: выполняются в отдельном потоке по одному,
+# чтобы тяжёлая запись не занимала потоки чтения (SQLite всё равно пишет последовательно)
+# Методы get_* только читают: отметки использования кэшей вынесены в touch_*
+WRITE_PREFIXES = ('save_', 'create_', 'update_', 'delete_', 'evict_', 'claim_', 'finish_', 'fail_', 'requeue_',
+                  'touch_')
+
+
+class AsyncDatabase:
+    """Асинхронная обёртка над Database: запросы выполняются вне event loop"""
+
+    def __init__(self, database: Database, read_pool_size: int = DB_READ_POOL_SIZE):
+        self.database = database
+        self._read_executor = ThreadPoolExecutor(max_workers=read_pool_size, thread_name_prefix='db-read')
+        self._write_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='db-write')
+
+    async def run(self, func: Callable, *args, write: bool = False, **kwargs) -> Any:
+        """Выполнить синхронную функцию в пуле потоков базы данных"""
+        executor = self._write_executor if write else self._read_executor
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, functools.partial(func, *args, **kwargs))
+
+    def __getattr__(self, name: str):
+        attr = getattr(self.database, name)
+        if not callable(attr):
+            return attr
+
+        write = name.startswith(WRITE_PREFIXES)
+
+        @functools.wraps(attr)
+        async def wrapper(*args, **kwargs):
+            return await self.run(attr, *args, write=write, **kwargs)
+
+        return wrapper
+
+    def shutdown(self):
+        """Дождаться текущих запросов и закрыть соединения"""
+        self._write_executor.shutdown(wait=True)
+        self._read_executor.shutdown(wait=True)
+        self.database.close()
+
+
+# Глобальный экземпляр для обработчиков FastAPI
+adb = AsyncDatabase(db)
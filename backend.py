@@ -6,54 +6,127 @@ load_dotenv()
 
 # КОНСТАНТЫ
 BACKEND_URL = os.getenv('WEBAPP_URL', 'https://zhenayozari-hr-assistant-bot-9ea4.twc1.net')
+# Сколько резюме из пакета анализируются одновременно
+BULK_ANALYSIS_CONCURRENCY = int(os.getenv('BULK_ANALYSIS_CONCURRENCY', 8))
+# Максимум файлов в одной пакетной загрузке
+BULK_UPLOAD_MAX_FILES = int(os.getenv('BULK_UPLOAD_MAX_FILES', 500))
+# Списки кандидатов: порция чтения из БД и максимальный размер страницы
+CANDIDATES_CHUNK_SIZE = int(os.getenv('CANDIDATES_CHUNK_SIZE', 200))
+CANDIDATES_MAX_PAGE = int(os.getenv('CANDIDATES_MAX_PAGE', 1000))
+# Прогрев профилей вакансий выполняет один воркер; блокировка истекает, если он упал (секунды)
+VACANCY_PROFILE_PREWARM_LOCK_SECONDS = float(os.getenv('VACANCY_PROFILE_PREWARM_LOCK_SECONDS', 900))
 
 # ПОТОМ импортируем остальное
 from fastapi import FastAPI, HTTPException, Request
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from starlette.background import BackgroundTask
 from fastapi.middleware.cors import CORSMiddleware
-import httpx
 import json
-from database import db
-from ai_analyzer import analyze_resume_from_hh, analyze_resume, generate_vacancy_profile
-from file_parser import parse_resume_file
+import orjson
+import asyncio
+import hashlib
+import socket
+from typing import List, Optional
+from async_database import adb
+from database import CANDIDATE_FIELDS, SEARCH_RANK_WINDOW, encode_cursor, decode_cursor
+from ai_analyzer import (analyze_resume_from_hh_async, analyze_resume_async, generate_vacancy_profile_async,
+                         analyze_resumes_batch_async, format_resume_for_analysis, get_usage_stats,
+                         close_async_client, analysis_cache, vacancy_profile_cache, prewarm_vacancy_profiles,
+                         VACANCY_PROFILE_PREWARM_TOP)
+from file_parser import PARSER_WORKERS, parse_resume_file_async, start_parser_pool, shutdown_parser_pool, is_supported_file, SUPPORTED_FORMAT_ERROR
+from job_queue import job_queue, PermanentJobError
+from email_outbox import email_outbox, EMAIL_BATCH_MAX
+from static_assets import static_assets, BROTLI_AVAILABLE
+from compression import SelectiveGZipMiddleware, GZIP_MIN_SIZE
 from fastapi import UploadFile, File, Form
-from email_service import get_oauth_url, exchange_code_for_token, get_user_email, send_email_via_oauth
-from fastapi.responses import RedirectResponse
+from http_clients import get_client, start_http_clients, close_http_clients
+from hh_cache import hh_cache
+from rate_limiter import hh_limiter, limiters
+from email_service import get_oauth_url, exchange_code_for_token, get_user_email, send_email_via_oauth, token_manager
+from fastapi.responses import RedirectResponse, StreamingResponse, Response, ORJSONResponse
+from contextlib import asynccontextmanager
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Запуск и остановка приложения"""
+    # Прогреваем пул процессов для парсинга PDF/DOCX
+    await asyncio.to_thread(start_parser_pool)
+    # Страницы Mini App читаем и сжимаем один раз
+    files = await asyncio.to_thread(static_assets.load)
+    print(f"✅ Страницы Mini App загружены в память: {files} (brotli: {'да' if BROTLI_AVAILABLE else 'нет'})")
+    # Общие пулы соединений к HH.ru, Google, Яндексу, Mail.ru
+    start_http_clients()
+    # Воркеры фонового анализа загруженных резюме
+    await job_queue.start()
+    # Токены почты обновляются в фоне до истечения
+    token_manager.start()
+    # Фоновая отправка писем из очереди
+    await email_outbox.start()
+    # Профили популярных вакансий готовим в фоне, чтобы не задерживать старт
+    prewarm_task = asyncio.create_task(prewarm_profiles()) if VACANCY_PROFILE_PREWARM_TOP > 0 else None
+    yield
+    if prewarm_task is not None:
+        prewarm_task.cancel()
+    await email_outbox.stop()
+    await token_manager.stop()
+    await job_queue.stop()
+    await close_http_clients()
+    shutdown_parser_pool()
+    # Закрываем соединения с OpenAI
+    await close_async_client()
+    # Закрываем пул потоков и соединения с БД
+    adb.shutdown()
+
+
+async def prewarm_profiles():
+    """Фоновый прогрев кэша профилей вакансий (генерирует один воркер uvicorn, остальные только читают БД)"""
+    owner = f"{socket.gethostname()}:{os.getpid()}"
+    try:
+        if not await adb.claim_app_lock("prewarm_vacancy_profiles", owner, VACANCY_PROFILE_PREWARM_LOCK_SECONDS):
+            loaded = await vacancy_profile_cache.load_hot()
+            print(f"✅ Профили вакансий загружены в память: {loaded} (прогрев выполняет другой воркер)")
+            return
+        try:
+            summary = await prewarm_vacancy_profiles()
+        finally:
+            await asyncio.shield(adb.delete_app_lock("prewarm_vacancy_profiles", owner))
+        print(f"✅ Кэш профилей вакансий прогрет: {summary}")
+    except Exception as e:
+        print(f"⚠️ Прогрев кэша профилей вакансий: {e}")
+
 
-app = FastAPI()
+# Ответы в JSON через orjson. Списки и профили возвращают ORJSONResponse напрямую:
+# так FastAPI не прогоняет их через jsonable_encoder
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 
 # Подключаем статические файлы
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
-# Главная страница - наш тестовый интерфейс
+# Страницы Mini App: из памяти, сжатые, с ETag (static_assets.py)
 @app.get("/test")
-async def test_page():
-    return FileResponse("static/index.html")
+async def test_page(request: Request):
+    return static_assets.response(request, "index.html")
+
 @app.get("/upload")
-async def upload_page():
-    return FileResponse("static/upload.html")
+async def upload_page(request: Request):
+    return static_assets.response(request, "upload.html")
 
 @app.get("/dashboard")
-async def dashboard_page():
-    return FileResponse("static/dashboard.html")
+async def dashboard_page(request: Request):
+    return static_assets.response(request, "dashboard.html")
 
 @app.get("/vacancies")
-async def vacancies_page():
-    return FileResponse("static/vacancies.html")
+async def vacancies_page(request: Request):
+    return static_assets.response(request, "vacancies.html")
 
 @app.get("/settings")
-async def settings_page():
-    return FileResponse("static/settings.html")
+async def settings_page(request: Request):
+    return static_assets.response(request, "settings.html")
 
 @app.get("/vacancy-detail")
-async def vacancy_detail_page():
-    return FileResponse("static/vacancy-detail.html")
-
-@app.get("/api/candidates/list/{user_id}/{vacancy_id}")
-async def get_candidates_by_vacancy(user_id: str, vacancy_id: int):
-    """Получить кандидатов по вакансии"""
-    return db.get_all_candidates(user_id, vacancy_id)
+async def vacancy_detail_page(request: Request):
+    return static_assets.response(request, "vacancy-detail.html")
 
 # CORS для Mini App
 app.add_middleware(
@@ -69,8 +142,16 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Сжатие ответов API больше GZIP_MIN_SIZE байт (compression.py)
+app.add_middleware(SelectiveGZipMiddleware, minimum_size=GZIP_MIN_SIZE)
+
 # Константы API
 HH_API_BASE = "https://api.hh.ru"
+# Заголовки ответа HH.ru, которые прокси передаёт клиенту
+PROXY_PASSTHROUGH_HEADERS = (
+    "content-type", "content-length", "content-encoding", "content-disposition",
+    "etag", "last-modified", "cache-control", "retry-after"
+)
 HH_OAUTH_BASE = "https://hh.ru"
 
 @app.get("/")
@@ -96,21 +177,61 @@ async def proxy_hh_api(path: str, request: Request):
         "HH-User-Agent": request.headers.get("HH-User-Agent", "HRAssistant/1.0"),
     }
     
+    # Очередь в лимитере HH.ru — по токену пользователя
+    limiter_key = hashlib.sha256((auth_header or '').encode()).hexdigest()[:16]
+    
+    # GET с настроенным TTL — через кэш (одинаковые запросы из разных вкладок схлопываются)
+    ttl = hh_cache.ttl_for(path) if request.method == "GET" else 0
+    if ttl > 0:
+        async def fetch(extra_headers: dict):
+            await hh_limiter.acquire(limiter_key)
+            response = await get_client('hh').get(target_url, headers={**headers, **extra_headers})
+            hh_limiter.observe(response.status_code, response.headers)
+            return response
+        
+        cached = await hh_cache.get(hh_cache.make_key(auth_header, target_url), ttl, fetch)
+        return Response(
+            content=cached["content"],
+            status_code=cached["status_code"],
+            headers={**cached["headers"], "X-Cache": cached["cache"]}
+        )
+    
     # Получаем тело запроса (если есть)
     body = None
     if request.method in ["POST", "PUT"]:
         body = await request.body()
     
-    # Делаем запрос к HH.ru
-    async with httpx.AsyncClient() as client:
-        response = await client.request(
-            method=request.method,
-            url=target_url,
-            headers=headers,
-            content=body,
-        )
+    # Отдаём байты HH.ru как есть (в той же кодировке сжатия, что понимает клиент)
+    headers["Accept-Encoding"] = request.headers.get("Accept-Encoding", "identity")
     
-    return response.json()
+    # Делаем запрос к HH.ru (общий пул соединений) и стримим ответ без буферизации
+    client = get_client('hh')
+    upstream_request = client.build_request(
+        method=request.method,
+        url=target_url,
+        headers=headers,
+        content=body,
+    )
+    await hh_limiter.acquire(limiter_key)
+    response = await client.send(upstream_request, stream=True)
+    hh_limiter.observe(response.status_code, response.headers)
+    
+    async def stream_upstream():
+        try:
+            async for chunk in response.aiter_raw():
+                yield chunk
+        finally:
+            # Возвращаем соединение в пул, если отправка клиенту оборвалась на середине
+            await response.aclose()
+    
+    # Фоновая задача ответа закрывает соединение и тогда, когда клиент отключился
+    # до первого чанка и генератор так и не запускался (повторный aclose ничего не делает)
+    return StreamingResponse(
+        stream_upstream(),
+        status_code=response.status_code,
+        headers={name: response.headers[name] for name in PROXY_PASSTHROUGH_HEADERS if name in response.headers},
+        background=BackgroundTask(response.aclose)
+    )
 
 # OAuth токен для HH.ru
 @app.post("/proxy/hh_oauth/oauth/token")
@@ -130,12 +251,13 @@ async def get_hh_token(request: Request):
         "code": auth_code,
     }
     
-    async with httpx.AsyncClient() as client:
-        response = await client.post(
-            f"{HH_OAUTH_BASE}/oauth/token",
-            data=payload,
-            headers={"Content-Type": "application/x-www-form-urlencoded"},
-        )
+    await hh_limiter.acquire(client_id)
+    response = await get_client('hh').post(
+        f"{HH_OAUTH_BASE}/oauth/token",
+        data=payload,
+        headers={"Content-Type": "application/x-www-form-urlencoded"},
+    )
+    hh_limiter.observe(response.status_code, response.headers)
     
     if response.status_code == 200:
         return response.json()
@@ -145,51 +267,26 @@ async def get_hh_token(request: Request):
 
 @app.get("/api/profile/{user_id}")
 async def get_profile(user_id: str):
-    """Получить профиль пользователя"""
-    profile = db.get_profile(user_id)
+    """Получить профиль пользователя (telegram_chat_ids и is_paid уже разобраны в Database)"""
+    profile = await adb.get_profile(user_id)
     if not profile:
         # Создаём новый профиль если его нет
-        profile = db.create_profile(user_id)
+        profile = await adb.create_profile(user_id)
     
-    # Преобразуем telegram_chat_ids из строки в массив
-    if profile.get('telegram_chat_ids'):
-        try:
-            profile['telegram_chat_ids'] = json.loads(profile['telegram_chat_ids'])
-        except:
-            profile['telegram_chat_ids'] = []
-    else:
-        profile['telegram_chat_ids'] = []
-    
-    # Преобразуем is_paid в boolean
-    profile['is_paid'] = bool(profile.get('is_paid', 0))
-    
-    return profile
+    return ORJSONResponse(profile)
 
 @app.put("/api/profile/{user_id}")
 async def update_profile(user_id: str, request: Request):
     """Обновить профиль пользователя"""
     data = await request.json()
     
-    # Если есть telegram_chat_ids, преобразуем в строку
-    if 'telegram_chat_ids' in data:
-        data['telegram_chat_ids'] = json.dumps(data['telegram_chat_ids'])
-    
-    # Если есть is_paid, преобразуем в integer
-    if 'is_paid' in data:
-        data['is_paid'] = 1 if data['is_paid'] else 0
-    
-    profile = db.update_profile(user_id, **data)
-    
-    # Преобразуем обратно для ответа
-    if profile.get('telegram_chat_ids'):
-        try:
-            profile['telegram_chat_ids'] = json.loads(profile['telegram_chat_ids'])
-        except:
-            profile['telegram_chat_ids'] = []
-    
-    profile['is_paid'] = bool(profile.get('is_paid', 0))
+    profile = await adb.update_profile(user_id, **data)
+    if any(key.startswith('email_') for key in data):
+        token_manager.forget(user_id)
+    if not profile:
+        raise HTTPException(status_code=404, detail="Profile not found")
     
-    return profile
+    return ORJSONResponse(profile)
 
 # === API ДЛЯ ВАКАНСИЙ ===
 
@@ -197,7 +294,7 @@ async def update_profile(user_id: str, request: Request):
 async def save_vacancy(request: Request):
     """Сохранить вакансию"""
     data = await request.json()
-    db.save_vacancy(
+    await adb.save_vacancy(
         vacancy_id=data['id'],
         user_id=data['user_id'],
         title=data['title'],
@@ -214,26 +311,84 @@ async def generate_vacancy(request: Request):
     if not title:
         raise HTTPException(status_code=400, detail="Title is required")
         
-    profile = generate_vacancy_profile(title)
+    profile = await generate_vacancy_profile_async(title, user_id=data.get('user_id'))
     return profile
 
 @app.get("/api/vacancies/list/{user_id}")
 async def get_all_vacancies(user_id: str):
     """Получить список всех вакансий"""
-    return db.get_all_vacancies(user_id)
+    return ORJSONResponse(await adb.get_all_vacancies(user_id))
 
 @app.get("/api/candidates/list/{user_id}/{vacancy_id}")
-async def get_candidates_by_vacancy(user_id: str, vacancy_id: int):
-    """Получить кандидатов по вакансии"""
-    return db.get_all_candidates(user_id, vacancy_id)
+async def get_candidates_by_vacancy(
+    user_id: str,
+    vacancy_id: int,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None
+):
+    """
+    Получить кандидатов по вакансии
+    
+    Без limit/cursor возвращает массив всех кандидатов. С ними — страницу
+    {"items": [...], "next_cursor": "..."}; fields=full_name,verdict — только нужные колонки.
+    Строки читаются из БД порциями и отдаются потоком.
+    """
+    field_list = [f.strip() for f in fields.split(',') if f.strip()] if fields else None
+    if field_list:
+        unknown = [f for f in field_list if f not in CANDIDATE_FIELDS]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Неизвестные поля: {', '.join(unknown)}")
+    
+    try:
+        after = decode_cursor(cursor) if cursor else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    paginated = limit is not None or cursor is not None
+    if limit is not None and not 1 <= limit <= CANDIDATES_MAX_PAGE:
+        raise HTTPException(status_code=400, detail=f"limit должен быть от 1 до {CANDIDATES_MAX_PAGE}")
+    
+    async def stream_candidates():
+        remaining = limit if limit is not None else CANDIDATES_MAX_PAGE if paginated else None
+        position = after
+        last_row = None
+        sent = 0
+        
+        yield b'{"items":[' if paginated else b'['
+        while remaining is None or remaining > 0:
+            chunk_size = CANDIDATES_CHUNK_SIZE if remaining is None else min(remaining, CANDIDATES_CHUNK_SIZE)
+            rows = await adb.get_candidates_page(
+                user_id, vacancy_id, limit=chunk_size, after=position, fields=field_list
+            )
+            if rows:
+                # Одна порция строк — один кусок ответа (меньше мелких записей в сокет и в gzip)
+                yield (b',' if sent else b'') + b','.join(orjson.dumps(row) for row in rows)
+                sent += len(rows)
+            if rows:
+                last_row = rows[-1]
+                position = (last_row['created_at'], last_row['id'])
+            if remaining is not None:
+                remaining -= len(rows)
+            if len(rows) < chunk_size:
+                last_row = None  # дальше строк нет
+                break
+        
+        if paginated:
+            next_cursor = encode_cursor(last_row['created_at'], last_row['id']) if last_row else None
+            yield b'],"next_cursor":' + orjson.dumps(next_cursor) + b'}'
+        else:
+            yield b']'
+    
+    return StreamingResponse(stream_candidates(), media_type="application/json")
 
 @app.get("/api/vacancies/{vacancy_id}/{user_id}")
 async def get_vacancy(vacancy_id: int, user_id: str):
     """Получить вакансию"""
-    vacancy = db.get_vacancy(vacancy_id, user_id)
+    vacancy = await adb.get_vacancy(vacancy_id, user_id)
     if not vacancy:
         raise HTTPException(status_code=404, detail="Vacancy not found")
-    return vacancy
+    return ORJSONResponse(vacancy)
 
 # === API ДЛЯ КАНДИДАТОВ ===
 
@@ -247,7 +402,7 @@ async def save_candidate(request: Request):
     if analysis and isinstance(analysis, dict):
         analysis = json.dumps(analysis)
     
-    db.save_candidate(
+    await adb.save_candidate(
         candidate_id=data['id'],
         user_id=data['user_id'],
         vacancy_id=data['vacancy_id'],
@@ -256,14 +411,34 @@ async def save_candidate(request: Request):
         email=data.get('email'),
         phone=data.get('phone'),
         salary=data.get('salary'),
-        resume_url=data.get('resume_url')
+        resume_url=data.get('resume_url'),
+        resume_text=data.get('resume_text')
     )
     return {"success": True}
 
+# Маршрут поиска объявлен раньше /api/candidates/{candidate_id}/{user_id}
+@app.get("/api/candidates/search/{user_id}")
+async def search_candidates(user_id: str, q: str, vacancy_id: Optional[int] = None, limit: int = 20,
+                            rank_window: int = SEARCH_RANK_WINDOW):
+    """
+    Полнотекстовый поиск кандидатов по резюме и результатам анализа
+    
+    Все слова запроса обязательны, «pyth*» — поиск по префиксу.
+    В snippet найденные слова выделены тегом <mark>.
+    Ранжируются только rank_window самых новых совпадений (не больше SEARCH_RANK_WINDOW_MAX):
+    если совпадений больше, в ответе truncated = true и более старые кандидаты не показаны.
+    """
+    if not q.strip():
+        raise HTTPException(status_code=400, detail="q is required")
+    limit = max(1, min(limit, 100))
+    return ORJSONResponse(await adb.search_candidates(
+        user_id, q, vacancy_id=vacancy_id, limit=limit, rank_window=rank_window
+    ))
+
 @app.get("/api/candidates/{candidate_id}/{user_id}")
 async def get_candidate(candidate_id: int, user_id: str):
     """Получить кандидата"""
-    candidate = db.get_candidate(candidate_id, user_id)
+    candidate = await adb.get_candidate(candidate_id, user_id)
     if not candidate:
         raise HTTPException(status_code=404, detail="Candidate not found")
     
@@ -274,7 +449,7 @@ async def get_candidate(candidate_id: int, user_id: str):
         except:
             pass
     
-    return candidate
+    return ORJSONResponse(candidate)
 
 # === API ДЛЯ AI-АНАЛИЗА ===
 
@@ -290,10 +465,84 @@ async def analyze_candidate(request: Request):
         raise HTTPException(status_code=400, detail="full_resume is required")
     
     # Анализируем через OpenAI
-    result = analyze_resume_from_hh(full_resume, criteria)
+    result = await analyze_resume_from_hh_async(full_resume, criteria, user_id=data.get('user_id'))
     
     return result
 
+@app.post("/api/analyze_batch")
+async def analyze_candidates_batch(request: Request):
+    """
+    Пакетный анализ кандидатов вакансии (например, всех откликов с HH.ru)
+    
+    Тело: {user_id, vacancy_id, candidates: [{id, full_name, full_resume | resume_text, email, phone, salary, resume_url}]}
+    Анализ идёт в фоне по несколько резюме на запрос к OpenAI, результаты сразу
+    сохраняются в кандидатов; прогресс — GET /api/jobs/{job_id}/{user_id}
+    """
+    data = await request.json()
+    user_id = data.get('user_id')
+    candidates = data.get('candidates') or []
+    
+    if not user_id or not data.get('vacancy_id'):
+        raise HTTPException(status_code=400, detail="user_id and vacancy_id are required")
+    if not candidates:
+        raise HTTPException(status_code=400, detail="candidates is required")
+    if any('id' not in candidate for candidate in candidates):
+        raise HTTPException(status_code=400, detail="each candidate needs an id")
+    
+    vacancy = await adb.get_vacancy(int(data['vacancy_id']), user_id)
+    if not vacancy:
+        raise HTTPException(status_code=404, detail="Вакансия не найдена")
+    
+    job_id = await job_queue.enqueue("analyze_batch", user_id, {
+        "vacancy_id": int(data['vacancy_id']),
+        "candidates": candidates
+    })
+    return {"job_id": job_id, "status": "queued", "total": len(candidates)}
+
+async def run_analyze_batch_job(job: dict) -> dict:
+    """Задача очереди: пакетный анализ кандидатов с записью результатов по мере готовности"""
+    payload = job["payload"]
+    user_id = job["user_id"]
+    candidates = payload["candidates"]
+    
+    vacancy = await adb.get_vacancy(payload["vacancy_id"], user_id)
+    if not vacancy:
+        raise PermanentJobError("Вакансия не найдена")
+    criteria = vacancy.get('pro_talk_criteria') or 'Оцени кандидата'
+    
+    resumes = [candidate.get('resume_text') or candidate.get('full_resume') for candidate in candidates]
+    # Текст для поиска: как есть или резюме HH.ru в текстовом виде
+    texts = [resume if isinstance(resume, str) else format_resume_for_analysis(resume) for resume in resumes]
+    summary = {"total": len(candidates), "processed": 0, "suitable": 0, "prefiltered": 0, "errors": 0}
+    
+    # Уже проанализированные при повторе задачи берутся из кэша анализа
+    async for index, analysis in analyze_resumes_batch_async(resumes, criteria, user_id=user_id):
+        if analysis.get("status") == "error":
+            summary["errors"] += 1
+            continue
+        candidate = candidates[index]
+        await adb.save_candidate(
+            candidate_id=candidate['id'],
+            user_id=user_id,
+            vacancy_id=payload["vacancy_id"],
+            full_name=candidate.get('full_name', ''),
+            analysis_result=json.dumps(analysis, ensure_ascii=False),
+            email=candidate.get('email'),
+            phone=candidate.get('phone'),
+            salary=candidate.get('salary'),
+            resume_url=candidate.get('resume_url'),
+            resume_text=texts[index]
+        )
+        summary["processed"] += 1
+        summary["suitable"] += analysis.get("verdict") == "Подходит"
+        summary["prefiltered"] += bool(analysis.get("prefiltered"))
+    
+    if summary["errors"]:
+        raise RuntimeError(f"Не проанализировано резюме: {summary['errors']} из {summary['total']}")
+    return summary
+
+job_queue.register("analyze_batch", run_analyze_batch_job)
+
 # === ЗАГРУЗКА РЕЗЮМЕ ===
 
 @app.post("/api/upload_resume")
@@ -302,52 +551,189 @@ async def upload_resume(
     user_id: str = Form(...),
     vacancy_id: str = Form(...)
 ):
-    """Загрузить, распарсить и СОХРАНИТЬ резюме С ПРИВЯЗКОЙ К ВАКАНСИИ"""
+    """
+    Загрузить резюме С ПРИВЯЗКОЙ К ВАКАНСИИ: файл ставится в очередь на анализ,
+    сразу возвращается job_id (статус — GET /api/jobs/{job_id}/{user_id})
+    """
+    if not is_supported_file(file.filename):
+        raise HTTPException(status_code=400, detail=SUPPORTED_FORMAT_ERROR)
     
     # Читаем файл
     content = await file.read()
     
-    # Парсим
-    result = parse_resume_file(file.filename, content)
+    # Проверяем вакансию
+    vacancy = await adb.get_vacancy(int(vacancy_id), user_id)
+    if not vacancy:
+        raise HTTPException(status_code=404, detail="Вакансия не найдена")
+    
+    # ID кандидата выдаём сразу: повтор задачи перезапишет ту же запись, а не создаст дубль
+    job_id = await job_queue.enqueue("analyze_resume", user_id, {
+        "filename": file.filename,
+        "vacancy_id": int(vacancy_id),
+        "candidate_id": await adb.create_candidate_id()
+    }, data=content)
+    
+    return {"job_id": job_id, "status": "queued"}
+
+async def run_analyze_resume_job(job: dict) -> dict:
+    """Задача очереди: распарсить, проанализировать и сохранить загруженное резюме"""
+    payload = job["payload"]
+    user_id = job["user_id"]
     
+    result = await parse_resume_file_async(payload["filename"], job["data"])
     if result.get("error"):
-        raise HTTPException(status_code=400, detail=result["error"])
+        raise PermanentJobError(result["error"])
     
-    # Получаем вакансию и её критерии
-    vacancy = db.get_vacancy(int(vacancy_id), user_id)
+    vacancy = await adb.get_vacancy(payload["vacancy_id"], user_id)
     if not vacancy:
-        raise HTTPException(status_code=404, detail="Вакансия не найдена")
+        raise PermanentJobError("Вакансия не найдена")
     
     criteria = vacancy.get('pro_talk_criteria') or 'Оцени кандидата'
     
-    # Анализируем ПО КРИТЕРИЯМ ВАКАНСИИ
-    analysis = analyze_resume(result["text"], criteria)
+    # Анализируем ПО КРИТЕРИЯМ ВАКАНСИИ; ошибка OpenAI — повтор задачи с паузой
+    analysis = await analyze_resume_async(result["text"], criteria, user_id=user_id)
+    if analysis.get("status") == "error":
+        raise RuntimeError(analysis["error"])
     
-    # Сохраняем в БД
-    analysis_json = json.dumps(analysis, ensure_ascii=False)
-    
-    import time
-    new_id = int(time.time())
-    
-    db.save_candidate(
-        candidate_id=new_id,
-        user_id=user_id,
-        vacancy_id=int(vacancy_id),
-        full_name=result["filename"],
-        analysis_result=analysis_json,
-        resume_url="local_file"
+    candidate_id = await save_uploaded_candidate(
+        user_id, payload["vacancy_id"], result["filename"], analysis,
+        candidate_id=payload["candidate_id"], resume_text=result["text"]
     )
     
     return {
         "filename": result["filename"],
         "text": result["text"][:500] + "...",
+        "candidate_id": candidate_id,
         "analysis": analysis
     }
 
+job_queue.register("analyze_resume", run_analyze_resume_job)
+
+@app.get("/api/jobs/{job_id}/{user_id}")
+async def get_job(job_id: int, user_id: str):
+    """Статус задачи: queued, running, done (с результатом) или failed (с ошибкой)"""
+    job = await adb.get_job(job_id, user_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Задача не найдена")
+    return job
+
+async def save_uploaded_candidate(user_id: str, vacancy_id: int, filename: str, analysis: dict,
+                                  candidate_id: int = None, resume_text: str = None) -> int:
+    """Сохранить кандидата из загруженного файла, вернуть его ID"""
+    candidate_id = candidate_id or await adb.create_candidate_id()
+    await adb.save_candidate(
+        candidate_id=candidate_id,
+        user_id=user_id,
+        vacancy_id=vacancy_id,
+        full_name=filename,
+        analysis_result=json.dumps(analysis, ensure_ascii=False),
+        resume_url="local_file",
+        resume_text=resume_text
+    )
+    return candidate_id
+
+async def process_uploaded_file(index: int, filename: str, content: bytes, user_id: str,
+                                vacancy_id: int, criteria: str, semaphore: asyncio.Semaphore,
+                                parse_slots: asyncio.Semaphore) -> dict:
+    """Распарсить, проанализировать и сохранить один файл из пакета"""
+    async with parse_slots:
+        result = await parse_resume_file_async(filename, content)
+    if result.get("error"):
+        return {"index": index, "filename": filename, "status": "error", "error": result["error"]}
+    
+    async with semaphore:
+        analysis = await analyze_resume_async(result["text"], criteria, user_id=user_id)
+    # Ошибка OpenAI: кандидата с вердиктом «Ошибка» не сохраняем, файл можно загрузить повторно
+    if analysis.get("status") == "error":
+        return {"index": index, "filename": filename, "status": "error", "error": analysis.get("error")}
+    
+    candidate_id = await save_uploaded_candidate(user_id, vacancy_id, result["filename"], analysis,
+                                                 resume_text=result["text"])
+    return {
+        "index": index,
+        "filename": filename,
+        "status": "success",
+        "candidate_id": candidate_id,
+        "analysis": analysis
+    }
+
+@app.post("/api/upload_resumes")
+async def upload_resumes(
+    files: List[UploadFile] = File(...),
+    user_id: str = Form(...),
+    vacancy_id: str = Form(...)
+):
+    """
+    Пакетная загрузка резюме: файлы парсятся в пуле процессов, результаты приходят
+    построчно (NDJSON) по мере готовности
+    """
+    if len(files) > BULK_UPLOAD_MAX_FILES:
+        raise HTTPException(status_code=400, detail=f"Не больше {BULK_UPLOAD_MAX_FILES} файлов за раз")
+    
+    vacancy = await adb.get_vacancy(int(vacancy_id), user_id)
+    if not vacancy:
+        raise HTTPException(status_code=404, detail="Вакансия не найдена")
+    
+    criteria = vacancy.get('pro_talk_criteria') or 'Оцени кандидата'
+    uploads = [(file.filename, await file.read()) for file in files]
+    
+    async def stream_results():
+        semaphore = asyncio.Semaphore(BULK_ANALYSIS_CONCURRENCY)
+        # Разбор файлов — не больше, чем процессов в пуле парсинга
+        parse_slots = asyncio.Semaphore(PARSER_WORKERS)
+        tasks = [
+            asyncio.create_task(process_uploaded_file(
+                index, filename, content, user_id, int(vacancy_id), criteria, semaphore, parse_slots
+            ))
+            for index, (filename, content) in enumerate(uploads)
+        ]
+        summary = {"event": "done", "total": len(tasks), "processed": 0, "suitable": 0, "errors": 0}
+        
+        try:
+            yield json.dumps({"event": "start", "total": len(tasks)}, ensure_ascii=False) + "\n"
+            for next_done in asyncio.as_completed(tasks):
+                item = await next_done
+                summary["processed"] += 1
+                if item["status"] == "error":
+                    summary["errors"] += 1
+                elif item["analysis"].get("verdict") == "Подходит":
+                    summary["suitable"] += 1
+                yield json.dumps({"event": "file", **item}, ensure_ascii=False) + "\n"
+            yield json.dumps(summary, ensure_ascii=False) + "\n"
+        finally:
+            # Клиент отключился — не тратим запросы к OpenAI впустую
+            for task in tasks:
+                task.cancel()
+    
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson")
+
+# === МЕТРИКИ ===
+
+@app.get("/api/metrics")
+async def get_metrics():
+    """Счётчики кэшей и очередей"""
+    return {
+        "analysis_cache": analysis_cache.stats(),
+        "vacancy_profile_cache": vacancy_profile_cache.stats(),
+        "hh_cache": hh_cache.stats(),
+        "rate_limits": {name: limiter.stats() for name, limiter in limiters.items()},
+        "jobs": {**job_queue.stats(), "by_status": await adb.get_job_counts()},
+        "email_outbox": {**email_outbox.stats(), "by_status": await adb.get_email_counts()},
+        "email_tokens": token_manager.stats(),
+        "profile_cache": await adb.get_profile_cache_stats(),
+        "static": static_assets.stats(),
+        "openai": get_usage_stats()
+    }
+
 # === API ДЛЯ ДАШБОРДА (НОВОЕ) ===
 @app.get("/api/dashboard/stats/{user_id}")
 async def get_dashboard_stats(user_id: str):
-    return db.get_dashboard_stats(user_id)
+    return ORJSONResponse(await adb.get_dashboard_stats(user_id))
+
+@app.get("/api/dashboard/overview/{user_id}")
+async def get_dashboard_overview(user_id: str):
+    """Статистика и вакансии с числом кандидатов одним запросом"""
+    return ORJSONResponse(await adb.get_dashboard_overview(user_id))
 
 if __name__ == "__main__":
     import uvicorn
@@ -411,8 +797,6 @@ async def oauth_callback(provider: str, code: str, state: str = None):
         token_data = await exchange_code_for_token(provider, code)
         
         access_token = token_data.get('access_token')
-        refresh_token = token_data.get('refresh_token')
-        expires_in = token_data.get('expires_in', 3600)
         
         print(f"✅ Получили токен: {access_token[:20]}...")
         
@@ -421,21 +805,10 @@ async def oauth_callback(provider: str, code: str, state: str = None):
         
         print(f"✅ Email пользователя: {user_email}")
         
-        # Вычисляем время истечения токена
-        from datetime import datetime, timedelta
-        expiry = (datetime.now() + timedelta(seconds=expires_in)).isoformat()
-        
-        # Сохраняем в БД (user_id берём из state параметра)
+        # Сохраняем в БД и в память (user_id берём из state параметра)
         user_id = state or 'test_user_123'
         
-        db.update_profile(
-            user_id,
-            email_provider=provider,
-            email_address=user_email,
-            email_access_token=access_token,
-            email_refresh_token=refresh_token,
-            email_token_expiry=expiry
-        )
+        await token_manager.store(user_id, provider, user_email, token_data)
         
         print(f"✅ Сохранили в БД для user_id={user_id}")
         
@@ -459,23 +832,98 @@ async def send_email_endpoint(request: Request):
     subject = data.get('subject')
     body = data.get('body')
     
-    # Получаем профиль пользователя
-    profile = db.get_profile(user_id)
-    if not profile or not profile.get('email_access_token'):
+    # Токен из памяти (обновлённый, если истекал)
+    token = await token_manager.get_token(user_id)
+    if token is None:
         raise HTTPException(status_code=400, detail="Почта не подключена")
     
-    provider = profile.get('email_provider')
-    access_token = profile.get('email_access_token')
-    from_email = profile.get('email_address')
-    
     # Отправляем письмо
     result = await send_email_via_oauth(
-        provider=provider,
-        access_token=access_token,
-        from_email=from_email,
+        provider=token.provider,
+        access_token=token.access_token,
+        from_email=token.email,
         to_email=to_email,
         subject=subject,
         body=body
     )
     
+    # Токен отозван или истёк раньше срока: обновляем и пробуем ещё раз
+    if result.get("status_code") == 401 and token.refresh_token:
+        token = await token_manager.refresh(user_id, token.access_token)
+        if token is None:
+            raise HTTPException(status_code=401, detail="Не удалось обновить токен почты — переподключите почту")
+        result = await send_email_via_oauth(
+            provider=token.provider,
+            access_token=token.access_token,
+            from_email=token.email,
+            to_email=to_email,
+            subject=subject,
+            body=body
+        )
+    
     return result
+
+
+@app.post("/api/send_email/bulk")
+async def send_email_bulk(request: Request):
+    """
+    Рассылка писем кандидатам через очередь
+    
+    Тело: {user_id, subject, body, recipients: [{email, name, candidate_id}]}
+    В subject и body можно использовать {name} — имя получателя.
+    Письма отправляются в фоне; статус — GET /api/send_email/batch/{batch_id}/{user_id}
+    """
+    data = await request.json()
+    user_id = data.get('user_id')
+    subject = data.get('subject')
+    body = data.get('body')
+    recipients = data.get('recipients') or []
+    
+    if not user_id or not subject or not body:
+        raise HTTPException(status_code=400, detail="user_id, subject и body обязательны")
+    if len(recipients) > EMAIL_BATCH_MAX:
+        raise HTTPException(status_code=400, detail=f"Не больше {EMAIL_BATCH_MAX} получателей за раз")
+    
+    token = await token_manager.get_token(user_id)
+    if token is None:
+        raise HTTPException(status_code=400, detail="Почта не подключена")
+    
+    messages = []
+    skipped = 0
+    for recipient in recipients:
+        to_email = (recipient.get('email') or '').strip()
+        if '@' not in to_email:
+            skipped += 1
+            continue
+        name = recipient.get('name') or ''
+        messages.append({
+            "to_email": to_email,
+            "candidate_id": recipient.get('candidate_id'),
+            "subject": subject.replace('{name}', name),
+            "body": body.replace('{name}', name)
+        })
+    
+    if not messages:
+        raise HTTPException(status_code=400, detail="Нет получателей с email")
+    
+    batch_id, _ = await email_outbox.enqueue(user_id, token.provider, messages)
+    return {"batch_id": batch_id, "queued": len(messages), "skipped": skipped}
+
+
+@app.get("/api/send_email/batch/{batch_id}/{user_id}")
+async def get_email_batch(batch_id: str, user_id: str):
+    """Статус рассылки: счётчики и статус каждого письма"""
+    messages = await adb.get_email_batch(batch_id, user_id)
+    if not messages:
+        raise HTTPException(status_code=404, detail="Рассылка не найдена")
+    
+    counts = {"queued": 0, "sending": 0, "sent": 0, "failed": 0}
+    for message in messages:
+        counts[message["status"]] = counts.get(message["status"], 0) + 1
+    return {
+        "batch_id": batch_id,
+        "total": len(messages),
+        "done": counts["queued"] == 0 and counts["sending"] == 0,
+        "counts": counts,
+        "messages": messages
+    }
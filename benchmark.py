@@ -0,0 +1,388 @@
+"""
+Бенчмарки производительности HR Assistant
+
+Запуск:
+    python benchmark.py db [--ops 5000]
+    python benchmark.py jobs [--jobs 200] [--workers 1 4 16] [--latency 0.05]
+    python benchmark.py llm [--resumes 100] [--batch-size 10] [--delay 0.3] [--token-delay 0.01]
+    python benchmark.py prefilter [--resumes 5000]
+    python benchmark.py search [--candidates 100000]
+    python benchmark.py json [--candidates 5000]
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import sqlite3
+import argparse
+import tempfile
+from typing import Callable, List
+
+from database import Database
+
+
+def _report(name: str, ops: int, elapsed: float):
+    """Напечатать результат замера"""
+    print(f"  {name:<32} {ops / elapsed:>12,.0f} ops/sec  ({elapsed * 1000:.1f} мс на {ops} операций)")
+
+
+def _measure(func: Callable[[int], None], ops: int) -> float:
+    """Выполнить func(i) ops раз и вернуть затраченное время"""
+    start = time.perf_counter()
+    for i in range(ops):
+        func(i)
+    return time.perf_counter() - start
+
+
+# === БАЗА ДАННЫХ ===
+
+def _legacy_get_profile(db_file: str, user_id: str):
+    """Чтение как раньше: новое соединение на каждый запрос"""
+    conn = sqlite3.connect(db_file)
+    conn.row_factory = sqlite3.Row
+    cursor = conn.cursor()
+    cursor.execute("SELECT * FROM profiles WHERE id = ?", (user_id,))
+    row = cursor.fetchone()
+    conn.close()
+    return dict(row) if row else None
+
+
+def _legacy_save_candidate(db_file: str, candidate_id: int, user_id: str, vacancy_id: int):
+    """Запись как раньше: новое соединение и rollback-журнал"""
+    conn = sqlite3.connect(db_file)
+    cursor = conn.cursor()
+    cursor.execute(
+        """INSERT OR REPLACE INTO candidates (id, user_id, vacancy_id, full_name, analysis_result)
+           VALUES (?, ?, ?, ?, ?)""",
+        (candidate_id, user_id, vacancy_id, f"Кандидат {candidate_id}", '{"verdict": "Подходит"}')
+    )
+    conn.commit()
+    conn.close()
+
+
+def bench_db(ops: int):
+    """Сравнить ops/sec: соединение на каждый вызов vs долгоживущие WAL-соединения"""
+    user_id = "bench_user"
+    vacancy_id = 1
+
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy_file = os.path.join(tmp, "legacy.db")
+        pooled_file = os.path.join(tmp, "pooled.db")
+
+        # Старая схема: те же таблицы, но journal_mode по умолчанию (DELETE)
+        legacy_db = Database(legacy_file)
+        conn = legacy_db.get_connection()
+        conn.execute("PRAGMA journal_mode = DELETE")
+        legacy_db.create_profile(user_id)
+        legacy_db.save_vacancy(vacancy_id, user_id, "Python Developer")
+        legacy_db.close()
+
+        pooled_db = Database(pooled_file)
+        pooled_db.create_profile(user_id)
+        pooled_db.save_vacancy(vacancy_id, user_id, "Python Developer")
+
+        print(f"\n📊 Чтение профиля ({ops} операций)")
+        _report("соединение на вызов", ops,
+                _measure(lambda i: _legacy_get_profile(legacy_file, user_id), ops))
+        _report("долгоживущее соединение (WAL)", ops,
+                _measure(lambda i: pooled_db.get_profile(user_id), ops))
+
+        print(f"\n📊 Сохранение кандидата ({ops} операций)")
+        _report("соединение на вызов", ops,
+                _measure(lambda i: _legacy_save_candidate(legacy_file, i, user_id, vacancy_id), ops))
+        _report("долгоживущее соединение (WAL)", ops,
+                _measure(lambda i: pooled_db.save_candidate(
+                    i, user_id, vacancy_id, f"Кандидат {i}", '{"verdict": "Подходит"}'), ops))
+
+        pooled_db.close()
+
+
+# === ОЧЕРЕДЬ ЗАДАЧ ===
+
+async def _run_jobs(db_file: str, jobs: int, workers: int, latency: float) -> float:
+    """Прогнать jobs задач через очередь с workers воркерами, вернуть время"""
+    from async_database import AsyncDatabase
+    from job_queue import JobQueue
+
+    database = AsyncDatabase(Database(db_file))
+    queue = JobQueue(database, workers=workers)
+    finished = asyncio.Event()
+    done = 0
+
+    async def handler(job):
+        # Имитация запроса к OpenAI: воркер ждёт ответа, не занимая CPU
+        nonlocal done
+        await asyncio.sleep(latency)
+        done += 1
+        if done == jobs:
+            finished.set()
+        return {"ok": True}
+
+    queue.register("bench", handler)
+    for i in range(jobs):
+        await queue.enqueue("bench", "bench_user", {"n": i})
+
+    start = time.perf_counter()
+    await queue.start()
+    await finished.wait()
+    elapsed = time.perf_counter() - start
+    await queue.stop()
+    database.shutdown()
+    return elapsed
+
+
+def bench_jobs(jobs: int, workers: List[int], latency: float):
+    """Пропускная способность очереди задач в зависимости от числа воркеров"""
+    print(f"\n📊 Очередь задач: {jobs} задач по {latency * 1000:.0f} мс")
+    with tempfile.TemporaryDirectory() as tmp:
+        for count in workers:
+            elapsed = asyncio.run(_run_jobs(os.path.join(tmp, f"jobs_{count}.db"), jobs, count, latency))
+            _report(f"воркеров: {count}", jobs, elapsed)
+
+
+# === АНАЛИЗ РЕЗЮМЕ: ПО ОДНОМУ VS ПАКЕТАМИ ===
+
+SAMPLE_RESUME = (
+    "Опыт работы:\n- Python Developer в ООО Ромашка (2019-01 - н.в.)\n"
+    "  Описание: разработка backend на FastAPI, PostgreSQL, Docker, CI/CD\n"
+    "\nОбразование:\n- МГТУ им. Баумана (2018, Информатика)\n"
+    "\nНавыки: Python, FastAPI, PostgreSQL, Docker, Git, Redis\n"
+)
+SAMPLE_CRITERIA = "Обязательно: опыт 3+ года, знание FastAPI и PostgreSQL. Желательно: опыт с Docker"
+
+
+async def _run_llm_mode(ai_analyzer, texts: List[str], batch_size: int) -> dict:
+    """Проанализировать texts по одному (batch_size=1) или пакетами, вернуть замеры"""
+    before = dict(ai_analyzer.usage_stats)
+    latencies = []
+    start = time.perf_counter()
+
+    if batch_size == 1:
+        semaphore = asyncio.Semaphore(int(os.getenv('BULK_ANALYSIS_CONCURRENCY', 8)))
+
+        async def single(text):
+            async with semaphore:
+                await ai_analyzer.analyze_resume_async(text, SAMPLE_CRITERIA, user_id="bench")
+            latencies.append(time.perf_counter() - start)
+
+        await asyncio.gather(*(single(text) for text in texts))
+    else:
+        async for _ in ai_analyzer.analyze_resumes_batch_async(texts, SAMPLE_CRITERIA, user_id="bench",
+                                                               batch_size=batch_size):
+            latencies.append(time.perf_counter() - start)
+
+    elapsed = time.perf_counter() - start
+    usage = {key: ai_analyzer.usage_stats[key] - before[key] for key in before}
+    return {
+        "elapsed": elapsed,
+        "latency": sum(latencies) / len(latencies),
+        "usage": usage,
+        "cost": ai_analyzer.estimate_cost(usage["prompt_tokens"], usage["completion_tokens"])
+    }
+
+
+def bench_llm(resumes: int, batch_size: int, delay: float, token_delay: float):
+    """Стоимость и задержка на кандидата: analyze_resume_async vs analyze_resumes_batch_async"""
+    import uuid
+    import fake_openai
+
+    server = fake_openai.start_server(delay=delay, token_delay=token_delay)
+    os.environ['OPENAI_BASE_URL'] = f"http://127.0.0.1:{server.server_port}/v1"
+    os.environ.setdefault('OPENAI_API_KEY', 'benchmark')
+
+    import ai_analyzer
+    from async_database import AsyncDatabase
+    from cache import AnalysisCache
+
+    print(f"\n📊 Анализ {resumes} резюме через заглушку OpenAI "
+          f"(задержка {delay} с + {token_delay} с на токен ответа)")
+    with tempfile.TemporaryDirectory() as tmp:
+        # Отдельная база для кэша анализа и уникальные резюме: каждый замер идёт в API
+        ai_analyzer.analysis_cache = AnalysisCache(AsyncDatabase(Database(os.path.join(tmp, "llm.db"))))
+        modes = (("по одному", 1), (f"пакетами по {batch_size}", batch_size))
+
+        async def run_modes():
+            # Один event loop на все замеры: пул соединений клиента OpenAI привязан к нему
+            results = []
+            for _, size in modes:
+                texts = [f"{SAMPLE_RESUME}\nID: {uuid.uuid4()}" for _ in range(resumes)]
+                results.append(await _run_llm_mode(ai_analyzer, texts, size))
+            return results
+
+        for (name, _), result in zip(modes, asyncio.run(run_modes())):
+            usage = result["usage"]
+            print(f"  {name:<20} запросов: {usage['requests']:>4}  "
+                  f"токенов на кандидата: {(usage['prompt_tokens'] + usage['completion_tokens']) / resumes:>5.0f}  "
+                  f"${result['cost'] / resumes * 1000:.3f} за 1000 кандидатов  "
+                  f"задержка: {result['latency']:.2f} с  всего: {result['elapsed']:.2f} с")
+        ai_analyzer.analysis_cache.adb.shutdown()
+    server.shutdown()
+
+
+# === ПРЕДВАРИТЕЛЬНЫЙ ОТСЕВ ===
+
+OFF_TOPIC_RESUME = (
+    "Опыт работы:\n- Повар в ресторане Весна (2015-03 - н.в.)\n"
+    "  Описание: приготовление блюд европейской кухни, составление меню, контроль склада\n"
+    "\nНавыки: кулинария, санитарные нормы, работа в команде\n"
+)
+
+
+def bench_prefilter(resumes: int):
+    """Скорость локального отсева и доля резюме, не дошедших до модели"""
+    from prefilter import score_resumes, prefilter_mask
+
+    # Половина резюме по теме вакансии, половина — нет; тексты длиной с обычное резюме
+    texts = [
+        (SAMPLE_RESUME if i % 2 else OFF_TOPIC_RESUME) * 8 + f"\nID: {i}"
+        for i in range(resumes)
+    ]
+    print(f"\n📊 Предварительный отсев: {resumes} резюме по ~{len(texts[0])} символов")
+    start = time.perf_counter()
+    scores = score_resumes(texts, SAMPLE_CRITERIA)
+    rejected = prefilter_mask(scores)
+    elapsed = time.perf_counter() - start
+    _report("BM25 + отсев (1 ядро)", resumes, elapsed)
+    print(f"  термины критериев: {', '.join(scores.terms)}")
+    print(f"  отсеяно без модели: {int(rejected.sum())} из {resumes}")
+
+
+# === ПОЛНОТЕКСТОВЫЙ ПОИСК ===
+
+SEARCH_SKILLS = ["Python", "FastAPI", "Django", "PostgreSQL", "Docker", "Kubernetes", "Redis", "Kafka",
+                 "React", "TypeScript", "Go", "Java", "Spring", "1С", "Excel", "SQL", "Linux", "Git"]
+SEARCH_FILLER = ("разработка сопровождение проектирование команда клиенты продажи отчётность аналитика "
+                 "интеграция тестирование оптимизация внедрение поддержка обучение руководство").split()
+
+
+def bench_search(candidates: int, queries: int = 50):
+    """Время поиска кандидатов через FTS5 на большой базе"""
+    import random
+
+    rng = random.Random(42)
+    with tempfile.TemporaryDirectory() as tmp:
+        database = Database(os.path.join(tmp, "search.db"))
+        database.save_vacancy(1, "bench_user", "Python Developer")
+        conn = database.get_connection()
+
+        start = time.perf_counter()
+        with conn:
+            conn.executemany(
+                """INSERT INTO candidates (id, user_id, vacancy_id, full_name, analysis_result, resume_text)
+                   VALUES (?, 'bench_user', 1, ?, ?, ?)""",
+                (
+                    (i, f"Кандидат {i}",
+                     json.dumps({"verdict": "Подходит", "matched_criteria": rng.sample(SEARCH_SKILLS, 3)},
+                                ensure_ascii=False),
+                     " ".join(rng.choices(SEARCH_FILLER, k=60) + rng.sample(SEARCH_SKILLS, 4)))
+                    for i in range(candidates)
+                )
+            )
+        print(f"\n📊 Поиск по {candidates} кандидатам (индексация: {time.perf_counter() - start:.1f} с)")
+
+        for query in ("4242", "kafka", "postgresql docker", "kube*", "1С excel", "разработка python"):
+            elapsed = _measure(lambda i: database.search_candidates("bench_user", query, limit=20), queries)
+            found = len(database.search_candidates("bench_user", query, limit=20)["items"])
+            print(f"  {query:<24} {elapsed / queries * 1000:>8.2f} мс на запрос (найдено {found})")
+        database.close()
+
+
+# === JSON-ОТВЕТЫ ===
+
+def bench_json(candidates: int, repeats: int = 20):
+    """Сериализация списка кандидатов: jsonable_encoder + json vs orjson, и размер с gzip"""
+    import gzip
+    import random
+    from fastapi.encoders import jsonable_encoder
+    from fastapi.responses import JSONResponse, ORJSONResponse
+    from compression import GZIP_LEVEL
+
+    rng = random.Random(42)
+    with tempfile.TemporaryDirectory() as tmp:
+        database = Database(os.path.join(tmp, "json.db"))
+        database.save_vacancy(1, "bench_user", "Python Developer")
+        conn = database.get_connection()
+        with conn:
+            conn.executemany(
+                """INSERT INTO candidates (id, user_id, vacancy_id, full_name, analysis_result, email, phone,
+                                           salary, resume_url, resume_text)
+                   VALUES (?, 'bench_user', 1, ?, ?, ?, ?, ?, ?, ?)""",
+                (
+                    (i, f"Кандидат {i}",
+                     json.dumps({
+                         "verdict": rng.choice(["Подходит", "Не подходит", "Возможно"]),
+                         "score": rng.randint(1, 10),
+                         "matched_criteria": rng.sample(SEARCH_SKILLS, 4),
+                         "missing_criteria": rng.sample(SEARCH_SKILLS, 2),
+                         "summary": " ".join(rng.choices(SEARCH_FILLER, k=25))
+                     }, ensure_ascii=False),
+                     f"candidate{i}@example.com", f"+7 900 {i:07d}", f"{rng.randint(80, 400)} 000 руб.",
+                     f"https://hh.ru/resume/{i:032x}", " ".join(rng.choices(SEARCH_FILLER, k=200)))
+                    for i in range(candidates)
+                )
+            )
+        payload = database.get_all_candidates("bench_user", 1)
+        database.close()
+
+    print(f"\n📊 Ответ со списком из {len(payload)} кандидатов (get_all_candidates)")
+    modes = (
+        ("jsonable_encoder + json", lambda i: JSONResponse(jsonable_encoder(payload)).body),
+        ("orjson (ORJSONResponse)", lambda i: ORJSONResponse(payload).body),
+    )
+    for name, render in modes:
+        elapsed = _measure(render, repeats)
+        print(f"  {name:<32} {elapsed / repeats * 1000:>8.1f} мс на ответ, {len(render(0)):>10,} байт")
+
+    body = ORJSONResponse(payload).body
+    elapsed = _measure(lambda i: gzip.compress(body, compresslevel=GZIP_LEVEL), repeats)
+    compressed = gzip.compress(body, compresslevel=GZIP_LEVEL)
+    print(f"  {f'gzip (уровень {GZIP_LEVEL})':<32} {elapsed / repeats * 1000:>8.1f} мс на ответ, "
+          f"{len(compressed):>10,} байт ({len(compressed) / len(body):.0%} от исходного)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарки HR Assistant")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    db_parser = subparsers.add_parser("db", help="SQLite: соединение на вызов vs пул соединений")
+    db_parser.add_argument("--ops", type=int, default=5000)
+
+    jobs_parser = subparsers.add_parser("jobs", help="Очередь задач: пропускная способность по числу воркеров")
+    jobs_parser.add_argument("--jobs", type=int, default=200)
+    jobs_parser.add_argument("--workers", type=int, nargs="+", default=[1, 4, 16])
+    jobs_parser.add_argument("--latency", type=float, default=0.05)
+
+    llm_parser = subparsers.add_parser("llm", help="Анализ резюме: по одному vs пакетами (через заглушку OpenAI)")
+    llm_parser.add_argument("--resumes", type=int, default=100)
+    llm_parser.add_argument("--batch-size", type=int, default=10)
+    llm_parser.add_argument("--delay", type=float, default=0.3)
+    llm_parser.add_argument("--token-delay", type=float, default=0.01)
+
+    prefilter_parser = subparsers.add_parser("prefilter", help="Скорость локального отсева резюме (BM25)")
+    prefilter_parser.add_argument("--resumes", type=int, default=5000)
+
+    search_parser = subparsers.add_parser("search", help="Полнотекстовый поиск кандидатов (FTS5)")
+    search_parser.add_argument("--candidates", type=int, default=100000)
+
+    json_parser = subparsers.add_parser("json", help="Сериализация и размер ответа со списком кандидатов")
+    json_parser.add_argument("--candidates", type=int, default=5000)
+
+    args = parser.parse_args(argv)
+
+    if args.command == "db":
+        bench_db(args.ops)
+    elif args.command == "jobs":
+        bench_jobs(args.jobs, args.workers, args.latency)
+    elif args.command == "llm":
+        bench_llm(args.resumes, args.batch_size, args.delay, args.token_delay)
+    elif args.command == "prefilter":
+        bench_prefilter(args.resumes)
+    elif args.command == "search":
+        bench_search(args.candidates)
+    elif args.command == "json":
+        bench_json(args.candidates)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,285 @@
+import os
+import re
+import time
+import json
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+# Настройки кэша анализа резюме (можно переопределить через .env)
+ANALYSIS_CACHE_MEMORY_SIZE = int(os.getenv('ANALYSIS_CACHE_MEMORY_SIZE', 1000))
+ANALYSIS_CACHE_MAX_ENTRIES = int(os.getenv('ANALYSIS_CACHE_MAX_ENTRIES', 50000))
+ANALYSIS_CACHE_TTL_DAYS = float(os.getenv('ANALYSIS_CACHE_TTL_DAYS', 30))
+# Как часто (в записях) чистить таблицу кэша
+ANALYSIS_CACHE_EVICT_EVERY = int(os.getenv('ANALYSIS_CACHE_EVICT_EVERY', 500))
+
+# Настройки кэша профилей вакансий
+VACANCY_PROFILE_CACHE_MEMORY_SIZE = int(os.getenv('VACANCY_PROFILE_CACHE_MEMORY_SIZE', 500))
+VACANCY_PROFILE_CACHE_MAX_ENTRIES = int(os.getenv('VACANCY_PROFILE_CACHE_MAX_ENTRIES', 5000))
+VACANCY_PROFILE_CACHE_TTL_DAYS = float(os.getenv('VACANCY_PROFILE_CACHE_TTL_DAYS', 30))
+
+
+class LRUCache:
+    """Потокобезопасный LRU-кэш в памяти с ограничением по размеру и TTL"""
+
+    def __init__(self, max_size: int, ttl: float = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, stored_at = item
+            if self.ttl is not None and time.time() - stored_at > self.ttl:
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def put(self, key: str, value: Any, stored_at: float = None):
+        with self._lock:
+            self._data[key] = (value, stored_at or time.time())
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def pop(self, key: str):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+def normalize_text(text: Optional[str]) -> str:
+    """Нормализация текста для ключа кэша: Unicode NFC и схлопывание пробелов"""
+    if not text:
+        return ""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+class AnalysisCache:
+    """
+    Кэш результатов анализа резюме: LRU в памяти поверх таблицы analysis_cache
+
+    Ключ — SHA-256 от нормализованного текста резюме, критериев, модели и версии промпта,
+    поэтому повторный анализ того же резюме по тем же критериям не идёт в OpenAI.
+    """
+
+    def __init__(self, adb, memory_size: int = ANALYSIS_CACHE_MEMORY_SIZE,
+                 max_entries: int = ANALYSIS_CACHE_MAX_ENTRIES, ttl_days: float = ANALYSIS_CACHE_TTL_DAYS):
+        self.adb = adb
+        self.max_entries = max_entries
+        self.max_age = ttl_days * 86400
+        self.memory = LRUCache(memory_size, ttl=self.max_age)
+        self._stats_lock = threading.Lock()
+        self._puts = 0
+        self.stats_counters = {"memory_hits": 0, "db_hits": 0, "misses": 0, "stores": 0, "evicted": 0}
+
+    @staticmethod
+    def make_key(resume_text: str, criteria: Optional[str], model: str, prompt_version: str) -> str:
+        payload = json.dumps(
+            [prompt_version, model, normalize_text(criteria), normalize_text(resume_text)],
+            ensure_ascii=False
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _count(self, name: str, value: int = 1):
+        with self._stats_lock:
+            self.stats_counters[name] += value
+
+    def _from_db(self, key: str, entry: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        if not entry or time.time() - entry["created_at"] > self.max_age:
+            self._count("misses")
+            return None
+        self._count("db_hits")
+        self.memory.put(key, entry["result"], stored_at=entry["created_at"])
+        return entry["result"]
+
+    def _should_evict(self) -> bool:
+        with self._stats_lock:
+            self._puts += 1
+            return self._puts % ANALYSIS_CACHE_EVICT_EVERY == 0
+
+    # --- синхронный доступ ---
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        result = self.memory.get(key)
+        if result is not None:
+            self._count("memory_hits")
+            return result
+        result = self._from_db(key, self.adb.database.get_analysis_cache(key))
+        if result is not None:
+            self.adb.database.touch_analysis_cache(key)
+        return result
+
+    def put(self, key: str, result: Dict[str, Any], model: str, prompt_version: str):
+        self.memory.put(key, result)
+        self.adb.database.save_analysis_cache(key, result, model, prompt_version)
+        self._count("stores")
+        if self._should_evict():
+            self._count("evicted", self.adb.database.evict_analysis_cache(self.max_entries, self.max_age))
+
+    # --- асинхронный доступ (БД вне event loop) ---
+
+    async def aget(self, key: str) -> Optional[Dict[str, Any]]:
+        result = self.memory.get(key)
+        if result is not None:
+            self._count("memory_hits")
+            return result
+        result = self._from_db(key, await self.adb.get_analysis_cache(key))
+        if result is not None:
+            await self.adb.touch_analysis_cache(key)
+        return result
+
+    async def aput(self, key: str, result: Dict[str, Any], model: str, prompt_version: str):
+        self.memory.put(key, result)
+        await self.adb.save_analysis_cache(key, result, model, prompt_version)
+        self._count("stores")
+        if self._should_evict():
+            self._count("evicted", await self.adb.evict_analysis_cache(self.max_entries, self.max_age))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            stats = dict(self.stats_counters)
+        lookups = stats["memory_hits"] + stats["db_hits"] + stats["misses"]
+        stats["memory_size"] = len(self.memory)
+        stats["hit_rate"] = round((stats["memory_hits"] + stats["db_hits"]) / lookups, 3) if lookups else 0.0
+        return stats
+
+
+# Транслитерация кириллицы: «Менеджер» и «Menedzher» — одно название
+TRANSLIT = str.maketrans({
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ё': 'e', 'ж': 'zh', 'з': 'z',
+    'и': 'i', 'й': 'y', 'к': 'k', 'л': 'l', 'м': 'm', 'н': 'n', 'о': 'o', 'п': 'p', 'р': 'r',
+    'с': 's', 'т': 't', 'у': 'u', 'ф': 'f', 'х': 'kh', 'ц': 'ts', 'ч': 'ch', 'ш': 'sh', 'щ': 'shch',
+    'ъ': '', 'ы': 'y', 'ь': '', 'э': 'e', 'ю': 'yu', 'я': 'ya'
+})
+# Слова названия: буквы, цифры и символы из названий технологий (C++, C#)
+TITLE_WORD_RE = re.compile(r"[a-z0-9+#]+")
+
+
+def normalize_title(title: Optional[str]) -> str:
+    """Ключ названия вакансии: регистр, пробелы, пунктуация и раскладка не важны"""
+    text = unicodedata.normalize("NFKC", title or "").lower().translate(TRANSLIT)
+    return " ".join(TITLE_WORD_RE.findall(text))
+
+
+class VacancyProfileCache:
+    """
+    Кэш сгенерированных профилей вакансий: LRU в памяти поверх таблицы vacancy_profile_cache
+
+    «Python Developer», «python  developer» и «Python-Developer» дают один ключ,
+    поэтому популярные вакансии генерируются один раз (и заранее — при прогреве).
+    """
+
+    def __init__(self, adb, memory_size: int = VACANCY_PROFILE_CACHE_MEMORY_SIZE,
+                 max_entries: int = VACANCY_PROFILE_CACHE_MAX_ENTRIES,
+                 ttl_days: float = VACANCY_PROFILE_CACHE_TTL_DAYS):
+        self.adb = adb
+        self.max_entries = max_entries
+        self.max_age = ttl_days * 86400
+        self.memory = LRUCache(memory_size, ttl=self.max_age)
+        self._stats_lock = threading.Lock()
+        self.stats_counters = {"memory_hits": 0, "db_hits": 0, "misses": 0, "stores": 0, "evicted": 0}
+
+    @staticmethod
+    def make_key(title: str, model: str, prompt_version: str) -> str:
+        # Название без латиницы и цифр после транслитерации (например, из одних эмодзи)
+        # даёт пустой ключ — тогда ключом служит хеш самого названия
+        title_key = normalize_title(title) or "#" + hashlib.sha256(
+            normalize_text(title).lower().encode("utf-8")
+        ).hexdigest()
+        return f"{prompt_version}:{model}:{title_key}"
+
+    def _count(self, name: str, value: int = 1):
+        with self._stats_lock:
+            self.stats_counters[name] += value
+
+    def _from_db(self, key: str, entry: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        if not entry or time.time() - entry["created_at"] > self.max_age:
+            self._count("misses")
+            return None
+        self._count("db_hits")
+        self.memory.put(key, entry["profile"], stored_at=entry["created_at"])
+        return entry["profile"]
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        profile = self.memory.get(key)
+        if profile is not None:
+            self._count("memory_hits")
+            return profile
+        profile = self._from_db(key, self.adb.database.get_vacancy_profile_cache(key))
+        if profile is not None:
+            self.adb.database.touch_vacancy_profile_cache(key)
+        return profile
+
+    def put(self, key: str, title: str, profile: Dict[str, Any], model: str, prompt_version: str):
+        self.memory.put(key, profile)
+        self.adb.database.save_vacancy_profile_cache(key, title, profile, model, prompt_version)
+        self._count("stores")
+
+    async def aget(self, key: str) -> Optional[Dict[str, Any]]:
+        profile = self.memory.get(key)
+        if profile is not None:
+            self._count("memory_hits")
+            return profile
+        profile = self._from_db(key, await self.adb.get_vacancy_profile_cache(key))
+        if profile is not None:
+            await self.adb.touch_vacancy_profile_cache(key)
+        return profile
+
+    async def aput(self, key: str, title: str, profile: Dict[str, Any], model: str, prompt_version: str):
+        self.memory.put(key, profile)
+        await self.adb.save_vacancy_profile_cache(key, title, profile, model, prompt_version)
+        self._count("stores")
+
+    async def contains(self, key: str) -> bool:
+        """Есть ли свежий профиль (без учёта в статистике и счётчике использований)"""
+        if self.memory.get(key) is not None:
+            return True
+        entry = await self.adb.get_vacancy_profile_cache(key)
+        return bool(entry) and time.time() - entry["created_at"] <= self.max_age
+
+    async def load_hot(self, limit: int = None) -> int:
+        """Загрузить самые востребованные профили из БД в память, вернуть их число"""
+        entries = await self.adb.get_hot_vacancy_profiles(limit or self.memory.max_size, self.max_age)
+        for entry in entries:
+            self.memory.put(entry["cache_key"], entry["profile"], stored_at=entry["created_at"])
+        return len(entries)
+
+    async def evict(self) -> int:
+        deleted = await self.adb.evict_vacancy_profile_cache(self.max_entries, self.max_age)
+        self._count("evicted", deleted)
+        return deleted
+
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            stats = dict(self.stats_counters)
+        lookups = stats["memory_hits"] + stats["db_hits"] + stats["misses"]
+        stats["memory_size"] = len(self.memory)
+        stats["hit_rate"] = round((stats["memory_hits"] + stats["db_hits"]) / lookups, 3) if lookups else 0.0
+        return stats
+
+
+def merge_popular_titles(rows: List[Dict[str, Any]], limit: int) -> List[str]:
+    """Сложить использования названий с одинаковым ключом, вернуть самые частые"""
+    uses: Dict[str, int] = {}
+    titles: Dict[str, str] = {}
+    for row in rows:
+        key = normalize_title(row["title"])
+        if not key:
+            continue
+        uses[key] = uses.get(key, 0) + (row["uses"] or 0)
+        titles.setdefault(key, " ".join(row["title"].split()))
+    return [titles[key] for key in sorted(uses, key=lambda key: -uses[key])[:limit]]
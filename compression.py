@@ -0,0 +1,34 @@
+import os
+from typing import Sequence
+
+from starlette.middleware.gzip import GZipMiddleware
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+# Сжатие ответов API (можно переопределить через .env)
+# Ответы меньше порога (байты) не сжимаем: выигрыш меньше затрат
+GZIP_MIN_SIZE = int(os.getenv('GZIP_MIN_SIZE', 1024))
+# Уровень 6 — почти как 9 по размеру JSON, но в разы быстрее
+GZIP_LEVEL = int(os.getenv('GZIP_LEVEL', 6))
+
+# Пути, которые не сжимаем:
+# - прокси HH.ru отдаёт байты upstream как есть (и сжатые, и из кэша)
+# - NDJSON-прогресс загрузки: gzip копит строки в буфере, и события приходили бы с задержкой
+# /static (StaticFiles отдаёт файлы несжатыми) сжимается здесь; страницы Mini App
+# приходят уже сжатыми (static_assets.py), а ответы с Content-Encoding GZipMiddleware пропускает
+GZIP_EXCLUDED_PREFIXES = ('/proxy/', '/api/upload_resumes')
+
+
+class SelectiveGZipMiddleware:
+    """GZip для ответов API, кроме путей с префиксами из excluded_prefixes"""
+
+    def __init__(self, app: ASGIApp, minimum_size: int = GZIP_MIN_SIZE, compresslevel: int = GZIP_LEVEL,
+                 excluded_prefixes: Sequence[str] = GZIP_EXCLUDED_PREFIXES):
+        self.app = app
+        self.gzip = GZipMiddleware(app, minimum_size=minimum_size, compresslevel=compresslevel)
+        self.excluded_prefixes = tuple(excluded_prefixes)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "http" and not scope["path"].startswith(self.excluded_prefixes):
+            await self.gzip(scope, receive, send)
+            return
+        await self.app(scope, receive, send)
@@ -1,30 +1,92 @@
+import os
 import sqlite3
 import json
-from typing import Optional, List, Dict, Any
+import threading
+import time
+import base64
+import re
+from typing import Optional, List, Dict, Any, Sequence, Tuple
 from datetime import datetime
 
-DB_FILE = 'hr_assistant.db'
+from cache import LRUCache
 
-class Database:
-    """Класс для работы с SQLite базой данных"""
-    
-    def __init__(self, db_file: str = DB_FILE):
-        self.db_file = db_file
-        self.init_database()
-    
-    def get_connection(self):
-        """Получить соединение с базой данных"""
-        conn = sqlite3.connect(self.db_file)
-        conn.row_factory = sqlite3.Row  # Возвращать результаты как словари
-        return conn
-    
-    def init_database(self):
-        """Создать таблицы если их нет"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        # Таблица: Профили пользователей
-        cursor.execute('''
+DB_FILE = os.getenv('DB_FILE', 'hr_assistant.db')
+
+# Настройки соединений SQLite (можно переопределить через .env)
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', 5000))
+SQLITE_CACHE_SIZE_KB = int(os.getenv('SQLITE_CACHE_SIZE_KB', 20000))
+SQLITE_MMAP_SIZE = int(os.getenv('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))
+SQLITE_STATEMENT_CACHE = int(os.getenv('SQLITE_STATEMENT_CACHE', 256))
+
+# Поиск кандидатов: BM25 считаем только для стольких последних совпадений
+# (частое слово совпадает с десятками тысяч резюме, полная сортировка — сотни мс)
+SEARCH_RANK_WINDOW = int(os.getenv('SEARCH_RANK_WINDOW', 500))
+# Верхняя граница окна, которое можно запросить явно (rank_window)
+SEARCH_RANK_WINDOW_MAX = int(os.getenv('SEARCH_RANK_WINDOW_MAX', 5000))
+
+# Сколько профилей держать в памяти (проверяются по profiles.version при каждом чтении)
+PROFILE_CACHE_SIZE = int(os.getenv('PROFILE_CACHE_SIZE', 1000))
+
+# Колонки кандидата, которые можно запросить в списке (fields=...)
+CANDIDATE_FIELDS = (
+    'id', 'user_id', 'vacancy_id', 'full_name', 'email', 'phone', 'salary',
+    'resume_url', 'analysis_result', 'verdict', 'matches_count', 'created_at'
+)
+
+def encode_cursor(created_at: str, candidate_id: int) -> str:
+    """Курсор постраничной выдачи: позиция (created_at, id) последней строки"""
+    return base64.urlsafe_b64encode(json.dumps([created_at, candidate_id]).encode()).decode()
+
+def decode_cursor(cursor: str) -> Tuple[str, int]:
+    """Разобрать курсор (ValueError если он повреждён)"""
+    try:
+        created_at, candidate_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return str(created_at), int(candidate_id)
+    except Exception:
+        raise ValueError("Некорректный курсор")
+
+# Слово поискового запроса; «*» в конце — поиск по префиксу
+SEARCH_TERM_RE = re.compile(r"[\w+#.]+\*?")
+
+def build_fts_query(query: str) -> str:
+    """
+    Запрос пользователя в синтаксис FTS5: каждое слово в кавычках (операторы и скобки
+    не ломают запрос), все слова обязательны, «pyth*» — поиск по префиксу
+    """
+    terms = []
+    for term in SEARCH_TERM_RE.findall((query or '').replace('ё', 'е').replace('Ё', 'Е')):
+        prefix = term.endswith('*')
+        word = term.rstrip('*').strip('.')
+        if word:
+            terms.append('"' + word.replace('"', '') + '"' + ('*' if prefix else ''))
+    return ' '.join(terms)
+
+def _extract_verdict(analysis_result) -> tuple:
+    """Достать verdict и matches_count из результата анализа (JSON-строка или dict)"""
+    if not analysis_result:
+        return None, None
+    try:
+        analysis = json.loads(analysis_result) if isinstance(analysis_result, str) else analysis_result
+        return analysis.get('verdict'), analysis.get('matches_count')
+    except (ValueError, AttributeError):
+        return None, None
+
+# === МИГРАЦИИ СХЕМЫ ===
+# Каждая миграция применяется один раз, номер записывается в schema_version.
+# Новые миграции добавлять только в конец списка MIGRATIONS.
+
+def _add_column_if_missing(cursor, table: str, column: str, column_type: str) -> bool:
+    """Добавить колонку в существующую таблицу (для баз, созданных старой версией)"""
+    columns = [row["name"] for row in cursor.execute(f"PRAGMA table_info({table})")]
+    if column in columns:
+        return False
+    cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+    return True
+
+def _migration_001_initial(cursor):
+    """Базовые таблицы"""
+    # Таблица: Профили пользователей
+    cursor.execute('''
     CREATE TABLE IF NOT EXISTS profiles (
         id TEXT PRIMARY KEY,
         hh_client_id TEXT,
@@ -35,80 +97,480 @@ class Database:
         is_paid INTEGER DEFAULT 0,
         company_name TEXT,
         company_description TEXT,
-        
+
         -- НОВЫЕ ПОЛЯ ДЛЯ ПОЧТЫ
         email_provider TEXT,
         email_address TEXT,
         email_access_token TEXT,
         email_refresh_token TEXT,
         email_token_expiry TEXT,
-        
+
         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
     )
 ''')
+
+    # Таблица: Вакансии
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS vacancies (
+            id INTEGER PRIMARY KEY,
+            user_id TEXT NOT NULL,
+            title TEXT NOT NULL,
+            pro_talk_criteria TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES profiles (id)
+        )
+    ''')
+
+    # Таблица: Кандидаты
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS candidates (
+            id INTEGER PRIMARY KEY,
+            user_id TEXT NOT NULL,
+            vacancy_id INTEGER,
+            full_name TEXT,
+            email TEXT,
+            phone TEXT,
+            salary TEXT,
+            resume_url TEXT,
+            analysis_result TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES profiles (id),
+            FOREIGN KEY (vacancy_id) REFERENCES vacancies (id)
+        )
+    ''')
+
+def _migration_002_analysis_cache(cursor):
+    """Кэш результатов AI-анализа (ключ — хэш резюме, критериев, модели и версии промпта)"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS analysis_cache (
+            cache_key TEXT PRIMARY KEY,
+            result TEXT NOT NULL,
+            model TEXT,
+            prompt_version TEXT,
+            hits INTEGER DEFAULT 0,
+            created_at REAL NOT NULL,
+            last_used_at REAL NOT NULL
+        )
+    ''')
+
+def _migration_003_candidate_verdict(cursor):
+    """Вердикт и число совпадений отдельными колонками, чтобы статистика не разбирала JSON"""
+    for column, column_type in (('verdict', 'TEXT'), ('matches_count', 'INTEGER')):
+        if _add_column_if_missing(cursor, 'candidates', column, column_type):
+            # Заполняем из уже сохранённых результатов анализа
+            cursor.execute(f'''
+                UPDATE candidates SET {column} = json_extract(analysis_result, '$.{column}')
+                WHERE analysis_result IS NOT NULL AND json_valid(analysis_result)
+            ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_candidates_user_verdict
+        ON candidates (user_id, verdict)
+    ''')
+
+def _migration_004_hot_path_indexes(cursor):
+    """Индексы для списков: фильтр по user_id (+ vacancy_id) и сортировка по created_at"""
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_candidates_user_vacancy_created
+        ON candidates (user_id, vacancy_id, created_at)
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_candidates_user_created
+        ON candidates (user_id, created_at)
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_vacancies_user_created
+        ON vacancies (user_id, created_at)
+    ''')
+
+def _migration_005_dashboard_overview_index(cursor):
+    """Покрывающий индекс для подсчёта кандидатов и подходящих по вакансиям"""
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_candidates_user_vacancy_verdict
+        ON candidates (user_id, vacancy_id, verdict)
+    ''')
+
+def _migration_006_jobs(cursor):
+    """Очередь фоновых задач (анализ загруженных резюме)"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            user_id TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            data BLOB,
+            status TEXT NOT NULL DEFAULT 'queued',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            max_attempts INTEGER NOT NULL DEFAULT 3,
+            run_at REAL NOT NULL,
+            locked_by TEXT,
+            locked_until REAL,
+            result TEXT,
+            error TEXT,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL
+        )
+    ''')
+    # Выбор следующей задачи: status = 'queued' AND run_at <= ? ORDER BY run_at
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_jobs_status_run_at
+        ON jobs (status, run_at)
+    ''')
+
+def _migration_007_candidates_fts(cursor):
+    """Полнотекстовый поиск по резюме, имени и результатам анализа кандидатов (FTS5)"""
+    _add_column_if_missing(cursor, 'candidates', 'resume_text', 'TEXT')
+    # Что индексируем: совпавшие критерии и причину достаём из JSON анализа,
+    # «ё» заменяем на «е» (unicode61 не считает их одной буквой).
+    # Без подзапросов (json_each): FTS5 читает содержимое из представления сам
+    cursor.execute('''
+        CREATE VIEW IF NOT EXISTS candidates_search AS
+        SELECT id, full_name, replace(replace(resume_text, 'ё', 'е'), 'Ё', 'Е') AS resume_text,
+               CASE WHEN json_valid(analysis_result) THEN replace(replace(replace(
+                   json_extract(analysis_result, '$.matched_criteria'), '","', ', '), '["', ''), '"]', '')
+               END AS matched_criteria,
+               CASE WHEN json_valid(analysis_result) THEN json_extract(analysis_result, '$.reason') END AS reason
+        FROM candidates
+    ''')
+    # External content: сам текст хранится только в candidates, в индексе — словарь
+    cursor.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS candidates_fts USING fts5(
+            full_name, resume_text, matched_criteria, reason,
+            content='candidates_search', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+        )
+    ''')
+    # Старую запись убираем из индекса до вставки: INSERT OR REPLACE удаляет строку
+    # без срабатывания DELETE-триггеров (recursive_triggers выключены)
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS candidates_fts_before_insert BEFORE INSERT ON candidates BEGIN
+            INSERT INTO candidates_fts (candidates_fts, rowid, full_name, resume_text, matched_criteria, reason)
+            SELECT 'delete', id, full_name, resume_text, matched_criteria, reason
+            FROM candidates_search WHERE id = new.id;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS candidates_fts_after_insert AFTER INSERT ON candidates BEGIN
+            INSERT INTO candidates_fts (rowid, full_name, resume_text, matched_criteria, reason)
+            SELECT id, full_name, resume_text, matched_criteria, reason
+            FROM candidates_search WHERE id = new.id;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS candidates_fts_before_update
+        BEFORE UPDATE OF full_name, resume_text, analysis_result ON candidates BEGIN
+            INSERT INTO candidates_fts (candidates_fts, rowid, full_name, resume_text, matched_criteria, reason)
+            SELECT 'delete', id, full_name, resume_text, matched_criteria, reason
+            FROM candidates_search WHERE id = old.id;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS candidates_fts_after_update
+        AFTER UPDATE OF full_name, resume_text, analysis_result ON candidates BEGIN
+            INSERT INTO candidates_fts (rowid, full_name, resume_text, matched_criteria, reason)
+            SELECT id, full_name, resume_text, matched_criteria, reason
+            FROM candidates_search WHERE id = new.id;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS candidates_fts_before_delete BEFORE DELETE ON candidates BEGIN
+            INSERT INTO candidates_fts (candidates_fts, rowid, full_name, resume_text, matched_criteria, reason)
+            SELECT 'delete', id, full_name, resume_text, matched_criteria, reason
+            FROM candidates_search WHERE id = old.id;
+        END
+    ''')
+    # Индексируем уже сохранённых кандидатов
+    cursor.execute("INSERT INTO candidates_fts (candidates_fts) VALUES ('rebuild')")
+
+def _migration_008_vacancy_profile_cache(cursor):
+    """Кэш сгенерированных профилей вакансий (ключ — нормализованное название, модель и версия промпта)"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS vacancy_profile_cache (
+            cache_key TEXT PRIMARY KEY,
+            title TEXT NOT NULL,
+            profile TEXT NOT NULL,
+            model TEXT,
+            prompt_version TEXT,
+            hits INTEGER DEFAULT 0,
+            created_at REAL NOT NULL,
+            last_used_at REAL NOT NULL
+        )
+    ''')
+
+def _migration_009_email_outbox(cursor):
+    """Исходящие письма: отправляются в фоне с повторами, у каждого письма свой статус"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS email_outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            batch_id TEXT NOT NULL,
+            user_id TEXT NOT NULL,
+            provider TEXT,
+            candidate_id INTEGER,
+            to_email TEXT NOT NULL,
+            subject TEXT NOT NULL,
+            body TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'queued',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            max_attempts INTEGER NOT NULL DEFAULT 5,
+            run_at REAL NOT NULL,
+            locked_until REAL,
+            error TEXT,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL,
+            sent_at REAL
+        )
+    ''')
+    # Выбор следующего письма: status = 'queued' AND run_at <= ? ORDER BY run_at
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_email_outbox_status_run_at
+        ON email_outbox (status, run_at)
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_email_outbox_batch
+        ON email_outbox (batch_id)
+    ''')
+
+def _migration_010_profile_version(cursor):
+    """Версия профиля: растёт при каждом изменении, по ней проверяется кэш профилей в памяти"""
+    cursor.execute("ALTER TABLE profiles ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+
+# ID кандидатов из файлов выдаются начиная с этого значения (меньше 2^53 — JavaScript читает без потерь)
+UPLOADED_CANDIDATE_ID_BASE = 10 ** 15
+
+def _migration_011_candidate_ids(cursor):
+    """Счётчик ID кандидатов из загруженных файлов (выдаёт SQLite, общий для всех воркеров)"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS candidate_ids (
+            id INTEGER PRIMARY KEY AUTOINCREMENT
+        )
+    ''')
+    # Начинаем выше ID от клиентов (Date.now()) и уже сохранённых кандидатов, чтобы не перезаписать их
+    cursor.execute(
+        "INSERT INTO sqlite_sequence (name, seq) SELECT 'candidate_ids', MAX(COALESCE(MAX(id), 0), ?) FROM candidates",
+        (UPLOADED_CANDIDATE_ID_BASE,)
+    )
+
+def _migration_012_email_outbox_locked_by(cursor):
+    """Кто отправляет письмо: итог записывает только воркер, который держит аренду"""
+    _add_column_if_missing(cursor, "email_outbox", "locked_by", "TEXT")
+
+def _migration_013_app_locks(cursor):
+    """Блокировки фоновых задач: задачу, общую для всех воркеров, выполняет один из них"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS app_locks (
+            name TEXT PRIMARY KEY,
+            owner TEXT NOT NULL,
+            locked_until REAL NOT NULL
+        )
+    ''')
+
+MIGRATIONS = [
+    (1, "Базовые таблицы", _migration_001_initial),
+    (2, "Кэш анализа резюме", _migration_002_analysis_cache),
+    (3, "Колонки verdict и matches_count у кандидатов", _migration_003_candidate_verdict),
+    (4, "Индексы для списков кандидатов и вакансий", _migration_004_hot_path_indexes),
+    (5, "Индекс для сводки дашборда по вакансиям", _migration_005_dashboard_overview_index),
+    (6, "Очередь фоновых задач", _migration_006_jobs),
+    (7, "Полнотекстовый поиск по кандидатам", _migration_007_candidates_fts),
+    (8, "Кэш профилей вакансий", _migration_008_vacancy_profile_cache),
+    (9, "Очередь исходящих писем", _migration_009_email_outbox),
+    (10, "Версия профиля для кэша в памяти", _migration_010_profile_version),
+    (11, "Счётчик ID кандидатов из файлов", _migration_011_candidate_ids),
+    (12, "Владелец аренды письма", _migration_012_email_outbox_locked_by),
+    (13, "Блокировки фоновых задач", _migration_013_app_locks),
+]
+
+def _decode_profile(row: sqlite3.Row) -> Dict[str, Any]:
+    """Профиль из строки БД: telegram_chat_ids — список, is_paid — bool"""
+    profile = dict(row)
+    try:
+        chat_ids = json.loads(profile.get('telegram_chat_ids') or '[]')
+    except (TypeError, ValueError):
+        chat_ids = []
+    profile['telegram_chat_ids'] = chat_ids if isinstance(chat_ids, list) else []
+    profile['is_paid'] = bool(profile.get('is_paid') or 0)
+    return profile
+
+def _copy_profile(profile: Dict[str, Any]) -> Dict[str, Any]:
+    """Копия профиля из кэша: изменения у вызывающего не попадут в кэш"""
+    return {**profile, 'telegram_chat_ids': list(profile['telegram_chat_ids'])}
+
+class Database:
+    """Класс для работы с SQLite базой данных"""
+    
+    def __init__(self, db_file: str = DB_FILE):
+        self.db_file = db_file
+        # Долгоживущие соединения: по одному на поток
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._connections_lock = threading.Lock()
+        # Профили уже в разобранном виде; актуальность проверяется по profiles.version,
+        # поэтому изменения из других воркеров uvicorn видны сразу
+        self.profile_cache = LRUCache(PROFILE_CACHE_SIZE)
+        self.profile_cache_counters = {"hits": 0, "misses": 0}
+        # get_profile выполняется в нескольких потоках чтения: «+= 1» без блокировки теряет значения
+        self._profile_stats_lock = threading.Lock()
+        self.init_database()
+    
+    def _connect(self) -> sqlite3.Connection:
+        """Открыть новое соединение и настроить PRAGMA"""
+        conn = sqlite3.connect(
+            self.db_file,
+            timeout=SQLITE_BUSY_TIMEOUT_MS / 1000,
+            cached_statements=SQLITE_STATEMENT_CACHE,
+            check_same_thread=False  # закрываем из close() в другом потоке
+        )
+        conn.row_factory = sqlite3.Row  # Возвращать результаты как словари
         
-        # Таблица: Вакансии
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS vacancies (
-                id INTEGER PRIMARY KEY,
-                user_id TEXT NOT NULL,
-                title TEXT NOT NULL,
-                pro_talk_criteria TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES profiles (id)
-            )
-        ''')
-        
-        # Таблица: Кандидаты
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS candidates (
-                id INTEGER PRIMARY KEY,
-                user_id TEXT NOT NULL,
-                vacancy_id INTEGER,
-                full_name TEXT,
-                email TEXT,
-                phone TEXT,
-                salary TEXT,
-                resume_url TEXT,
-                analysis_result TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES profiles (id),
-                FOREIGN KEY (vacancy_id) REFERENCES vacancies (id)
+        # WAL: читатели не блокируются писателем
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        conn.execute(f"PRAGMA busy_timeout = {SQLITE_BUSY_TIMEOUT_MS}")
+        conn.execute(f"PRAGMA cache_size = -{SQLITE_CACHE_SIZE_KB}")
+        conn.execute(f"PRAGMA mmap_size = {SQLITE_MMAP_SIZE}")
+        conn.execute("PRAGMA temp_store = MEMORY")
+        return conn
+    
+    def get_connection(self) -> sqlite3.Connection:
+        """Получить соединение текущего потока (открывается один раз и переиспользуется)"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+    
+    def close(self):
+        """Закрыть все открытые соединения (при остановке приложения)"""
+        with self._connections_lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+        self._local = threading.local()
+    
+    def init_database(self):
+        """Создать таблицы и применить недостающие миграции"""
+        applied = self.migrate()
+        print(f"✅ База данных '{self.db_file}' инициализирована "
+              f"(версия схемы {self.get_schema_version()}, применено миграций: {applied})")
+
+    # === МИГРАЦИИ ===
+
+    def migrate(self) -> int:
+        """Применить недостающие миграции по порядку, вернуть их количество"""
+        conn = self.get_connection()
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                description TEXT,
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             )
         ''')
-        
         conn.commit()
-        conn.close()
-        print(f"✅ База данных '{self.db_file}' инициализирована")
-    
+
+        applied = 0
+        for version, description, migration in MIGRATIONS:
+            # BEGIN IMMEDIATE: несколько воркеров uvicorn не применят миграцию дважды
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                done = conn.execute(
+                    "SELECT 1 FROM schema_version WHERE version = ?", (version,)
+                ).fetchone()
+                if not done:
+                    migration(conn.cursor())
+                    conn.execute(
+                        "INSERT INTO schema_version (version, description) VALUES (?, ?)",
+                        (version, description)
+                    )
+                    applied += 1
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+
+        if applied:
+            # Обновляем статистику планировщика после новых индексов
+            conn.execute("PRAGMA optimize")
+        return applied
+
+    def get_schema_version(self) -> int:
+        """Текущая версия схемы"""
+        row = self.get_connection().execute("SELECT MAX(version) FROM schema_version").fetchone()
+        return row[0] or 0
+
+    def explain_query_plan(self, query: str, params: tuple = ()) -> List[str]:
+        """План выполнения запроса (EXPLAIN QUERY PLAN) — для проверки индексов"""
+        rows = self.get_connection().execute(f"EXPLAIN QUERY PLAN {query}", params).fetchall()
+        return [row["detail"] for row in rows]
+
     # === ПРОФИЛИ ===
     
     def get_profile(self, user_id: str) -> Optional[Dict[str, Any]]:
-        """Получить профиль пользователя"""
+        """
+        Получить профиль пользователя
+
+        telegram_chat_ids возвращается списком, is_paid — bool. Профиль берётся из кэша,
+        если его версия совпадает с profiles.version (чтение одного числа по первичному ключу).
+        """
         conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM profiles WHERE id = ?", (user_id,))
-        row = cursor.fetchone()
-        conn.close()
-        return dict(row) if row else None
+        cached = self.profile_cache.get(user_id)
+        if cached is not None:
+            row = conn.execute("SELECT version FROM profiles WHERE id = ?", (user_id,)).fetchone()
+            if row is not None and row[0] == cached['version']:
+                self._count_profile_cache("hits")
+                return _copy_profile(cached)
+        
+        self._count_profile_cache("misses")
+        row = conn.execute("SELECT * FROM profiles WHERE id = ?", (user_id,)).fetchone()
+        return self._cache_profile(user_id, row)
+    
+    def _count_profile_cache(self, name: str):
+        with self._profile_stats_lock:
+            self.profile_cache_counters[name] += 1
+    
+    def get_profile_version(self, user_id: str) -> Optional[int]:
+        """Версия профиля (None — профиля нет): по ней кэши в памяти проверяют актуальность"""
+        row = self.get_connection().execute("SELECT version FROM profiles WHERE id = ?", (user_id,)).fetchone()
+        return row[0] if row else None
+    
+    def _cache_profile(self, user_id: str, row: Optional[sqlite3.Row]) -> Optional[Dict[str, Any]]:
+        """Положить свежую строку профиля в кэш и вернуть её копию"""
+        if row is None:
+            self.profile_cache.pop(user_id)
+            return None
+        profile = _decode_profile(row)
+        self.profile_cache.put(user_id, profile)
+        return _copy_profile(profile)
     
     def create_profile(self, user_id: str) -> Dict[str, Any]:
         """Создать новый профиль"""
         conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            "INSERT INTO profiles (id, telegram_chat_ids) VALUES (?, ?)",
-            (user_id, "[]")
-        )
-        conn.commit()
-        conn.close()
-        return self.get_profile(user_id)
+        with conn:
+            rows = conn.execute(
+                "INSERT INTO profiles (id, telegram_chat_ids) VALUES (?, ?) RETURNING *",
+                (user_id, "[]")
+            ).fetchall()
+        return self._cache_profile(user_id, rows[0])
     
     def update_profile(self, user_id: str, **kwargs) -> Optional[Dict[str, Any]]:
-        """Обновить профиль"""
+        """
+        Обновить профиль
+        
+        telegram_chat_ids можно передать списком, is_paid — bool. Версия профиля
+        увеличивается в том же UPDATE, новая строка сразу попадает в кэш.
+        """
+        kwargs.pop('version', None)  # версией управляет только база
         if not kwargs:
             return self.get_profile(user_id)
         
+        if isinstance(kwargs.get('telegram_chat_ids'), list):
+            kwargs['telegram_chat_ids'] = json.dumps(kwargs['telegram_chat_ids'])
+        if 'is_paid' in kwargs:
+            kwargs['is_paid'] = 1 if kwargs['is_paid'] else 0
+        
         # Формируем SET часть запроса
         set_parts = []
         values = []
@@ -118,50 +580,48 @@ class Database:
         values.append(user_id)
         
         conn = self.get_connection()
-        cursor = conn.cursor()
-        query = f"UPDATE profiles SET {', '.join(set_parts)} WHERE id = ?"
-        cursor.execute(query, values)
-        conn.commit()
-        conn.close()
+        query = f"UPDATE profiles SET {', '.join(set_parts)}, version = version + 1 WHERE id = ? RETURNING *"
+        with conn:
+            # fetchall: RETURNING завершает UPDATE только после чтения всех строк
+            rows = conn.execute(query, values).fetchall()
         
-        return self.get_profile(user_id)
+        return self._cache_profile(user_id, rows[0] if rows else None)
+    
+    def get_profile_cache_stats(self) -> Dict[str, Any]:
+        """Счётчики кэша профилей"""
+        with self._profile_stats_lock:
+            return {"size": len(self.profile_cache), **self.profile_cache_counters}
     
     # === ВАКАНСИИ ===
     
     def save_vacancy(self, vacancy_id: int, user_id: str, title: str, criteria: str = None):
         """Сохранить вакансию"""
         conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            """INSERT OR REPLACE INTO vacancies (id, user_id, title, pro_talk_criteria) 
-               VALUES (?, ?, ?, ?)""",
-            (vacancy_id, user_id, title, criteria)
-        )
-        conn.commit()
-        conn.close()
+        with conn:
+            conn.execute(
+                """INSERT OR REPLACE INTO vacancies (id, user_id, title, pro_talk_criteria) 
+                   VALUES (?, ?, ?, ?)""",
+                (vacancy_id, user_id, title, criteria)
+            )
     
     def get_vacancy(self, vacancy_id: int, user_id: str) -> Optional[Dict[str, Any]]:
         """Получить вакансию"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
+        cursor = self.get_connection().cursor()
         cursor.execute(
             "SELECT * FROM vacancies WHERE id = ? AND user_id = ?",
             (vacancy_id, user_id)
         )
         row = cursor.fetchone()
-        conn.close()
         return dict(row) if row else None
     
     def get_all_vacancies(self, user_id: str) -> List[Dict[str, Any]]:
         """Получить все вакансии пользователя"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
+        cursor = self.get_connection().cursor()
         cursor.execute(
             "SELECT * FROM vacancies WHERE user_id = ? ORDER BY created_at DESC",
             (user_id,)
         )
         rows = cursor.fetchall()
-        conn.close()
         return [dict(row) for row in rows]
     
     # === КАНДИДАТЫ ===
@@ -169,48 +629,56 @@ class Database:
     def save_candidate(self, candidate_id: int, user_id: str, vacancy_id: int, 
                       full_name: str, analysis_result: str = None, **kwargs):
         """Сохранить кандидата"""
+        verdict, matches_count = _extract_verdict(analysis_result)
         conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            """INSERT OR REPLACE INTO candidates 
-               (id, user_id, vacancy_id, full_name, analysis_result, email, phone, salary, resume_url) 
-               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
-            (candidate_id, user_id, vacancy_id, full_name, analysis_result,
-             kwargs.get('email'), kwargs.get('phone'), kwargs.get('salary'), kwargs.get('resume_url'))
-        )
-        conn.commit()
-        conn.close()
+        with conn:
+            conn.execute(
+                """INSERT OR REPLACE INTO candidates 
+                   (id, user_id, vacancy_id, full_name, analysis_result, email, phone, salary, resume_url,
+                    verdict, matches_count, resume_text) 
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                (candidate_id, user_id, vacancy_id, full_name, analysis_result,
+                 kwargs.get('email'), kwargs.get('phone'), kwargs.get('salary'), kwargs.get('resume_url'),
+                 verdict, matches_count, kwargs.get('resume_text'))
+            )
+    
+    def create_candidate_id(self) -> int:
+        """Выдать новый ID кандидата (AUTOINCREMENT: не повторяется между процессами и после удаления)"""
+        conn = self.get_connection()
+        with conn:
+            candidate_id = conn.execute("INSERT INTO candidate_ids DEFAULT VALUES").lastrowid
+            # Строка не нужна: sqlite_sequence помнит последний выданный ID
+            conn.execute("DELETE FROM candidate_ids WHERE id = ?", (candidate_id,))
+        return candidate_id
     
     def get_candidate(self, candidate_id: int, user_id: str) -> Optional[Dict[str, Any]]:
         """Получить кандидата"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
+        cursor = self.get_connection().cursor()
         cursor.execute(
             "SELECT * FROM candidates WHERE id = ? AND user_id = ?",
             (candidate_id, user_id)
         )
         row = cursor.fetchone()
-        conn.close()
         return dict(row) if row else None
     
     def get_all_candidates(self, user_id: str, vacancy_id: int = None) -> List[Dict[str, Any]]:
         """Получить всех кандидатов (опционально по вакансии)"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
+        cursor = self.get_connection().cursor()
         
+        # Без resume_text: полный текст резюме нужен только в карточке кандидата
+        columns = ', '.join(CANDIDATE_FIELDS)
         if vacancy_id:
             cursor.execute(
-                "SELECT * FROM candidates WHERE user_id = ? AND vacancy_id = ? ORDER BY created_at DESC",
+                f"SELECT {columns} FROM candidates WHERE user_id = ? AND vacancy_id = ? ORDER BY created_at DESC",
                 (user_id, vacancy_id)
             )
         else:
             cursor.execute(
-                "SELECT * FROM candidates WHERE user_id = ? ORDER BY created_at DESC",
+                f"SELECT {columns} FROM candidates WHERE user_id = ? ORDER BY created_at DESC",
                 (user_id,)
             )
         
         rows = cursor.fetchall()
-        conn.close()
         
         result = []
         for row in rows:
@@ -225,38 +693,554 @@ class Database:
         
         return result
     
-    def get_dashboard_stats(self, user_id: str) -> Dict[str, Any]:
-        """Статистика для дашборда"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
+    def get_candidates_page(self, user_id: str, vacancy_id: int = None, limit: int = 100,
+                            after: Tuple[str, int] = None,
+                            fields: Sequence[str] = None) -> List[Dict[str, Any]]:
+        """
+        Страница кандидатов (keyset-пагинация по created_at, id — от новых к старым)
         
-        # Количество вакансий
-        cursor.execute("SELECT COUNT(*) FROM vacancies WHERE user_id = ?", (user_id,))
-        vac_count = cursor.fetchone()[0]
+        Args:
+            after: (created_at, id) последней строки предыдущей страницы
+            fields: какие колонки вернуть (по умолчанию все); id и created_at есть всегда
+        """
+        columns = list(CANDIDATE_FIELDS) if not fields else \
+            ['id', 'created_at'] + [f for f in fields if f in CANDIDATE_FIELDS and f not in ('id', 'created_at')]
         
-        # Количество кандидатов
-        cursor.execute("SELECT COUNT(*) FROM candidates WHERE user_id = ?", (user_id,))
-        cand_count = cursor.fetchone()[0]
+        where = ["user_id = ?"]
+        params: List[Any] = [user_id]
+        if vacancy_id:
+            where.append("vacancy_id = ?")
+            params.append(vacancy_id)
+        if after:
+            where.append("(created_at, id) < (?, ?)")
+            params.extend(after)
+        params.append(limit)
         
-        # Подходящие кандидаты (подсчёт из JSON)
-        cursor.execute("SELECT analysis_result FROM candidates WHERE user_id = ?", (user_id,))
-        rows = cursor.fetchall()
-        suitable_count = 0
-        for row in rows:
-            try:
-                analysis = json.loads(row[0]) if row[0] else {}
-                if analysis.get('verdict') == 'Подходит':
-                    suitable_count += 1
-            except:
-                pass
+        cursor = self.get_connection().cursor()
+        cursor.execute(
+            f"""SELECT {', '.join(columns)} FROM candidates 
+                WHERE {' AND '.join(where)} 
+                ORDER BY created_at DESC, id DESC LIMIT ?""",
+            params
+        )
+        
+        result = []
+        for row in cursor.fetchall():
+            r = dict(row)
+            # Преобразуем analysis_result обратно в объект
+            if r.get('analysis_result'):
+                try:
+                    r['analysis_result'] = json.loads(r['analysis_result'])
+                except ValueError:
+                    pass
+            result.append(r)
+        
+        return result
+    
+    def search_candidates(self, user_id: str, query: str, vacancy_id: int = None,
+                          limit: int = 20, rank_window: int = SEARCH_RANK_WINDOW) -> Dict[str, Any]:
+        """
+        Полнотекстовый поиск кандидатов (FTS5) по резюме, имени, совпавшим критериям и причине вердикта
+        
+        BM25 считается только для rank_window самых новых совпадений: более старые кандидаты
+        в выдачу не попадают, даже если подходят лучше. Тогда truncated = True.
+        
+        Returns:
+            {"items": кандидаты от самых релевантных с фрагментом текста, где нашлись слова,
+             "truncated": совпадений больше, чем rank_window}
+        """
+        fts_query = build_fts_query(query)
+        if not fts_query:
+            return {"items": [], "truncated": False}
+        rank_window = max(1, min(rank_window, SEARCH_RANK_WINDOW_MAX))
+        
+        where = ["candidates_fts MATCH ?", "c.user_id = ?"]
+        params: List[Any] = [fts_query, user_id]
+        if vacancy_id:
+            where.append("c.vacancy_id = ?")
+            params.append(vacancy_id)
+        conn = self.get_connection()
         
-        conn.close()
+        # 1. Ранжирование: последние rank_window совпадений (FTS5 отдаёт их по rowid
+        #    без сортировки), BM25 только для них. Веса колонок: критерии и имя важнее резюме.
+        #    Лишняя строка сверх окна показывает, что совпадений больше
+        window = conn.execute(
+            f"""SELECT c.id, bm25(candidates_fts, 3.0, 1.0, 4.0, 2.0) AS score
+                FROM candidates_fts JOIN candidates c ON c.id = candidates_fts.rowid
+                WHERE {' AND '.join(where)}
+                ORDER BY candidates_fts.rowid DESC LIMIT ?""",
+            params + [rank_window + 1]
+        ).fetchall()
+        truncated = len(window) > rank_window
+        ranked = sorted(window[:rank_window], key=lambda row: row['score'])[:limit]
+        if not ranked:
+            return {"items": [], "truncated": False}
+        scores = {row['id']: row['score'] for row in ranked}
+        
+        # 2. Фрагменты текста — только для выдачи. FTS5 получает один диапазон rowid,
+        #    а не IN: на каждое значение IN он заново разбирал бы запрос («pyth*» — мс на значение)
+        placeholders = ', '.join('?' * len(scores))
+        rows = conn.execute(
+            f"""SELECT c.id, c.vacancy_id, c.full_name, c.verdict, c.matches_count, c.created_at,
+                       snippet(candidates_fts, -1, '<mark>', '</mark>', '…', 16) AS snippet
+                FROM candidates_fts JOIN candidates c ON c.id = candidates_fts.rowid
+                WHERE candidates_fts MATCH ? AND candidates_fts.rowid BETWEEN ? AND ?
+                  AND +candidates_fts.rowid IN ({placeholders})""",
+            [fts_query, min(scores), max(scores), *scores]
+        ).fetchall()
+        results = [{**dict(row), "score": scores[row['id']]} for row in rows]
+        results.sort(key=lambda item: item["score"])
+        return {"items": results, "truncated": truncated}
+    
+    def get_dashboard_stats(self, user_id: str) -> Dict[str, Any]:
+        """Статистика для дашборда (один запрос по индексам)"""
+        cursor = self.get_connection().cursor()
+        cursor.execute(
+            """SELECT
+                   (SELECT COUNT(*) FROM vacancies WHERE user_id = ?),
+                   (SELECT COUNT(*) FROM candidates WHERE user_id = ?),
+                   (SELECT COUNT(*) FROM candidates WHERE user_id = ? AND verdict = 'Подходит')""",
+            (user_id, user_id, user_id)
+        )
+        vac_count, cand_count, suitable_count = cursor.fetchone()
         
         return {
             "vacancies": vac_count,
             "candidates": cand_count,
             "suitable": suitable_count
         }
+    
+    def get_dashboard_overview(self, user_id: str) -> Dict[str, Any]:
+        """Сводка для дашборда: общая статистика и вакансии с числом кандидатов"""
+        cursor = self.get_connection().cursor()
+        cursor.execute(
+            """SELECT v.id, v.title, v.created_at,
+                      COALESCE(c.candidates, 0) AS candidates,
+                      COALESCE(c.suitable, 0) AS suitable
+               FROM vacancies v
+               LEFT JOIN (
+                   SELECT vacancy_id, COUNT(*) AS candidates, SUM(verdict = 'Подходит') AS suitable
+                   FROM candidates WHERE user_id = ? GROUP BY vacancy_id
+               ) c ON c.vacancy_id = v.id
+               WHERE v.user_id = ?
+               ORDER BY v.created_at DESC""",
+            (user_id, user_id)
+        )
+        vacancies = [dict(row) for row in cursor.fetchall()]
+        
+        return {
+            "stats": self.get_dashboard_stats(user_id),
+            "vacancies": vacancies
+        }
+    
+    # === КЭШ АНАЛИЗА ===
+    
+    def get_analysis_cache(self, cache_key: str) -> Optional[Dict[str, Any]]:
+        """Получить закэшированный результат анализа (использование отмечает touch_analysis_cache)"""
+        row = self.get_connection().execute(
+            "SELECT result, created_at FROM analysis_cache WHERE cache_key = ?",
+            (cache_key,)
+        ).fetchone()
+        if not row:
+            return None
+        return {"result": json.loads(row["result"]), "created_at": row["created_at"]}
+    
+    def touch_analysis_cache(self, cache_key: str):
+        """Отметить использование результата анализа из кэша"""
+        conn = self.get_connection()
+        with conn:
+            conn.execute(
+                "UPDATE analysis_cache SET hits = hits + 1, last_used_at = ? WHERE cache_key = ?",
+                (time.time(), cache_key)
+            )
+    
+    def save_analysis_cache(self, cache_key: str, result: Dict[str, Any], model: str, prompt_version: str):
+        """Сохранить результат анализа в кэш"""
+        now = time.time()
+        conn = self.get_connection()
+        with conn:
+            conn.execute(
+                """INSERT OR REPLACE INTO analysis_cache 
+                   (cache_key, result, model, prompt_version, hits, created_at, last_used_at) 
+                   VALUES (?, ?, ?, ?, 0, ?, ?)""",
+                (cache_key, json.dumps(result, ensure_ascii=False), model, prompt_version, now, now)
+            )
+    
+    def evict_analysis_cache(self, max_entries: int, max_age_seconds: float) -> int:
+        """Удалить устаревшие записи и самые давно использованные сверх лимита"""
+        conn = self.get_connection()
+        with conn:
+            deleted = conn.execute(
+                "DELETE FROM analysis_cache WHERE created_at < ?",
+                (time.time() - max_age_seconds,)
+            ).rowcount
+            deleted += conn.execute(
+                """DELETE FROM analysis_cache WHERE cache_key IN (
+                       SELECT cache_key FROM analysis_cache 
+                       ORDER BY last_used_at DESC LIMIT -1 OFFSET ?
+                   )""",
+                (max_entries,)
+            ).rowcount
+        return deleted
+    
+    # === КЭШ ПРОФИЛЕЙ ВАКАНСИЙ ===
+    
+    def get_vacancy_profile_cache(self, cache_key: str) -> Optional[Dict[str, Any]]:
+        """Получить закэшированный профиль вакансии (использование отмечает touch_vacancy_profile_cache)"""
+        row = self.get_connection().execute(
+            "SELECT profile, created_at FROM vacancy_profile_cache WHERE cache_key = ?",
+            (cache_key,)
+        ).fetchone()
+        if not row:
+            return None
+        return {"profile": json.loads(row["profile"]), "created_at": row["created_at"]}
+    
+    def touch_vacancy_profile_cache(self, cache_key: str):
+        """Отметить использование профиля вакансии из кэша"""
+        conn = self.get_connection()
+        with conn:
+            conn.execute(
+                "UPDATE vacancy_profile_cache SET hits = hits + 1, last_used_at = ? WHERE cache_key = ?",
+                (time.time(), cache_key)
+            )
+    
+    def save_vacancy_profile_cache(self, cache_key: str, title: str, profile: Dict[str, Any],
+                                   model: str, prompt_version: str):
+        """Сохранить профиль вакансии в кэш (счётчик использований сохраняется)"""
+        now = time.time()
+        conn = self.get_connection()
+        with conn:
+            conn.execute(
+                """INSERT INTO vacancy_profile_cache 
+                   (cache_key, title, profile, model, prompt_version, hits, created_at, last_used_at) 
+                   VALUES (?, ?, ?, ?, ?, 0, ?, ?)
+                   ON CONFLICT (cache_key) DO UPDATE SET 
+                       title = excluded.title, profile = excluded.profile, created_at = excluded.created_at""",
+                (cache_key, title, json.dumps(profile, ensure_ascii=False), model, prompt_version, now, now)
+            )
+    
+    def get_hot_vacancy_profiles(self, limit: int, max_age_seconds: float) -> List[Dict[str, Any]]:
+        """Самые востребованные свежие профили из кэша (для загрузки в память при старте)"""
+        rows = self.get_connection().execute(
+            """SELECT cache_key, profile, created_at FROM vacancy_profile_cache 
+               WHERE created_at >= ? ORDER BY hits DESC LIMIT ?""",
+            (time.time() - max_age_seconds, limit)
+        ).fetchall()
+        return [{"cache_key": row["cache_key"], "profile": json.loads(row["profile"]),
+                 "created_at": row["created_at"]} for row in rows]
+    
+    def get_popular_vacancy_titles(self, limit: int) -> List[Dict[str, Any]]:
+        """Частые названия вакансий: сколько раз создавали такую вакансию и запрашивали профиль"""
+        rows = self.get_connection().execute(
+            """SELECT title, COUNT(*) AS uses FROM vacancies WHERE trim(title) != '' GROUP BY title
+               UNION ALL
+               SELECT title, hits AS uses FROM vacancy_profile_cache
+               ORDER BY uses DESC LIMIT ?""",
+            (limit,)
+        ).fetchall()
+        return [dict(row) for row in rows]
+    
+    def evict_vacancy_profile_cache(self, max_entries: int, max_age_seconds: float) -> int:
+        """Удалить устаревшие профили и самые давно использованные сверх лимита"""
+        conn = self.get_connection()
+        with conn:
+            deleted = conn.execute(
+                "DELETE FROM vacancy_profile_cache WHERE created_at < ?",
+                (time.time() - max_age_seconds,)
+            ).rowcount
+            deleted += conn.execute(
+                """DELETE FROM vacancy_profile_cache WHERE cache_key IN (
+                       SELECT cache_key FROM vacancy_profile_cache 
+                       ORDER BY last_used_at DESC LIMIT -1 OFFSET ?
+                   )""",
+                (max_entries,)
+            ).rowcount
+        return deleted
+    
+    # === ОЧЕРЕДЬ ЗАДАЧ ===
+    
+    @staticmethod
+    def _decode_job(row: sqlite3.Row) -> Dict[str, Any]:
+        job = dict(row)
+        job['payload'] = json.loads(job['payload'])
+        if job.get('result') is not None:
+            job['result'] = json.loads(job['result'])
+        return job
+    
+    def create_job(self, kind: str, user_id: str, payload: Dict[str, Any],
+                   data: bytes = None, max_attempts: int = 3) -> int:
+        """Поставить задачу в очередь, вернуть её ID"""
+        now = time.time()
+        conn = self.get_connection()
+        with conn:
+            cursor = conn.execute(
+                """INSERT INTO jobs (kind, user_id, payload, data, max_attempts, run_at, created_at, updated_at)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+                (kind, user_id, json.dumps(payload, ensure_ascii=False), data, max_attempts, now, now, now)
+            )
+        return cursor.lastrowid
+    
+    def claim_job(self, worker_id: str, lease_seconds: float) -> Optional[Dict[str, Any]]:
+        """Взять следующую готовую задачу (одним UPDATE, две копии не возьмут одну задачу)"""
+        now = time.time()
+        conn = self.get_connection()
+        with conn:
+            rows = conn.execute(
+                """UPDATE jobs 
+                   SET status = 'running', attempts = attempts + 1, 
+                       locked_by = ?, locked_until = ?, updated_at = ?
+                   WHERE id = (
+                       SELECT id FROM jobs WHERE status = 'queued' AND run_at <= ?
+                       ORDER BY run_at LIMIT 1
+                   )
+                   RETURNING *""",
+                (worker_id, now + lease_seconds, now, now)
+            ).fetchall()
+        return self._decode_job(rows[0]) if rows else None
+    
+    def update_job_lease(self, job_id: int, worker_id: str, lease_seconds: float) -> bool:
+        """Продлить аренду выполняемой задачи (False — задачу уже забрали)"""
+        conn = self.get_connection()
+        with conn:
+            updated = conn.execute(
+                """UPDATE jobs SET locked_until = ? 
+                   WHERE id = ? AND status = 'running' AND locked_by = ?""",
+                (time.time() + lease_seconds, job_id, worker_id)
+            ).rowcount
+        return updated > 0
+    
+    def finish_job(self, job_id: int, worker_id: str, result: Dict[str, Any]) -> bool:
+        """Отметить задачу выполненной и сохранить результат (False — аренду уже забрали)"""
+        conn = self.get_connection()
+        with conn:
+            updated = conn.execute(
+                """UPDATE jobs SET status = 'done', result = ?, error = NULL, data = NULL,
+                          locked_by = NULL, locked_until = NULL, updated_at = ?
+                   WHERE id = ? AND status = 'running' AND locked_by = ?""",
+                (json.dumps(result, ensure_ascii=False), time.time(), job_id, worker_id)
+            ).rowcount
+        return updated > 0
+    
+    def fail_job(self, job_id: int, worker_id: str, error: str, retry_at: float = None) -> bool:
+        """Ошибка задачи: вернуть в очередь на retry_at или пометить проваленной (False — аренду уже забрали)"""
+        conn = self.get_connection()
+        with conn:
+            if retry_at is not None:
+                updated = conn.execute(
+                    """UPDATE jobs SET status = 'queued', run_at = ?, error = ?,
+                              locked_by = NULL, locked_until = NULL, updated_at = ?
+                       WHERE id = ? AND status = 'running' AND locked_by = ?""",
+                    (retry_at, error, time.time(), job_id, worker_id)
+                ).rowcount
+            else:
+                updated = conn.execute(
+                    """UPDATE jobs SET status = 'failed', error = ?, data = NULL,
+                              locked_by = NULL, locked_until = NULL, updated_at = ?
+                       WHERE id = ? AND status = 'running' AND locked_by = ?""",
+                    (error, time.time(), job_id, worker_id)
+                ).rowcount
+        return updated > 0
+    
+    def requeue_job(self, job_id: int, worker_id: str):
+        """Вернуть прерванную задачу в очередь, не засчитывая попытку (остановка приложения)"""
+        conn = self.get_connection()
+        with conn:
+            conn.execute(
+                """UPDATE jobs SET status = 'queued', attempts = MAX(attempts - 1, 0),
+                          locked_by = NULL, locked_until = NULL, updated_at = ?
+                   WHERE id = ? AND status = 'running' AND locked_by = ?""",
+                (time.time(), job_id, worker_id)
+            )
+    
+    def requeue_expired_jobs(self) -> int:
+        """Задачи с истёкшей арендой (процесс упал) — обратно в очередь или в failed"""
+        now = time.time()
+        conn = self.get_connection()
+        with conn:
+            requeued = conn.execute(
+                """UPDATE jobs SET status = 'queued', run_at = ?, 
+                          locked_by = NULL, locked_until = NULL, updated_at = ?
+                   WHERE status = 'running' AND locked_until < ? AND attempts < max_attempts""",
+                (now, now, now)
+            ).rowcount
+            conn.execute(
+                """UPDATE jobs SET status = 'failed', error = 'Обработка прервана', data = NULL,
+                          locked_by = NULL, locked_until = NULL, updated_at = ?
+                   WHERE status = 'running' AND locked_until < ?""",
+                (now, now)
+            )
+        return requeued
+    
+    def get_job(self, job_id: int, user_id: str) -> Optional[Dict[str, Any]]:
+        """Статус и результат задачи пользователя (без содержимого файла)"""
+        row = self.get_connection().execute(
+            """SELECT id, kind, status, attempts, max_attempts, payload, result, error,
+                      run_at, created_at, updated_at
+               FROM jobs WHERE id = ? AND user_id = ?""",
+            (job_id, user_id)
+        ).fetchone()
+        return self._decode_job(row) if row else None
+    
+    def get_job_counts(self) -> Dict[str, int]:
+        """Число задач по статусам"""
+        rows = self.get_connection().execute(
+            "SELECT status, COUNT(*) FROM jobs GROUP BY status"
+        ).fetchall()
+        return {row[0]: row[1] for row in rows}
+    
+    def delete_finished_jobs(self, max_age_seconds: float) -> int:
+        """Удалить выполненные и проваленные задачи старше max_age_seconds"""
+        conn = self.get_connection()
+        with conn:
+            deleted = conn.execute(
+                "DELETE FROM jobs WHERE status IN ('done', 'failed') AND updated_at < ?",
+                (time.time() - max_age_seconds,)
+            ).rowcount
+        return deleted
+
+    
+    # === ИСХОДЯЩИЕ ПИСЬМА ===
+    
+    def create_emails(self, batch_id: str, user_id: str, provider: str, messages: List[Dict[str, Any]],
+                      max_attempts: int = 5) -> List[int]:
+        """Поставить письма в очередь одной транзакцией, вернуть их ID"""
+        now = time.time()
+        conn = self.get_connection()
+        ids = []
+        with conn:
+            for message in messages:
+                cursor = conn.execute(
+                    """INSERT INTO email_outbox 
+                       (batch_id, user_id, provider, candidate_id, to_email, subject, body,
+                        max_attempts, run_at, created_at, updated_at)
+                       VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                    (batch_id, user_id, provider, message.get('candidate_id'), message['to_email'],
+                     message['subject'], message['body'], max_attempts, now, now, now)
+                )
+                ids.append(cursor.lastrowid)
+        return ids
+    
+    def claim_email(self, worker_id: str, lease_seconds: float) -> Optional[Dict[str, Any]]:
+        """Взять следующее готовое к отправке письмо"""
+        now = time.time()
+        conn = self.get_connection()
+        with conn:
+            rows = conn.execute(
+                """UPDATE email_outbox 
+                   SET status = 'sending', attempts = attempts + 1, 
+                       locked_by = ?, locked_until = ?, updated_at = ?
+                   WHERE id = (
+                       SELECT id FROM email_outbox WHERE status = 'queued' AND run_at <= ?
+                       ORDER BY run_at LIMIT 1
+                   )
+                   RETURNING *""",
+                (worker_id, now + lease_seconds, now, now)
+            ).fetchall()
+        return dict(rows[0]) if rows else None
+    
+    def finish_email(self, email_id: int, worker_id: str) -> bool:
+        """Отметить письмо отправленным (False — аренду уже забрали)"""
+        now = time.time()
+        conn = self.get_connection()
+        with conn:
+            updated = conn.execute(
+                """UPDATE email_outbox SET status = 'sent', error = NULL, 
+                          locked_by = NULL, locked_until = NULL, sent_at = ?, updated_at = ?
+                   WHERE id = ? AND status = 'sending' AND locked_by = ?""",
+                (now, now, email_id, worker_id)
+            ).rowcount
+        return updated > 0
+    
+    def fail_email(self, email_id: int, worker_id: str, error: str, retry_at: float = None) -> bool:
+        """Ошибка отправки: вернуть письмо в очередь на retry_at или пометить проваленным (False — аренду уже забрали)"""
+        conn = self.get_connection()
+        with conn:
+            updated = conn.execute(
+                """UPDATE email_outbox SET status = ?, run_at = COALESCE(?, run_at), error = ?,
+                          locked_by = NULL, locked_until = NULL, updated_at = ?
+                   WHERE id = ? AND status = 'sending' AND locked_by = ?""",
+                ('queued' if retry_at is not None else 'failed', retry_at, error, time.time(),
+                 email_id, worker_id)
+            ).rowcount
+        return updated > 0
+    
+    def requeue_email(self, email_id: int, worker_id: str):
+        """Вернуть прерванное письмо в очередь, не засчитывая попытку (остановка приложения)"""
+        conn = self.get_connection()
+        with conn:
+            conn.execute(
+                """UPDATE email_outbox SET status = 'queued', attempts = MAX(attempts - 1, 0),
+                          locked_by = NULL, locked_until = NULL, updated_at = ?
+                   WHERE id = ? AND status = 'sending' AND locked_by = ?""",
+                (time.time(), email_id, worker_id)
+            )
+    
+    def requeue_expired_emails(self) -> int:
+        """Письма с истёкшей арендой (процесс упал во время отправки) — обратно в очередь"""
+        now = time.time()
+        conn = self.get_connection()
+        with conn:
+            requeued = conn.execute(
+                """UPDATE email_outbox SET status = 'queued', run_at = ?, 
+                          locked_by = NULL, locked_until = NULL, updated_at = ?
+                   WHERE status = 'sending' AND locked_until < ? AND attempts < max_attempts""",
+                (now, now, now)
+            ).rowcount
+            conn.execute(
+                """UPDATE email_outbox SET status = 'failed', error = 'Отправка прервана',
+                          locked_by = NULL, locked_until = NULL, updated_at = ?
+                   WHERE status = 'sending' AND locked_until < ?""",
+                (now, now)
+            )
+        return requeued
+    
+    def get_email_batch(self, batch_id: str, user_id: str) -> List[Dict[str, Any]]:
+        """Статусы писем одной рассылки"""
+        rows = self.get_connection().execute(
+            """SELECT id, candidate_id, to_email, status, attempts, error, created_at, sent_at
+               FROM email_outbox WHERE batch_id = ? AND user_id = ? ORDER BY id""",
+            (batch_id, user_id)
+        ).fetchall()
+        return [dict(row) for row in rows]
+    
+    def get_email_counts(self) -> Dict[str, int]:
+        """Число писем по статусам"""
+        rows = self.get_connection().execute(
+            "SELECT status, COUNT(*) FROM email_outbox GROUP BY status"
+        ).fetchall()
+        return {row[0]: row[1] for row in rows}
+    
+    def delete_finished_emails(self, max_age_seconds: float) -> int:
+        """Удалить отправленные и проваленные письма старше max_age_seconds"""
+        conn = self.get_connection()
+        with conn:
+            deleted = conn.execute(
+                "DELETE FROM email_outbox WHERE status IN ('sent', 'failed') AND updated_at < ?",
+                (time.time() - max_age_seconds,)
+            ).rowcount
+        return deleted
+    
+    # === БЛОКИРОВКИ ФОНОВЫХ ЗАДАЧ ===
+    
+    def claim_app_lock(self, name: str, owner: str, ttl_seconds: float) -> bool:
+        """Взять блокировку (True), если она свободна или истекла (владелец упал)"""
+        now = time.time()
+        conn = self.get_connection()
+        with conn:
+            updated = conn.execute(
+                """INSERT INTO app_locks (name, owner, locked_until) VALUES (?, ?, ?)
+                   ON CONFLICT(name) DO UPDATE SET owner = excluded.owner, locked_until = excluded.locked_until
+                   WHERE app_locks.locked_until < ?""",
+                (name, owner, now + ttl_seconds, now)
+            ).rowcount
+        return updated > 0
+    
+    def delete_app_lock(self, name: str, owner: str):
+        """Отпустить блокировку (только свою)"""
+        conn = self.get_connection()
+        with conn:
+            conn.execute("DELETE FROM app_locks WHERE name = ? AND owner = ?", (name, owner))
+
 
 # Создаём глобальный экземпляр
 db = Database()
\ No newline at end of file
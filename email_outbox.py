@@ -0,0 +1,234 @@
+import os
+import json
+import time
+import uuid
+import random
+import socket
+import asyncio
+from collections import deque
+from typing import Any, Awaitable, Deque, Dict, List, Optional, Tuple
+
+from async_database import AsyncDatabase, adb
+from email_service import send_email_via_oauth, token_manager
+from rate_limiter import email_limiters, parse_retry_after
+
+# Настройки отправки писем (можно переопределить через .env)
+# Сколько писем отправляется одновременно (соединения берутся из общего пула http_clients)
+EMAIL_WORKERS = int(os.getenv('EMAIL_WORKERS', 8))
+EMAIL_MAX_ATTEMPTS = int(os.getenv('EMAIL_MAX_ATTEMPTS', 5))
+# Повтор после ошибки: база * 2^(попытка-1) секунд, не больше максимума
+EMAIL_RETRY_BASE_DELAY = float(os.getenv('EMAIL_RETRY_BASE_DELAY', 10))
+EMAIL_RETRY_MAX_DELAY = float(os.getenv('EMAIL_RETRY_MAX_DELAY', 600))
+# Аренда письма на время отправки: после падения процесса письмо вернётся в очередь
+EMAIL_LEASE_SECONDS = float(os.getenv('EMAIL_LEASE_SECONDS', 120))
+EMAIL_POLL_INTERVAL = float(os.getenv('EMAIL_POLL_INTERVAL', 1))
+# Сколько хранить отправленные письма (дни)
+EMAIL_RETENTION_DAYS = float(os.getenv('EMAIL_RETENTION_DAYS', 30))
+# Максимум получателей в одной рассылке
+EMAIL_BATCH_MAX = int(os.getenv('EMAIL_BATCH_MAX', 500))
+
+# Ответы почтового API, после которых есть смысл повторить отправку
+RETRYABLE_STATUS_CODES = (401, 408, 429)
+
+
+class EmailOutbox:
+    """
+    Очередь исходящих писем в SQLite
+
+    Рассылка сохраняется в email_outbox одной транзакцией и сразу возвращается клиенту,
+    а воркеры отправляют письма параллельно через лимитер провайдера (email_limiters).
+    Временные ошибки (429, 5xx, сеть) повторяются с экспоненциальной паузой.
+    Доставка «хотя бы один раз»: если процесс упал сразу после отправки, письмо уйдёт повторно.
+    """
+
+    def __init__(self, adb: AsyncDatabase, workers: int = EMAIL_WORKERS):
+        self.adb = adb
+        self.workers = workers
+        self._tasks: List[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._worker_prefix = f"{socket.gethostname()}:{os.getpid()}:email"
+        # Время отправки последних писем — для пропускной способности за минуту
+        self._recent_sent: Deque[float] = deque()
+        self.stats_counters = {"sent": 0, "failed": 0, "retried": 0, "running": 0,
+                               "total_latency": 0.0, "max_latency": 0.0}
+
+    async def enqueue(self, user_id: str, provider: str, messages: List[Dict[str, Any]],
+                      max_attempts: int = EMAIL_MAX_ATTEMPTS) -> Tuple[str, List[int]]:
+        """Поставить письма в очередь, вернуть ID рассылки и ID писем"""
+        batch_id = uuid.uuid4().hex
+        ids = await self.adb.create_emails(batch_id, user_id, provider, messages, max_attempts)
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return batch_id, ids
+
+    @staticmethod
+    def retry_delay(attempts: int) -> float:
+        """Пауза перед следующей попыткой (с разбросом, чтобы повторы не шли пачкой)"""
+        delay = min(EMAIL_RETRY_MAX_DELAY, EMAIL_RETRY_BASE_DELAY * 2 ** (attempts - 1))
+        return delay * random.uniform(0.5, 1.0)
+
+    async def start(self, workers: int = None):
+        """Запустить отправку (при старте приложения)"""
+        if self._tasks:
+            return
+        self.workers = workers or self.workers
+        self._wakeup = asyncio.Event()
+        recovered = await self.adb.requeue_expired_emails()
+        self._tasks = [
+            asyncio.create_task(self._worker(f"{self._worker_prefix}:{n}"))
+            for n in range(self.workers)
+        ]
+        self._tasks.append(asyncio.create_task(self._maintenance()))
+        print(f"✅ Отправка писем запущена (воркеров: {self.workers}, возвращено в очередь: {recovered})")
+
+    async def stop(self):
+        """Остановить отправку: прерванные письма вернутся в очередь"""
+        tasks, self._tasks = self._tasks, []
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _worker(self, worker_id: str):
+        while True:
+            self._wakeup.clear()
+            try:
+                message = await self.adb.claim_email(worker_id, EMAIL_LEASE_SECONDS)
+            except Exception as e:
+                print(f"⚠️ Очередь писем: не удалось взять письмо: {e}")
+                message = None
+            if message is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), EMAIL_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            try:
+                await self._run(message, worker_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Воркер не должен завершаться: письмо вернётся в очередь по истечении аренды
+                print(f"❌ Очередь писем: ошибка при отправке письма {message['id']}: {e}")
+
+    async def _run(self, message: Dict[str, Any], worker_id: str):
+        """Отправить письмо и записать результат"""
+        self.stats_counters["running"] += 1
+        try:
+            error, retryable, retry_after = await self._send(message)
+        except asyncio.CancelledError:
+            await asyncio.shield(self.adb.requeue_email(message["id"], worker_id))
+            raise
+        except Exception as e:
+            error, retryable, retry_after = str(e) or e.__class__.__name__, True, None
+        finally:
+            self.stats_counters["running"] -= 1
+
+        if error is None:
+            # Письмо уже ушло: считаем его отправленным, даже если статус не записался
+            await self._save(message, self.adb.finish_email(message["id"], worker_id))
+            self._record_sent(time.time() - message["created_at"])
+        elif retryable and message["attempts"] < message["max_attempts"]:
+            delay = max(self.retry_delay(message["attempts"]), retry_after or 0)
+            if await self._save(message, self.adb.fail_email(message["id"], worker_id, error,
+                                                             retry_at=time.time() + delay)):
+                self.stats_counters["retried"] += 1
+        else:
+            if await self._save(message, self.adb.fail_email(message["id"], worker_id, error)):
+                self.stats_counters["failed"] += 1
+                print(f"❌ Письмо {message['id']} для {message['to_email']} не отправлено: {error}")
+
+    @staticmethod
+    async def _save(message: Dict[str, Any], write: Awaitable[bool]) -> bool:
+        """Записать статус письма. Ошибка записи не останавливает воркер: письмо вернётся в очередь по аренде"""
+        try:
+            if await write:
+                return True
+            print(f"⚠️ Письмо {message['id']}: статус не записан, аренду забрал другой воркер")
+        except Exception as e:
+            print(f"❌ Письмо {message['id']}: не удалось записать статус: {e}")
+        return False
+
+    async def _send(self, message: Dict[str, Any]) -> Tuple[Optional[str], bool, Optional[float]]:
+        """
+        Одна попытка отправки
+
+        Returns:
+            (ошибка или None, можно ли повторить, Retry-After в секундах)
+        """
+        # Токен из памяти TokenManager: обновляется заранее, до истечения
+        token = await token_manager.get_token(message["user_id"])
+        if token is None:
+            return "Почта не подключена", False, None
+        limiter = email_limiters.get(token.provider)
+        if limiter is None:
+            return f"Неизвестный провайдер: {token.provider}", False, None
+
+        await limiter.acquire(message["user_id"])
+        result = await self._deliver(token, message)
+        # 401: токен отозван раньше срока. Одно общее обновление на всех воркеров
+        # этого пользователя, и сразу повтор без паузы
+        if result.get("status_code") == 401 and token.refresh_token:
+            token = await token_manager.refresh(message["user_id"], token.access_token)
+            if token is None:
+                # Повтор с паузой: почту могут переподключить, пока письмо ждёт в очереди
+                return "Не удалось обновить токен почты — переподключите почту", True, None
+            result = await self._deliver(token, message)
+        if result.get("status") == "success":
+            return None, False, None
+
+        status_code = result.get("status_code")
+        if status_code is not None:
+            limiter.observe(status_code, {"retry-after": result.get("retry_after")})
+        error = result.get("message") or json.dumps(result.get("data"), ensure_ascii=False)[:500]
+        retryable = status_code is not None and (status_code in RETRYABLE_STATUS_CODES or status_code >= 500)
+        return f"{status_code or ''} {error}".strip(), retryable, parse_retry_after(result.get("retry_after"))
+
+    @staticmethod
+    async def _deliver(token, message: Dict[str, Any]) -> Dict[str, Any]:
+        return await send_email_via_oauth(
+            provider=token.provider,
+            access_token=token.access_token,
+            from_email=token.email,
+            to_email=message["to_email"],
+            subject=message["subject"],
+            body=message["body"]
+        )
+
+    def _record_sent(self, latency: float):
+        now = time.time()
+        self.stats_counters["sent"] += 1
+        self.stats_counters["total_latency"] += latency
+        self.stats_counters["max_latency"] = max(self.stats_counters["max_latency"], latency)
+        self._recent_sent.append(now)
+        while self._recent_sent and self._recent_sent[0] < now - 60:
+            self._recent_sent.popleft()
+
+    async def _maintenance(self):
+        """Забирать письма упавших процессов и чистить старые"""
+        while True:
+            await asyncio.sleep(EMAIL_LEASE_SECONDS / 2)
+            try:
+                if await self.adb.requeue_expired_emails():
+                    self._wakeup.set()
+                await self.adb.delete_finished_emails(EMAIL_RETENTION_DAYS * 86400)
+            except Exception as e:
+                print(f"⚠️ Обслуживание очереди писем: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        counters = self.stats_counters
+        sent = counters["sent"]
+        now = time.time()
+        return {
+            "workers": self.workers if self._tasks else 0,
+            "sent": sent,
+            "failed": counters["failed"],
+            "retried": counters["retried"],
+            "running": counters["running"],
+            "sent_last_minute": sum(1 for sent_at in self._recent_sent if sent_at >= now - 60),
+            "avg_latency_ms": round(counters["total_latency"] / sent * 1000, 1) if sent else 0.0,
+            "max_latency_ms": round(counters["max_latency"] * 1000, 1)
+        }
+
+
+# Глобальная очередь писем
+email_outbox = EmailOutbox(adb)
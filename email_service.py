@@ -1,11 +1,13 @@
 import os
-import json
+import time
 import base64
+import asyncio
 from datetime import datetime, timedelta
-from typing import Dict, Any, Optional
-import httpx
+from typing import Dict, Any, NamedTuple, Optional
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
+from http_clients import get_client
+from async_database import AsyncDatabase, adb
 
 # OAuth credentials (из переменных окружения)
 GOOGLE_CLIENT_ID = os.getenv('GOOGLE_CLIENT_ID')
@@ -22,6 +24,20 @@ MAILRU_REDIRECT_URI = os.getenv('MAILRU_REDIRECT_URI')
 
 BACKEND_URL = os.getenv('WEBAPP_URL', 'http://localhost:8000')
 
+# Обновлять токен заранее: за столько секунд до истечения (можно переопределить через .env)
+EMAIL_TOKEN_REFRESH_MARGIN = float(os.getenv('EMAIL_TOKEN_REFRESH_MARGIN', 300))
+# Как часто проверять токены в памяти на скорое истечение
+EMAIL_TOKEN_CHECK_INTERVAL = float(os.getenv('EMAIL_TOKEN_CHECK_INTERVAL', 60))
+# После неудачного обновления не обращаемся к провайдеру столько секунд
+EMAIL_TOKEN_REFRESH_BACKOFF = float(os.getenv('EMAIL_TOKEN_REFRESH_BACKOFF', 60))
+
+# Адреса обмена refresh token на новый access token
+TOKEN_URLS = {
+    'google': "https://oauth2.googleapis.com/token",
+    'yandex': "https://oauth.yandex.ru/token",
+    'mailru': "https://oauth.mail.ru/token",
+}
+
 
 def get_oauth_url(provider: str, state: str = None) -> str:
     """Получить URL для OAuth авторизации"""
@@ -100,10 +116,31 @@ async def exchange_code_for_token(provider: str, code: str) -> Dict[str, Any]:
     else:
         raise ValueError(f"Неизвестный провайдер: {provider}")
     
-    async with httpx.AsyncClient() as client:
-        response = await client.post(url, data=data)
-        response.raise_for_status()
-        return response.json()
+    response = await get_client(provider).post(url, data=data)
+    response.raise_for_status()
+    return response.json()
+
+
+async def refresh_access_token(provider: str, refresh_token: str) -> Dict[str, Any]:
+    """Получить новый access token по refresh token"""
+    credentials = {
+        'google': (GOOGLE_CLIENT_ID, GOOGLE_CLIENT_SECRET),
+        'yandex': (YANDEX_CLIENT_ID, YANDEX_CLIENT_SECRET),
+        'mailru': (MAILRU_CLIENT_ID, MAILRU_CLIENT_SECRET),
+    }
+    if provider not in credentials:
+        raise ValueError(f"Неизвестный провайдер: {provider}")
+    
+    client_id, client_secret = credentials[provider]
+    data = {
+        "refresh_token": refresh_token,
+        "client_id": client_id,
+        "client_secret": client_secret,
+        "grant_type": "refresh_token"
+    }
+    response = await get_client(provider).post(TOKEN_URLS[provider], data=data)
+    response.raise_for_status()
+    return response.json()
 
 
 async def get_user_email(provider: str, access_token: str) -> str:
@@ -113,29 +150,26 @@ async def get_user_email(provider: str, access_token: str) -> str:
         url = "https://www.googleapis.com/oauth2/v2/userinfo"
         headers = {"Authorization": f"Bearer {access_token}"}
         
-        async with httpx.AsyncClient() as client:
-            response = await client.get(url, headers=headers)
-            data = response.json()
-            return data.get('email', '')
+        response = await get_client('google').get(url, headers=headers)
+        data = response.json()
+        return data.get('email', '')
     
     elif provider == 'yandex':
         url = "https://login.yandex.ru/info"
         headers = {"Authorization": f"OAuth {access_token}"}
         
-        async with httpx.AsyncClient() as client:
-            response = await client.get(url, headers=headers)
-            data = response.json()
-            return data.get('default_email', '')
+        response = await get_client('yandex').get(url, headers=headers)
+        data = response.json()
+        return data.get('default_email', '')
     
     elif provider == 'mailru':
         # Mail.ru API для получения email
         url = "https://oauth.mail.ru/userinfo"
         headers = {"Authorization": f"Bearer {access_token}"}
         
-        async with httpx.AsyncClient() as client:
-            response = await client.get(url, headers=headers)
-            data = response.json()
-            return data.get('email', '')
+        response = await get_client('mailru').get(url, headers=headers)
+        data = response.json()
+        return data.get('email', '')
     
     return ""
 
@@ -169,9 +203,18 @@ async def send_email_via_oauth(
         }
         payload = {"raw": raw_message}
         
-        async with httpx.AsyncClient() as client:
-            response = await client.post(url, headers=headers, json=payload)
-            return {"status": "success" if response.status_code == 200 else "error", "data": response.json()}
+        response = await get_client('google').post(url, headers=headers, json=payload)
+        try:
+            data = response.json()
+        except ValueError:
+            data = {"message": response.text[:500]}
+        # status_code и retry_after нужны очереди писем: повторять ли отправку и когда
+        return {
+            "status": "success" if response.status_code == 200 else "error",
+            "data": data,
+            "status_code": response.status_code,
+            "retry_after": response.headers.get("retry-after")
+        }
     
     elif provider == 'yandex':
         # Яндекс использует SMTP с OAuth
@@ -181,4 +224,200 @@ async def send_email_via_oauth(
         # Mail.ru также через SMTP
         return {"status": "error", "message": "Mail.ru SMTP требует дополнительной настройки"}
     
-    return {"status": "error", "message": "Неизвестный провайдер"}
\ No newline at end of file
+    return {"status": "error", "message": "Неизвестный провайдер"}
+
+
+# === ТОКЕНЫ ДОСТУПА ===
+
+class OAuthToken(NamedTuple):
+    """Токен почты пользователя"""
+    provider: str
+    email: str
+    access_token: str
+    refresh_token: Optional[str]
+    expires_at: float      # unix-время истечения access token (0 — неизвестно)
+    version: int = 0       # версия профиля, из которой прочитан токен
+
+
+def _parse_expiry(value: Optional[str]) -> float:
+    """email_token_expiry из профиля (ISO-строка) в unix-время"""
+    if not value:
+        return 0.0
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        return 0.0
+
+
+class TokenManager:
+    """
+    Токены почты в памяти с обновлением заранее
+
+    Токен читается из профиля и отдаётся из памяти, пока не изменилась версия профиля
+    (profiles.version): токен, обновлённый или отключённый другим воркером uvicorn,
+    перечитывается при следующей отправке. Фоновая задача обновляет токены
+    за EMAIL_TOKEN_REFRESH_MARGIN секунд до истечения, одновременные обновления токена
+    одного пользователя объединяются в один запрос, новый токен сохраняется в профиль.
+    После ошибки обновления новые попытки не делаются EMAIL_TOKEN_REFRESH_BACKOFF секунд.
+    """
+
+    def __init__(self, adb: AsyncDatabase, refresh_margin: float = EMAIL_TOKEN_REFRESH_MARGIN):
+        self.adb = adb
+        self.refresh_margin = refresh_margin
+        self._tokens: Dict[str, OAuthToken] = {}
+        self._refreshing: Dict[str, asyncio.Task] = {}
+        self._refresher: Optional[asyncio.Task] = None
+        # Когда можно снова пробовать обновить токен пользователя после ошибки
+        self._refresh_blocked_until: Dict[str, float] = {}
+        self.stats_counters = {"loads": 0, "refreshed": 0, "refresh_errors": 0, "coalesced": 0,
+                               "refresh_skipped": 0}
+
+    async def get_token(self, user_id: str) -> Optional[OAuthToken]:
+        """Действующий токен пользователя (None — почта не подключена)"""
+        token = self._tokens.get(user_id)
+        if token is None or token.version != await self.adb.get_profile_version(user_id):
+            token = await self._load(user_id)
+            if token is None:
+                return None
+
+        if token.refresh_token and token.expires_at and token.expires_at - time.time() < self.refresh_margin:
+            if token.expires_at <= time.time():
+                # Уже истёк: ждём обновления (общего для всех запросов пользователя).
+                # Не обновился — отдаём истёкший: провайдер ответит 401, а почта не считается отключённой
+                return await self.refresh(user_id, token.access_token) or self._tokens.get(user_id)
+            # Скоро истечёт: обновляем в фоне, пока отдаём текущий
+            self._start_refresh(user_id, token.access_token)
+        return token
+
+    async def _load(self, user_id: str) -> Optional[OAuthToken]:
+        profile = await self.adb.get_profile(user_id)
+        if not profile or not profile.get('email_access_token'):
+            self._tokens.pop(user_id, None)
+            return None
+        self.stats_counters["loads"] += 1
+        return self._remember(user_id, profile)
+
+    def _remember(self, user_id: str, profile: Dict[str, Any]) -> OAuthToken:
+        """Токен из профиля — в память вместе с версией профиля"""
+        token = OAuthToken(
+            provider=profile.get('email_provider'),
+            email=profile.get('email_address') or '',
+            access_token=profile['email_access_token'],
+            refresh_token=profile.get('email_refresh_token'),
+            expires_at=_parse_expiry(profile.get('email_token_expiry')),
+            version=profile.get('version') or 0
+        )
+        self._tokens[user_id] = token
+        return token
+
+    async def refresh(self, user_id: str, stale_access_token: str = None) -> Optional[OAuthToken]:
+        """
+        Обновить токен (например, после ответа 401)
+        
+        stale_access_token — токен, который отверг сервер: если его уже заменили
+        (в этом или другом воркере), новый токен возвращается без запроса к провайдеру.
+        None — почта отключена или токен обновить не удалось (нужно переподключить почту).
+        """
+        token = self._tokens.get(user_id)
+        if token is not None and stale_access_token and token.access_token != stale_access_token:
+            return token
+        return await asyncio.shield(self._start_refresh(user_id, stale_access_token))
+
+    def _start_refresh(self, user_id: str, stale_access_token: str = None) -> asyncio.Task:
+        task = self._refreshing.get(user_id)
+        if task is not None:
+            self.stats_counters["coalesced"] += 1
+            return task
+        task = asyncio.create_task(self._refresh(user_id, stale_access_token))
+        self._refreshing[user_id] = task
+        task.add_done_callback(lambda _: self._refreshing.pop(user_id, None))
+        return task
+
+    async def _refresh(self, user_id: str, stale_access_token: str = None) -> Optional[OAuthToken]:
+        # Профиль перечитываем: токен мог уже обновить другой воркер
+        token = await self._load(user_id)
+        if token is None or not token.refresh_token:
+            return token
+        if stale_access_token and token.access_token != stale_access_token:
+            return token
+        if self._refresh_blocked_until.get(user_id, 0) > time.time():
+            # Недавно не удалось: не нагружаем OAuth провайдера повторами
+            self.stats_counters["refresh_skipped"] += 1
+            return None
+        try:
+            token_data = await refresh_access_token(token.provider, token.refresh_token)
+        except Exception as e:
+            self.stats_counters["refresh_errors"] += 1
+            self._refresh_blocked_until[user_id] = time.time() + EMAIL_TOKEN_REFRESH_BACKOFF
+            print(f"⚠️ Не удалось обновить токен почты для user_id={user_id}: {e}")
+            return None
+        self._refresh_blocked_until.pop(user_id, None)
+
+        expires_in = token_data.get('expires_in', 3600)
+        token = token._replace(
+            access_token=token_data['access_token'],
+            # Google возвращает refresh token только при первой авторизации
+            refresh_token=token_data.get('refresh_token') or token.refresh_token,
+            expires_at=time.time() + expires_in
+        )
+        self.stats_counters["refreshed"] += 1
+        profile = await self.adb.update_profile(
+            user_id,
+            email_access_token=token.access_token,
+            email_refresh_token=token.refresh_token,
+            email_token_expiry=datetime.fromtimestamp(token.expires_at).isoformat()
+        )
+        token = token._replace(version=profile['version'] if profile else token.version)
+        self._tokens[user_id] = token
+        return token
+
+    async def store(self, user_id: str, provider: str, email: str, token_data: Dict[str, Any]):
+        """Сохранить токены после OAuth авторизации (в профиль и в память)"""
+        expires_in = token_data.get('expires_in', 3600)
+        expiry = datetime.now() + timedelta(seconds=expires_in)
+        profile = await self.adb.update_profile(
+            user_id,
+            email_provider=provider,
+            email_address=email,
+            email_access_token=token_data.get('access_token'),
+            email_refresh_token=token_data.get('refresh_token'),
+            email_token_expiry=expiry.isoformat()
+        )
+        self._refresh_blocked_until.pop(user_id, None)
+        if profile and profile.get('email_access_token'):
+            self._remember(user_id, profile)
+
+    def forget(self, user_id: str):
+        """Забыть токен в памяти (другие воркеры заметят изменение по версии профиля)"""
+        self._tokens.pop(user_id, None)
+
+    def start(self):
+        """Запустить фоновое обновление токенов (при старте приложения)"""
+        if self._refresher is None:
+            self._refresher = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self):
+        tasks = [task for task in (self._refresher, *self._refreshing.values()) if task is not None]
+        self._refresher = None
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _refresh_loop(self):
+        """Обновлять токены, которые истекут до следующей проверки"""
+        while True:
+            await asyncio.sleep(EMAIL_TOKEN_CHECK_INTERVAL)
+            deadline = time.time() + self.refresh_margin + EMAIL_TOKEN_CHECK_INTERVAL
+            now = time.time()
+            for user_id, token in list(self._tokens.items()):
+                if self._refresh_blocked_until.get(user_id, 0) > now:
+                    continue
+                if token.refresh_token and token.expires_at and token.expires_at < deadline:
+                    self._start_refresh(user_id, token.access_token)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"cached": len(self._tokens), "refreshing": len(self._refreshing), **self.stats_counters}
+
+
+# Глобальный менеджер токенов почты
+token_manager = TokenManager(adb)
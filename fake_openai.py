@@ -0,0 +1,152 @@
+"""
+Локальная заглушка OpenAI Chat Completions API для тестов без сети
+
+Запуск:
+    python fake_openai.py --port 8765 --delay 1.0 --token-delay 0.01
+
+Затем в .env:
+    OPENAI_BASE_URL=http://127.0.0.1:8765/v1
+    OPENAI_API_KEY=test
+"""
+import re
+import json
+import time
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ANALYSIS_RESPONSE = {
+    "verdict": "Подходит",
+    "reason": "Опыт и навыки соответствуют критериям вакансии",
+    "matches_count": 3,
+    "matched_criteria": ["Опыт работы", "Ключевые навыки", "Образование"]
+}
+
+VACANCY_RESPONSE = {
+    "hard_skills": "Python, FastAPI, PostgreSQL, Docker, Git",
+    "soft_skills": "Коммуникабельность, Ответственность",
+    "description": "Разработка и поддержка backend-сервисов.",
+    "criteria": "Обязательно: опыт 3+ года, знание FastAPI и PostgreSQL."
+}
+
+
+def _count_tokens(text: str) -> int:
+    """Грубая оценка числа токенов (~4 символа на токен)"""
+    return max(1, len(text) // 4)
+
+
+# Пакетный анализ: в промпте по заголовку на каждого кандидата
+BATCH_CANDIDATE_RE = re.compile(r"### Кандидат id=(\S+)")
+
+
+def build_completion(request: dict) -> dict:
+    """Сформировать ответ в формате Chat Completions по содержимому промпта"""
+    prompt = "\n".join(m.get("content", "") for m in request.get("messages", []))
+    batch_ids = BATCH_CANDIDATE_RE.findall(prompt)
+
+    if "Создай профиль вакансии" in prompt:
+        content = VACANCY_RESPONSE
+    elif batch_ids:
+        content = {"results": [{"id": candidate_id, **ANALYSIS_RESPONSE} for candidate_id in batch_ids]}
+    else:
+        content = ANALYSIS_RESPONSE
+
+    content_text = json.dumps(content, ensure_ascii=False)
+    prompt_tokens = _count_tokens(prompt)
+    completion_tokens = _count_tokens(content_text)
+
+    return {
+        "id": f"chatcmpl-fake-{int(time.time() * 1000)}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": request.get("model", "gpt-4o-mini"),
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": content_text},
+            "finish_reason": "stop"
+        }],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens
+        }
+    }
+
+
+class FakeOpenAIServer(ThreadingHTTPServer):
+    """HTTP-сервер с потоком на запрос и большой очередью соединений"""
+
+    daemon_threads = True
+    request_queue_size = 256
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    """Обработчик POST /v1/chat/completions"""
+
+    protocol_version = "HTTP/1.1"  # keep-alive, как у настоящего API
+    delay = 0.0
+    # Генерация ответа: секунды на каждый токен ответа (длинный ответ дольше)
+    token_delay = 0.0
+    lock = threading.Lock()
+    requests_served = 0
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send(404, {"error": {"message": f"Unknown path {self.path}"}})
+            return
+
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+
+        completion = build_completion(request)
+        delay = self.delay + self.token_delay * completion["usage"]["completion_tokens"]
+        if delay:
+            time.sleep(delay)
+
+        with FakeOpenAIHandler.lock:
+            FakeOpenAIHandler.requests_served += 1
+
+        self._send(200, completion)
+
+    def _send(self, status: int, payload: dict):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server(host: str = "127.0.0.1", port: int = 0, delay: float = 0.0,
+                 token_delay: float = 0.0) -> FakeOpenAIServer:
+    """Запустить заглушку в фоновом потоке (port=0 — любой свободный порт)"""
+    FakeOpenAIHandler.delay = delay
+    FakeOpenAIHandler.token_delay = token_delay
+    server = FakeOpenAIServer((host, port), FakeOpenAIHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Заглушка OpenAI API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--delay", type=float, default=0.0, help="Задержка ответа в секундах")
+    parser.add_argument("--token-delay", type=float, default=0.0, help="Дополнительно секунд на токен ответа")
+    args = parser.parse_args()
+
+    FakeOpenAIHandler.delay = args.delay
+    FakeOpenAIHandler.token_delay = args.token_delay
+    server = FakeOpenAIServer((args.host, args.port), FakeOpenAIHandler)
+    print(f"✅ Заглушка OpenAI: http://{args.host}:{args.port}/v1 (задержка {args.delay} с)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,34 @@
+import os
+import signal
+import asyncio
+import multiprocessing
 import PyPDF2
 import docx
 import io
-from typing import Dict, Any
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Any, List, Optional
+
+# Число процессов для парсинга (по умолчанию — по числу ядер)
+PARSER_WORKERS = int(os.getenv('PARSER_WORKERS', os.cpu_count() or 2))
+# Максимальное время разбора одного файла (секунды)
+PARSE_TIMEOUT = float(os.getenv('PARSE_TIMEOUT', 30))
+# Сколько страниц PDF читаем максимум
+PDF_MAX_PAGES = int(os.getenv('PDF_MAX_PAGES', 30))
+# Ограничение длины извлечённого текста (символы)
+PARSE_MAX_CHARS = int(os.getenv('PARSE_MAX_CHARS', 100000))
 
 def parse_pdf(file_content: bytes) -> str:
-    """Извлечь текст из PDF"""
+    """Извлечь текст из PDF (не больше PDF_MAX_PAGES страниц)"""
     try:
         pdf_file = io.BytesIO(file_content)
         reader = PyPDF2.PdfReader(pdf_file)
         text = ""
-        for page in reader.pages:
+        for page in reader.pages[:PDF_MAX_PAGES]:
             text += page.extract_text() + "\n"
-        return text.strip()
+            if len(text) >= PARSE_MAX_CHARS:
+                break
+        return text[:PARSE_MAX_CHARS].strip()
     except Exception as e:
         return f"Ошибка парсинга PDF: {str(e)}"
 
@@ -21,10 +38,16 @@ def parse_docx(file_content: bytes) -> str:
         docx_file = io.BytesIO(file_content)
         doc = docx.Document(docx_file)
         text = "\n".join([paragraph.text for paragraph in doc.paragraphs])
-        return text.strip()
+        return text[:PARSE_MAX_CHARS].strip()
     except Exception as e:
         return f"Ошибка парсинга DOCX: {str(e)}"
 
+SUPPORTED_FORMAT_ERROR = "Неподдерживаемый формат. Используй PDF или DOCX"
+
+def is_supported_file(filename: str) -> bool:
+    """Файл PDF или DOCX (проверка по расширению)"""
+    return (filename or '').lower().endswith(('.pdf', '.docx'))
+
 def parse_resume_file(filename: str, file_content: bytes) -> Dict[str, Any]:
     """Парсит резюме из файла"""
     filename_lower = filename.lower()
@@ -34,7 +57,7 @@ def parse_resume_file(filename: str, file_content: bytes) -> Dict[str, Any]:
     elif filename_lower.endswith('.docx'):
         text = parse_docx(file_content)
     else:
-        return {"error": "Неподдерживаемый формат. Используй PDF или DOCX"}
+        return {"error": SUPPORTED_FORMAT_ERROR}
     
     if text.startswith("Ошибка"):
         return {"error": text}
@@ -43,4 +66,110 @@ def parse_resume_file(filename: str, file_content: bytes) -> Dict[str, Any]:
         "success": True,
         "text": text,
         "filename": filename
-    }
\ No newline at end of file
+    }
+
+# === ПУЛ ПРОЦЕССОВ ===
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_workers = PARSER_WORKERS
+# Файлов в работе не больше, чем процессов: иначе ожидание в очереди пула
+# засчитывалось бы в PARSE_TIMEOUT и здоровые файлы «зависали» бы
+_parse_slots: Optional[asyncio.Semaphore] = None
+# Новый пул после перезапуска создаётся один раз, в потоке (прогрев блокирует)
+_pool_lock = asyncio.Lock()
+# PID процессов пула: каждый процесс сообщает свой PID при запуске (_register_worker).
+# Публичного способа убить процессы зависшего пула до Python 3.14 нет
+_worker_pids: Dict[ProcessPoolExecutor, Any] = {}
+
+def _register_worker(pids):
+    """Инициализатор процесса пула: записать свой PID"""
+    pids.put(os.getpid())
+
+def _pool_pids(pool: ProcessPoolExecutor) -> List[int]:
+    """PID всех процессов, которые запускал пул"""
+    pids = _worker_pids.get(pool)
+    result = []
+    while pids is not None and not pids.empty():
+        result.append(pids.get())
+    return result
+
+def _warm_up() -> bool:
+    """Пустая задача: заставляет процесс пула запуститься и импортировать парсеры"""
+    return True
+
+def start_parser_pool(workers: int = PARSER_WORKERS) -> ProcessPoolExecutor:
+    """Создать пул процессов и прогреть его (вызывается при старте приложения)"""
+    global _pool, _pool_workers, _parse_slots
+    if _pool is None:
+        _pool_workers = workers
+        if _parse_slots is None:
+            _parse_slots = asyncio.Semaphore(workers)
+        # spawn: безопасно в процессе с потоками (uvicorn, пул БД)
+        context = multiprocessing.get_context('spawn')
+        pids = context.SimpleQueue()
+        _pool = ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                                    initializer=_register_worker, initargs=(pids,))
+        _worker_pids[_pool] = pids
+        for future in [_pool.submit(_warm_up) for _ in range(workers)]:
+            future.result()
+        print(f"✅ Пул парсинга резюме запущен (процессов: {workers})")
+    return _pool
+
+def shutdown_parser_pool():
+    """Остановить пул процессов"""
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=True, cancel_futures=True)
+        _worker_pids.pop(_pool, None)
+        _pool = None
+
+def _recycle_pool(pool: ProcessPoolExecutor):
+    """Убить процессы зависшего пула: следующий вызов создаст новый"""
+    global _pool
+    if _pool is pool:
+        _pool = None
+    # Остальные задачи этого пула получат BrokenProcessPool и будут повторены
+    if hasattr(pool, 'terminate_workers'):  # Python 3.14+
+        pool.terminate_workers()
+    else:
+        for pid in _pool_pids(pool):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except (ProcessLookupError, PermissionError):
+                pass  # процесс уже завершился
+        pool.shutdown(wait=False, cancel_futures=True)
+    _worker_pids.pop(pool, None)
+
+async def _get_pool() -> ProcessPoolExecutor:
+    """Текущий пул или новый (после перезапуска), не блокируя event loop"""
+    if _pool is not None:
+        return _pool
+    async with _pool_lock:
+        if _pool is None:
+            await asyncio.to_thread(start_parser_pool, _pool_workers)
+    return _pool
+
+async def parse_resume_file_async(filename: str, file_content: bytes, timeout: float = PARSE_TIMEOUT) -> Dict[str, Any]:
+    """Парсит резюме в пуле процессов, не блокируя event loop"""
+    loop = asyncio.get_running_loop()
+    await _get_pool()  # создаёт и _parse_slots
+    
+    # Таймаут считается с момента, когда для файла есть свободный процесс
+    async with _parse_slots:
+        for attempt in range(2):
+            pool = await _get_pool()
+            try:
+                return await asyncio.wait_for(
+                    loop.run_in_executor(pool, parse_resume_file, filename, file_content),
+                    timeout
+                )
+            except asyncio.TimeoutError:
+                # Патологический файл держит ядро — перезапускаем пул
+                _recycle_pool(pool)
+                return {"error": f"Превышено время обработки файла ({timeout:.0f} с)"}
+            except BrokenProcessPool:
+                # Пул перезапущен из-за соседнего файла — пробуем ещё раз в новом
+                if _pool is pool:
+                    _recycle_pool(pool)
+    
+    return {"error": "Не удалось обработать файл"}
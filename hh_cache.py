@@ -0,0 +1,143 @@
+import os
+import time
+import asyncio
+import hashlib
+import threading
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+import httpx
+
+from cache import LRUCache
+
+# TTL (секунды) по префиксу пути HH.ru API: "me=60,vacancies=30,dictionaries=3600"
+# Пути без записи не кэшируются. Резюме по умолчанию не кэшируем: это большие ответы
+# с персональными данными кандидатов, их прокси отдаёт потоком без буферизации
+HH_CACHE_TTLS = os.getenv('HH_CACHE_TTLS', 'me=60,vacancies=30,dictionaries=3600,areas=3600')
+HH_CACHE_MAX_ENTRIES = int(os.getenv('HH_CACHE_MAX_ENTRIES', 2000))
+# Ответы больше этого размера (байты) и не-JSON в кэш не кладём
+HH_CACHE_MAX_BODY = int(os.getenv('HH_CACHE_MAX_BODY', 256 * 1024))
+
+# Заголовки ответа, которые сохраняем и отдаём клиенту
+CACHED_HEADERS = ('content-type', 'etag', 'last-modified')
+
+
+def parse_ttls(spec: str) -> Dict[str, float]:
+    """Разобрать строку "путь=секунды,..." в словарь"""
+    ttls = {}
+    for part in spec.split(','):
+        if '=' not in part:
+            continue
+        prefix, ttl = part.split('=', 1)
+        ttls[prefix.strip().strip('/')] = float(ttl)
+    return ttls
+
+
+class HHResponseCache:
+    """
+    Кэш GET-ответов HH.ru API
+
+    Ключ — хэш токена доступа + URL, поэтому разные пользователи не видят чужие данные.
+    Одновременные одинаковые запросы ждут один общий запрос к HH.ru (single-flight),
+    а устаревшая запись с ETag перепроверяется через If-None-Match.
+    """
+
+    def __init__(self, ttls: Dict[str, float], max_entries: int = HH_CACHE_MAX_ENTRIES,
+                 max_body: int = HH_CACHE_MAX_BODY):
+        self.max_body = max_body
+        # Длинные префиксы проверяем первыми: "vacancies/active" раньше "vacancies"
+        self.ttls = dict(sorted(ttls.items(), key=lambda item: -len(item[0])))
+        # Устаревшие записи храним дальше: они нужны для ревалидации по ETag
+        self.entries = LRUCache(max_entries)
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._stats_lock = threading.Lock()
+        self.stats_counters = {"hits": 0, "misses": 0, "coalesced": 0, "revalidated": 0, "uncacheable": 0}
+
+    def ttl_for(self, path: str) -> float:
+        """TTL для пути API (0 — не кэшировать)"""
+        path = path.strip('/')
+        for prefix, ttl in self.ttls.items():
+            if path == prefix or path.startswith(prefix + '/'):
+                return ttl
+        return 0
+
+    @staticmethod
+    def make_key(auth_header: Optional[str], url: str) -> str:
+        token_hash = hashlib.sha256((auth_header or '').encode('utf-8')).hexdigest()
+        return f"{token_hash}:{url}"
+
+    def _count(self, name: str):
+        with self._stats_lock:
+            self.stats_counters[name] += 1
+
+    async def get(self, key: str, ttl: float,
+                  fetch: Callable[[Dict[str, str]], Awaitable[httpx.Response]]) -> Dict[str, Any]:
+        """
+        Ответ из кэша или от HH.ru
+
+        Args:
+            fetch: делает запрос к HH.ru с дополнительными заголовками (If-None-Match)
+
+        Returns:
+            Dict со status_code, headers, content и cache (HIT, MISS, COALESCED, REVALIDATED)
+        """
+        entry = self.entries.get(key)
+        if entry and entry["expires_at"] > time.time():
+            self._count("hits")
+            return {**entry, "cache": "HIT"}
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self._count("coalesced")
+            # shield: если клиент отключился, общий запрос доживает для остальных
+            return {**await asyncio.shield(task), "cache": "COALESCED"}
+
+        task = asyncio.create_task(self._fetch(key, ttl, entry, fetch))
+        self._inflight[key] = task
+        task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def _fetch(self, key: str, ttl: float, entry: Optional[Dict[str, Any]],
+                     fetch: Callable[[Dict[str, str]], Awaitable[httpx.Response]]) -> Dict[str, Any]:
+        extra_headers = {}
+        if entry and entry["headers"].get("etag"):
+            extra_headers["If-None-Match"] = entry["headers"]["etag"]
+
+        response = await fetch(extra_headers)
+
+        if response.status_code == 304 and entry:
+            self._count("revalidated")
+            entry = {**entry, "expires_at": time.time() + ttl}
+            self.entries.put(key, entry)
+            return {**entry, "cache": "REVALIDATED"}
+
+        result = {
+            "status_code": response.status_code,
+            "headers": {name: response.headers[name] for name in CACHED_HEADERS if name in response.headers},
+            "content": response.content,
+            "expires_at": time.time() + ttl
+        }
+        if self._cacheable(response):
+            self._count("misses")
+            self.entries.put(key, result)
+        else:
+            self._count("uncacheable")
+        return {**result, "cache": "MISS"}
+
+    def _cacheable(self, response: httpx.Response) -> bool:
+        """В кэш — только успешные JSON-ответы не больше max_body"""
+        return (response.status_code == 200
+                and 'json' in response.headers.get('content-type', '')
+                and len(response.content) <= self.max_body)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            stats = dict(self.stats_counters)
+        lookups = stats["hits"] + stats["misses"] + stats["coalesced"] + stats["revalidated"]
+        stats["entries"] = len(self.entries)
+        stats["inflight"] = len(self._inflight)
+        stats["hit_rate"] = round((stats["hits"] + stats["coalesced"] + stats["revalidated"]) / lookups, 3) if lookups else 0.0
+        return stats
+
+
+# Глобальный экземпляр для прокси HH.ru
+hh_cache = HHResponseCache(parse_ttls(HH_CACHE_TTLS))
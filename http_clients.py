@@ -0,0 +1,62 @@
+import os
+import httpx
+from typing import Dict
+
+# Настройки исходящих HTTP-соединений (можно переопределить через .env)
+HTTP_TIMEOUT = float(os.getenv('HTTP_TIMEOUT', 30))
+HTTP_CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', 5))
+HTTP_MAX_CONNECTIONS = int(os.getenv('HTTP_MAX_CONNECTIONS', 100))
+HTTP_MAX_KEEPALIVE = int(os.getenv('HTTP_MAX_KEEPALIVE', 20))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv('HTTP_KEEPALIVE_EXPIRY', 60))
+HTTP2_ENABLED = os.getenv('HTTP2_ENABLED', '1') == '1'
+
+# HTTP/2 работает только если установлен пакет h2 (pip install httpx[http2])
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+# Внешние сервисы: по одному клиенту (и пулу соединений) на каждый
+UPSTREAMS = ('hh', 'google', 'yandex', 'mailru')
+
+_clients: Dict[str, httpx.AsyncClient] = {}
+
+
+def _create_client(upstream: str) -> httpx.AsyncClient:
+    """Клиент с keep-alive пулом соединений"""
+    return httpx.AsyncClient(
+        http2=HTTP2_ENABLED and HTTP2_AVAILABLE,
+        timeout=httpx.Timeout(HTTP_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+        limits=httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY
+        ),
+        headers={"User-Agent": "HRAssistant/1.0"}
+    )
+
+
+def get_client(upstream: str) -> httpx.AsyncClient:
+    """Общий клиент для внешнего сервиса (создаётся при первом обращении)"""
+    if upstream not in UPSTREAMS:
+        raise ValueError(f"Неизвестный внешний сервис: {upstream}")
+    client = _clients.get(upstream)
+    if client is None or client.is_closed:
+        client = _clients[upstream] = _create_client(upstream)
+    return client
+
+
+def start_http_clients():
+    """Создать клиенты для всех внешних сервисов (при старте приложения)"""
+    for upstream in UPSTREAMS:
+        get_client(upstream)
+    print(f"✅ HTTP-клиенты готовы: {', '.join(UPSTREAMS)} (HTTP/2: {'да' if HTTP2_ENABLED and HTTP2_AVAILABLE else 'нет'})")
+
+
+async def close_http_clients():
+    """Закрыть все соединения (при остановке приложения)"""
+    clients = list(_clients.values())
+    _clients.clear()
+    for client in clients:
+        await client.aclose()
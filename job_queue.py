@@ -0,0 +1,195 @@
+import os
+import time
+import socket
+import random
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from async_database import AsyncDatabase, adb
+
+# Настройки очереди фоновых задач (можно переопределить через .env)
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', 8))
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', 3))
+# Повтор после ошибки: база * 2^(попытка-1) секунд, не больше максимума
+JOB_RETRY_BASE_DELAY = float(os.getenv('JOB_RETRY_BASE_DELAY', 5))
+JOB_RETRY_MAX_DELAY = float(os.getenv('JOB_RETRY_MAX_DELAY', 300))
+# Аренда задачи: воркер продлевает её, пока работает; после падения процесса
+# задача вернётся в очередь не позже чем через JOB_LEASE_SECONDS
+JOB_LEASE_SECONDS = float(os.getenv('JOB_LEASE_SECONDS', 60))
+# Как часто проверять очередь, если нет новых задач (задачи от других процессов)
+JOB_POLL_INTERVAL = float(os.getenv('JOB_POLL_INTERVAL', 1))
+# Сколько хранить выполненные задачи (дни)
+JOB_RETENTION_DAYS = float(os.getenv('JOB_RETENTION_DAYS', 7))
+
+JobHandler = Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]]
+
+
+class PermanentJobError(Exception):
+    """Ошибка, которую бессмысленно повторять (битый файл, удалённая вакансия)"""
+
+
+class JobQueue:
+    """
+    Очередь фоновых задач в SQLite
+
+    Задачи переживают перезапуск процесса: воркер берёт задачу в аренду и продлевает её,
+    пока работает. Аренду упавшего процесса забирает любой живой процесс.
+    Ошибки повторяются с экспоненциальной паузой до max_attempts раз.
+    """
+
+    def __init__(self, adb: AsyncDatabase, workers: int = JOB_WORKERS):
+        self.adb = adb
+        self.workers = workers
+        self.handlers: Dict[str, JobHandler] = {}
+        self._tasks: List[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._worker_prefix = f"{socket.gethostname()}:{os.getpid()}"
+        self.stats_counters = {"started": 0, "done": 0, "retried": 0, "failed": 0, "running": 0}
+
+    def register(self, kind: str, handler: JobHandler):
+        """Зарегистрировать обработчик задач вида kind"""
+        self.handlers[kind] = handler
+
+    async def enqueue(self, kind: str, user_id: str, payload: Dict[str, Any],
+                      data: bytes = None, max_attempts: int = JOB_MAX_ATTEMPTS) -> int:
+        """Поставить задачу в очередь, вернуть её ID"""
+        if kind not in self.handlers:
+            raise ValueError(f"Неизвестный вид задачи: {kind}")
+        job_id = await self.adb.create_job(kind, user_id, payload, data, max_attempts)
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return job_id
+
+    @staticmethod
+    def retry_delay(attempts: int) -> float:
+        """Пауза перед следующей попыткой (с разбросом, чтобы повторы не шли пачкой)"""
+        delay = min(JOB_RETRY_MAX_DELAY, JOB_RETRY_BASE_DELAY * 2 ** (attempts - 1))
+        return delay * random.uniform(0.5, 1.0)
+
+    async def start(self, workers: int = None):
+        """Запустить воркеры (при старте приложения)"""
+        if self._tasks:
+            return
+        self.workers = workers or self.workers
+        self._wakeup = asyncio.Event()
+        # Задачи, прерванные прошлым запуском, возвращаются в очередь
+        recovered = await self.adb.requeue_expired_jobs()
+        self._tasks = [
+            asyncio.create_task(self._worker(f"{self._worker_prefix}:{n}"))
+            for n in range(self.workers)
+        ]
+        self._tasks.append(asyncio.create_task(self._maintenance()))
+        print(f"✅ Очередь задач запущена (воркеров: {self.workers}, возвращено в очередь: {recovered})")
+
+    async def stop(self):
+        """Остановить воркеры: прерванные задачи вернутся в очередь"""
+        tasks, self._tasks = self._tasks, []
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _worker(self, worker_id: str):
+        while True:
+            self._wakeup.clear()
+            try:
+                job = await self.adb.claim_job(worker_id, JOB_LEASE_SECONDS)
+            except Exception as e:
+                print(f"⚠️ Очередь задач: не удалось взять задачу: {e}")
+                job = None
+            if job is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), JOB_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            try:
+                await self._run(job, worker_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Воркер не должен завершаться: задача вернётся в очередь по истечении аренды
+                print(f"❌ Очередь задач: ошибка при выполнении задачи {job['id']}: {e}")
+
+    async def _run(self, job: Dict[str, Any], worker_id: str):
+        """Выполнить задачу, продлевая аренду, и записать результат"""
+        self.stats_counters["started"] += 1
+        self.stats_counters["running"] += 1
+        work = asyncio.create_task(self._execute(job))
+        heartbeat = asyncio.create_task(self._heartbeat(job["id"], worker_id, work))
+        try:
+            result = await work
+        except asyncio.CancelledError:
+            if not self._lease_lost(heartbeat):
+                # Остановка приложения: задача вернётся в очередь без потери попытки
+                await asyncio.shield(self.adb.requeue_job(job["id"], worker_id))
+                raise
+            print(f"⚠️ Задача {job['id']} ({job['kind']}) прервана: аренду забрал другой воркер")
+        except Exception as e:
+            error = str(e) or e.__class__.__name__
+            if isinstance(e, PermanentJobError) or job["attempts"] >= job["max_attempts"]:
+                if await self._save(job, self.adb.fail_job(job["id"], worker_id, error)):
+                    self.stats_counters["failed"] += 1
+                    print(f"❌ Задача {job['id']} ({job['kind']}) провалена: {error}")
+            else:
+                retry_at = time.time() + self.retry_delay(job["attempts"])
+                if await self._save(job, self.adb.fail_job(job["id"], worker_id, error, retry_at=retry_at)):
+                    self.stats_counters["retried"] += 1
+        else:
+            if await self._save(job, self.adb.finish_job(job["id"], worker_id, result)):
+                self.stats_counters["done"] += 1
+        finally:
+            work.cancel()
+            heartbeat.cancel()
+            self.stats_counters["running"] -= 1
+
+    async def _execute(self, job: Dict[str, Any]) -> Dict[str, Any]:
+        handler = self.handlers.get(job["kind"])
+        if handler is None:
+            raise PermanentJobError(f"Неизвестный вид задачи: {job['kind']}")
+        return await handler(job)
+
+    @staticmethod
+    async def _save(job: Dict[str, Any], write: Awaitable[bool]) -> bool:
+        """Записать итог задачи. Ошибка записи не останавливает воркер: задача вернётся в очередь по аренде"""
+        try:
+            if await write:
+                return True
+            print(f"⚠️ Задача {job['id']} ({job['kind']}): итог не записан, аренду забрал другой воркер")
+        except Exception as e:
+            print(f"❌ Задача {job['id']} ({job['kind']}): не удалось записать итог: {e}")
+        return False
+
+    async def _heartbeat(self, job_id: int, worker_id: str, work: asyncio.Task) -> bool:
+        """Продлевать аренду задачи, пока она выполняется; аренду забрали — прервать обработчик"""
+        while True:
+            await asyncio.sleep(JOB_LEASE_SECONDS / 3)
+            try:
+                renewed = await self.adb.update_job_lease(job_id, worker_id, JOB_LEASE_SECONDS)
+            except Exception as e:
+                print(f"⚠️ Задача {job_id}: не удалось продлить аренду: {e}")
+                continue
+            if not renewed:
+                work.cancel()
+                return True
+
+    @staticmethod
+    def _lease_lost(heartbeat: asyncio.Task) -> bool:
+        return heartbeat.done() and not heartbeat.cancelled() and heartbeat.result()
+
+    async def _maintenance(self):
+        """Забирать задачи упавших процессов и чистить старые выполненные"""
+        while True:
+            await asyncio.sleep(JOB_LEASE_SECONDS / 2)
+            try:
+                if await self.adb.requeue_expired_jobs():
+                    self._wakeup.set()
+                await self.adb.delete_finished_jobs(JOB_RETENTION_DAYS * 86400)
+            except Exception as e:
+                print(f"⚠️ Обслуживание очереди задач: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {"workers": self.workers if self._tasks else 0, **self.stats_counters}
+
+
+# Глобальная очередь задач
+job_queue = JobQueue(adb)
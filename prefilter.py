@@ -0,0 +1,99 @@
+import os
+import re
+from typing import Dict, List, NamedTuple
+
+import numpy as np
+
+# Предварительный отсев резюме без запроса к OpenAI (можно переопределить через .env)
+PREFILTER_ENABLED = os.getenv('PREFILTER_ENABLED', '1') == '1'
+# Доля терминов критериев, которая должна встретиться в резюме, чтобы его анализировала модель
+PREFILTER_MIN_COVERAGE = float(os.getenv('PREFILTER_MIN_COVERAGE', 0.15))
+# Если в критериях меньше терминов, отсев не применяем (слишком мало сигнала)
+PREFILTER_MIN_TERMS = int(os.getenv('PREFILTER_MIN_TERMS', 3))
+
+# Параметры BM25
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Слова критериев, которые не говорят о навыках
+STOPWORDS = frozenset('''
+и в во на с со к по о об от до за из у для при без не но а или либо что как это
+быть опыт опыта опытом знание знания знанием умение умения навык навыки навыков
+работа работы работе год года лет обязательно желательно плюсом будет приветствуется
+хорошее хорошие хороший уровень уровне понимание требования требуется кандидат
+кандидата вакансии должен должна можно также более менее ниже оцени оценить
+and or the of in with for to a an on at is are be experience knowledge years
+'''.split())
+
+# Слово: буквы, цифры и символы из названий технологий (c++, c#, node.js)
+WORD_RE = re.compile(r"[a-zа-яё0-9][a-zа-яё0-9+#.]*", re.IGNORECASE)
+# Термин критериев должен содержать букву: «3+» и «2020» не термины
+LETTER_RE = re.compile(r"[a-zа-яё]")
+
+# Грубый стемминг: начала слов одинаковой длины («разработка» и «разработчик»)
+STEM_LENGTH = 6
+
+
+class PrefilterScores(NamedTuple):
+    """Оценки резюме по терминам критериев"""
+    terms: List[str]
+    coverage: np.ndarray   # доля терминов критериев, встретившихся в резюме (0..1)
+    matched: np.ndarray    # сколько терминов встретилось
+    bm25: np.ndarray       # BM25 по всей пачке резюме — для ранжирования
+
+
+def tokenize(text: str) -> List[str]:
+    """Слова текста в нижнем регистре, приведённые к основе"""
+    return [word.rstrip('.')[:STEM_LENGTH] for word in WORD_RE.findall((text or '').lower().replace('ё', 'е'))]
+
+
+def criteria_terms(criteria: str) -> List[str]:
+    """Уникальные термины критериев вакансии без служебных слов и чисел"""
+    terms = []
+    for word in WORD_RE.findall((criteria or '').lower().replace('ё', 'е')):
+        word = word.rstrip('.')
+        if len(word) < 2 or word in STOPWORDS or not LETTER_RE.search(word):
+            continue
+        stem = word[:STEM_LENGTH]
+        if stem not in terms:
+            terms.append(stem)
+    return terms
+
+
+def score_resumes(resume_texts: List[str], criteria: str) -> PrefilterScores:
+    """
+    Оценить пачку резюме по критериям вакансии одной матричной операцией
+
+    Словарь — только термины критериев, поэтому матрица частот (резюме × термины) маленькая
+    и плотная, а основное время уходит на разбиение текста на слова.
+    """
+    terms = criteria_terms(criteria)
+    vocabulary: Dict[str, int] = {term: i for i, term in enumerate(terms)}
+    tf = np.zeros((len(resume_texts), len(terms)), dtype=np.float32)
+    lengths = np.zeros(len(resume_texts), dtype=np.float32)
+
+    for row, text in enumerate(resume_texts):
+        tokens = tokenize(text)
+        lengths[row] = len(tokens)
+        ids = [vocabulary[token] for token in tokens if token in vocabulary]
+        if ids:
+            tf[row] = np.bincount(ids, minlength=len(terms))
+
+    present = tf > 0
+    matched = present.sum(axis=1)
+    coverage = matched / len(terms) if terms else np.ones(len(resume_texts), dtype=np.float32)
+
+    documents = max(len(resume_texts), 1)
+    df = present.sum(axis=0)
+    idf = np.log1p((documents - df + 0.5) / (df + 0.5))
+    norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths / max(float(lengths.mean()) if len(lengths) else 0.0, 1.0))
+    bm25 = (idf * tf * (BM25_K1 + 1) / (tf + norm[:, None])).sum(axis=1)
+
+    return PrefilterScores(terms, coverage, matched, bm25)
+
+
+def prefilter_mask(scores: PrefilterScores, min_coverage: float = PREFILTER_MIN_COVERAGE) -> np.ndarray:
+    """True для резюме, которые можно отсеять без модели"""
+    if not PREFILTER_ENABLED or len(scores.terms) < PREFILTER_MIN_TERMS:
+        return np.zeros(len(scores.coverage), dtype=bool)
+    return scores.coverage < min_coverage
@@ -0,0 +1,39 @@
+"""
+Прогрев кэша профилей вакансий (например, после деплоя или смены модели)
+
+Запуск:
+    python prewarm.py [--top 50]
+    python prewarm.py --title "Python Developer" --title "Менеджер по продажам"
+"""
+import asyncio
+import argparse
+
+from ai_analyzer import prewarm_vacancy_profiles, close_async_client, VACANCY_PROFILE_PREWARM_TOP
+from async_database import adb
+
+
+async def run(top: int, titles=None):
+    try:
+        summary = await prewarm_vacancy_profiles(top, titles=titles)
+    finally:
+        await close_async_client()
+    print(f"✅ Загружено в память: {summary['loaded']}, уже в кэше: {summary['cached']}, "
+          f"сгенерировано: {summary['generated']}, ошибок: {summary['errors']}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Прогрев кэша профилей вакансий")
+    parser.add_argument("--top", type=int, default=VACANCY_PROFILE_PREWARM_TOP,
+                        help="Сколько самых частых названий подготовить")
+    parser.add_argument("--title", action="append", dest="titles",
+                        help="Подготовить профиль для этого названия (можно несколько раз)")
+    args = parser.parse_args(argv)
+
+    try:
+        asyncio.run(run(args.top, args.titles))
+    finally:
+        adb.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+import os
+import time
+import asyncio
+from collections import OrderedDict, deque
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Any, Deque, Dict, Optional
+
+# Лимиты внешних API: запросов в секунду и размер «пачки» (можно переопределить через .env)
+HH_RATE_LIMIT = float(os.getenv('HH_RATE_LIMIT', 10))
+HH_RATE_BURST = int(os.getenv('HH_RATE_BURST', 20))
+OPENAI_RATE_LIMIT = float(os.getenv('OPENAI_RATE_LIMIT', 8))
+OPENAI_RATE_BURST = int(os.getenv('OPENAI_RATE_BURST', 16))
+# Отправка писем: у каждого почтового провайдера свой лимит
+EMAIL_RATE_LIMITS = {
+    'google': (float(os.getenv('EMAIL_RATE_LIMIT_GOOGLE', 5)), int(os.getenv('EMAIL_RATE_BURST_GOOGLE', 10))),
+    'yandex': (float(os.getenv('EMAIL_RATE_LIMIT_YANDEX', 2)), int(os.getenv('EMAIL_RATE_BURST_YANDEX', 5))),
+    'mailru': (float(os.getenv('EMAIL_RATE_LIMIT_MAILRU', 2)), int(os.getenv('EMAIL_RATE_BURST_MAILRU', 5))),
+}
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Retry-After в секундах (заголовок бывает числом или HTTP-датой)"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+class RateLimiter:
+    """
+    Token bucket для внешнего API со справедливой очередью
+
+    Запросы ждут в очереди своего ключа (user_id), очереди обслуживаются по кругу:
+    пакет из 500 резюме одного рекрутера не задерживает одиночные запросы остальных.
+    """
+
+    def __init__(self, name: str, rate: float, burst: int):
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._queues: "OrderedDict[str, Deque[asyncio.Future]]" = OrderedDict()
+        self._dispatcher: Optional[asyncio.Task] = None
+        self.stats_counters = {"granted": 0, "queued": 0, "throttled": 0, "total_wait": 0.0, "max_wait": 0.0}
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _record_wait(self, waited: float):
+        self.stats_counters["granted"] += 1
+        self.stats_counters["total_wait"] += waited
+        self.stats_counters["max_wait"] = max(self.stats_counters["max_wait"], waited)
+
+    async def acquire(self, key: Optional[str] = None):
+        """Дождаться разрешения на один запрос"""
+        key = str(key or 'default')
+        self._refill()
+        if not self._queues and self._tokens >= 1 and time.monotonic() >= self._paused_until:
+            self._tokens -= 1
+            self._record_wait(0.0)
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        enqueued_at = time.monotonic()
+        self._queues.setdefault(key, deque()).append(future)
+        self.stats_counters["queued"] += 1
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+
+        try:
+            await future
+        except asyncio.CancelledError:
+            queue = self._queues.get(key)
+            if queue is not None and future in queue:
+                queue.remove(future)
+                if not queue:
+                    del self._queues[key]
+            raise
+        self._record_wait(time.monotonic() - enqueued_at)
+
+    async def _dispatch(self):
+        """Выдаёт токены ожидающим: по одному из каждой очереди по кругу"""
+        while self._queues:
+            now = time.monotonic()
+            if now < self._paused_until:
+                await asyncio.sleep(self._paused_until - now)
+                continue
+
+            self._refill()
+            if self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+                continue
+
+            key, queue = next(iter(self._queues.items()))
+            future = queue.popleft()
+            if queue:
+                self._queues.move_to_end(key)
+            else:
+                del self._queues[key]
+
+            if not future.done():
+                self._tokens -= 1
+                future.set_result(None)
+
+    def pause(self, seconds: float):
+        """Не выдавать токены seconds секунд (ответ 429 с Retry-After)"""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0.0
+        self.stats_counters["throttled"] += 1
+
+    def observe(self, status_code: int, headers: Any) -> Optional[float]:
+        """Учесть ответ API: при 429/503 с Retry-After приостановить выдачу, вернуть паузу"""
+        if status_code not in (429, 503):
+            return None
+        delay = parse_retry_after(headers.get("retry-after") if headers is not None else None)
+        if delay is None and status_code == 429:
+            delay = 1.0
+        if delay is not None:
+            self.pause(delay)
+        return delay
+
+    def queue_depth(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    def stats(self) -> Dict[str, Any]:
+        counters = self.stats_counters
+        granted = counters["granted"]
+        return {
+            "rate": self.rate,
+            "burst": self.burst,
+            "queue_depth": self.queue_depth(),
+            "users_waiting": len(self._queues),
+            "granted": granted,
+            "queued": counters["queued"],
+            "throttled": counters["throttled"],
+            "avg_wait_ms": round(counters["total_wait"] / granted * 1000, 1) if granted else 0.0,
+            "max_wait_ms": round(counters["max_wait"] * 1000, 1),
+            "paused_for": round(max(0.0, self._paused_until - time.monotonic()), 1)
+        }
+
+
+# Лимитеры внешних API
+hh_limiter = RateLimiter('hh', HH_RATE_LIMIT, HH_RATE_BURST)
+openai_limiter = RateLimiter('openai', OPENAI_RATE_LIMIT, OPENAI_RATE_BURST)
+
+email_limiters = {
+    provider: RateLimiter(f'email_{provider}', rate, burst)
+    for provider, (rate, burst) in EMAIL_RATE_LIMITS.items()
+}
+
+limiters = {limiter.name: limiter for limiter in (hh_limiter, openai_limiter, *email_limiters.values())}
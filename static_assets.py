@@ -0,0 +1,173 @@
+import os
+import gzip
+import hashlib
+import mimetypes
+import threading
+from typing import Dict, List, NamedTuple, Optional
+
+from fastapi import Request
+from fastapi.responses import Response
+
+# Brotli работает только если установлен пакет brotli (pip install brotli), иначе только gzip
+try:
+    import brotli
+    BROTLI_AVAILABLE = True
+except ImportError:
+    brotli = None
+    BROTLI_AVAILABLE = False
+
+STATIC_DIR = os.getenv('STATIC_DIR', 'static')
+# Файлы меньше этого размера (байты) не сжимаем: выигрыш меньше заголовков
+STATIC_COMPRESS_MIN_SIZE = int(os.getenv('STATIC_COMPRESS_MIN_SIZE', 512))
+# HTML перепроверяется при каждом открытии: при неизменном файле ответ 304 без тела,
+# а новая версия приходит сразу после деплоя
+HTML_CACHE_CONTROL = os.getenv('HTML_CACHE_CONTROL', 'no-cache')
+
+# Порядок предпочтения сжатия при равном q в Accept-Encoding
+ENCODINGS = ('br', 'gzip', 'identity')
+
+
+class StaticAsset(NamedTuple):
+    """Файл в памяти со сжатыми вариантами"""
+    media_type: str
+    digest: str                  # sha256 содержимого (начало) — основа ETag
+    variants: Dict[str, bytes]   # кодировка ('identity', 'gzip', 'br') → тело ответа
+
+    def etag(self, encoding: str) -> str:
+        return f'"{self.digest}"' if encoding == 'identity' else f'"{self.digest}-{encoding}"'
+
+
+def parse_accept_encoding(header: Optional[str]) -> Dict[str, float]:
+    """Accept-Encoding в словарь кодировка → q"""
+    weights = {}
+    for part in (header or '').split(','):
+        name, _, params = part.strip().partition(';')
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        weights[name] = q
+    return weights
+
+
+def choose_encoding(accept_encoding: Optional[str], available: List[str]) -> str:
+    """Лучшая кодировка из доступных, которую принимает клиент"""
+    weights = parse_accept_encoding(accept_encoding)
+    best, best_q = 'identity', 0.0
+    for encoding in ENCODINGS:
+        if encoding not in available:
+            continue
+        # Без упоминания в заголовке: identity допустим всегда, сжатие — только по «*»
+        q = weights.get(encoding, weights.get('*', 1.0 if encoding == 'identity' else 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def build_asset(content: bytes, media_type: str) -> StaticAsset:
+    """Посчитать ETag и сжатые варианты файла"""
+    variants = {'identity': content}
+    if len(content) >= STATIC_COMPRESS_MIN_SIZE:
+        # mtime=0: одинаковый файл — одинаковые байты gzip после каждого запуска
+        compressed = gzip.compress(content, compresslevel=9, mtime=0)
+        if len(compressed) < len(content):
+            variants['gzip'] = compressed
+        if BROTLI_AVAILABLE:
+            compressed = brotli.compress(content, quality=11)
+            if len(compressed) < len(content):
+                variants['br'] = compressed
+    return StaticAsset(media_type, hashlib.sha256(content).hexdigest()[:32], variants)
+
+
+class StaticAssets:
+    """
+    Страницы Mini App из памяти
+
+    Файлы читаются и сжимаются один раз при старте (gzip и, если есть пакет, brotli).
+    Ответ выбирается по Accept-Encoding, ETag — хэш содержимого, повторное открытие
+    страницы с If-None-Match получает 304 без тела.
+    """
+
+    def __init__(self, directory: str = STATIC_DIR):
+        self.directory = directory
+        self.assets: Dict[str, StaticAsset] = {}
+        self._lock = threading.Lock()
+        self.stats_counters = {"responses": 0, "not_modified": 0, "bytes_sent": 0,
+                               "identity": 0, "gzip": 0, "br": 0}
+
+    def load(self) -> int:
+        """Прочитать и сжать все файлы каталога, вернуть их число"""
+        assets = {}
+        for name in sorted(os.listdir(self.directory)):
+            path = os.path.join(self.directory, name)
+            if not os.path.isfile(path):
+                continue
+            with open(path, 'rb') as f:
+                content = f.read()
+            # charset=utf-8 для text/* Starlette добавит сам
+            media_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+            assets[name] = build_asset(content, media_type)
+        with self._lock:
+            self.assets = assets
+        return len(assets)
+
+    def get(self, name: str) -> StaticAsset:
+        asset = self.assets.get(name)
+        if asset is None:
+            # Файлы могли не загрузить при старте (приложение без lifespan)
+            with self._lock:
+                if not self.assets:
+                    self.load()
+            asset = self.assets.get(name)
+        if asset is None:
+            raise FileNotFoundError(name)
+        return asset
+
+    def response(self, request: Request, name: str) -> Response:
+        """Ответ с файлом: сжатый вариант по Accept-Encoding или 304 по If-None-Match"""
+        asset = self.get(name)
+        encoding = choose_encoding(request.headers.get('accept-encoding'), list(asset.variants))
+        headers = {
+            'ETag': asset.etag(encoding),
+            'Cache-Control': HTML_CACHE_CONTROL,
+            'Vary': 'Accept-Encoding',
+        }
+
+        if_none_match = request.headers.get('if-none-match')
+        if if_none_match:
+            # Любой вариант того же содержимого подходит (сравнение ETag «weak»)
+            known = {asset.etag(variant) for variant in asset.variants}
+            tags = {tag.strip().removeprefix('W/') for tag in if_none_match.split(',')}
+            if '*' in tags or tags & known:
+                self.stats_counters["not_modified"] += 1
+                return Response(status_code=304, headers=headers)
+
+        if encoding != 'identity':
+            headers['Content-Encoding'] = encoding
+        body = asset.variants[encoding]
+        self.stats_counters["responses"] += 1
+        self.stats_counters[encoding] += 1
+        self.stats_counters["bytes_sent"] += len(body)
+        return Response(body, media_type=asset.media_type, headers=headers)
+
+    def stats(self) -> Dict[str, object]:
+        sizes = {encoding: 0 for encoding in ENCODINGS}
+        for asset in self.assets.values():
+            for encoding, body in asset.variants.items():
+                sizes[encoding] += len(body)
+        return {
+            "files": len(self.assets),
+            "brotli": BROTLI_AVAILABLE,
+            "size_bytes": sizes,
+            **self.stats_counters
+        }
+
+
+# Глобальное хранилище страниц Mini App
+static_assets = StaticAssets()
@@ -0,0 +1,9 @@
+import os
+import sys
+import tempfile
+
+# Модули приложения лежат в корне репозитория
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# database создаёт глобальный экземпляр при импорте — не трогаем рабочую базу
+os.environ.setdefault('DB_FILE', os.path.join(tempfile.mkdtemp(), 'hr_assistant_test.db'))
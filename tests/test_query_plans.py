@@ -0,0 +1,55 @@
+"""Горячие запросы обязаны идти по индексам (EXPLAIN QUERY PLAN) без сортировки во временном B-дереве"""
+import pytest
+
+from database import Database
+
+CANDIDATES_PAGE = ("SELECT id, created_at, full_name FROM candidates WHERE {where} "
+                   "ORDER BY created_at DESC, id DESC LIMIT ?")
+
+# (название, запрос, параметры, индекс, который должен быть в плане)
+HOT_QUERIES = [
+    ("get_all_candidates(user_id, vacancy_id)",
+     "SELECT * FROM candidates WHERE user_id = ? AND vacancy_id = ? ORDER BY created_at DESC",
+     ("u", 1), "idx_candidates_user_vacancy_created"),
+    ("get_all_candidates(user_id)",
+     "SELECT * FROM candidates WHERE user_id = ? ORDER BY created_at DESC",
+     ("u",), "idx_candidates_user_created"),
+    ("get_candidates_page: первая страница",
+     CANDIDATES_PAGE.format(where="user_id = ? AND vacancy_id = ?"),
+     ("u", 1, 100), "idx_candidates_user_vacancy_created"),
+    ("get_candidates_page: следующая страница",
+     CANDIDATES_PAGE.format(where="user_id = ? AND vacancy_id = ? AND (created_at, id) < (?, ?)"),
+     ("u", 1, "2024-01-01 00:00:00", 10, 100), "idx_candidates_user_vacancy_created"),
+    ("get_candidates_page: все вакансии, следующая страница",
+     CANDIDATES_PAGE.format(where="user_id = ? AND (created_at, id) < (?, ?)"),
+     ("u", "2024-01-01 00:00:00", 10, 100), "idx_candidates_user_created"),
+    ("get_all_vacancies(user_id)",
+     "SELECT * FROM vacancies WHERE user_id = ? ORDER BY created_at DESC",
+     ("u",), "idx_vacancies_user_created"),
+    ("get_dashboard_stats: подходящие",
+     "SELECT COUNT(*) FROM candidates WHERE user_id = ? AND verdict = 'Подходит'",
+     ("u",), "idx_candidates_user_verdict"),
+    ("get_dashboard_overview: кандидаты по вакансиям",
+     "SELECT vacancy_id, COUNT(*), SUM(verdict = 'Подходит') FROM candidates WHERE user_id = ? GROUP BY vacancy_id",
+     ("u",), "COVERING INDEX idx_candidates_user_vacancy_verdict"),
+    ("claim_job: следующая задача",
+     "SELECT id FROM jobs WHERE status = 'queued' AND run_at <= ? ORDER BY run_at LIMIT 1",
+     (0,), "idx_jobs_status_run_at"),
+    ("claim_email: следующее письмо",
+     "SELECT id FROM email_outbox WHERE status = 'queued' AND run_at <= ? ORDER BY run_at LIMIT 1",
+     (0,), "idx_email_outbox_status_run_at"),
+]
+
+
+@pytest.fixture(scope="module")
+def database(tmp_path_factory):
+    database = Database(str(tmp_path_factory.mktemp("plans") / "plans.db"))
+    yield database
+    database.close()
+
+
+@pytest.mark.parametrize("name, query, params, index", HOT_QUERIES, ids=[q[0] for q in HOT_QUERIES])
+def test_hot_query_uses_index(database, name, query, params, index):
+    plan = database.explain_query_plan(query, params)
+    assert any(index in detail for detail in plan), plan
+    assert not any("TEMP B-TREE" in detail for detail in plan), plan